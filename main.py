@@ -1,4 +1,9 @@
 import subprocess
+import sys
 
 if __name__ == "__main__":
-    subprocess.run(["streamlit", "run", "ui/app.py"])
+    if len(sys.argv) > 1 and sys.argv[1] == "api":
+        # HTTP /chat service (graph.ainvoke)
+        subprocess.run([sys.executable, "-m", "server.app"])
+    else:
+        subprocess.run(["streamlit", "run", "ui/app.py"])
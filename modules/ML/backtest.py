@@ -1,60 +1,193 @@
+"""
+Backtest walk-forward cho model gap (SARIMAX log-return phiên kế tiếp).
+
+- Lấy dữ liệu 1 lần: close (kho OHLCV) + exog tin tức (1 lượt build_news_features),
+  cắt cửa sổ train/test trong RAM; không ghi model ra đĩa.
+- Chỉ giữ các phiên giao dịch thật (có nến trong kho OHLCV): dòng ffill cuối tuần / nghỉ lễ
+  có return = 0 sẽ làm đẹp giả direction accuracy và pha loãng RMSE / MAE -> bỏ khỏi cả
+  cửa sổ train lẫn fold test.
+- Bậc (p, d, q) / trend: truyền cố định, "saved" (theo model gap đã lưu), hoặc chọn 1 lần
+  trên cửa sổ train của fold đầu (không nhìn trước dữ liệu test) rồi cache.
+- Các fold chia thành từng dãy liên tiếp cho process pool (tham số workers, mặc định ARIMA_WORKERS); mọi fold khởi động
+  từ tham số fit trên cửa sổ đầu -> kết quả như nhau với mọi số worker.
+- RMSE / MAE / directional accuracy tính vector hoá trên toàn bộ dự báo ở cuối.
+"""
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple, Union
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from modules.api.stock_api import get_close_series
-from modules.ML.pipeline import train_gap_model
-
-
-def backtest_gap_model(symbol, test_days=60):
-
-    # lấy dữ liệu giá
-    close = get_close_series(symbol, days=365 + test_days)
-
-    # returns
-    r = np.log(close / close.shift(1)).dropna()
-
-    preds = []
-    actuals = []
-    dates = []
-
-    for i in range(len(r) - test_days, len(r)):
-
-        train_r = r.iloc[:i]
-
-        fit, meta, report = train_gap_model(symbol)
-
-        pred = report["ret_hat_next"]
-
-        actual = r.iloc[i]
-
-        preds.append(pred)
-        actuals.append(actual)
-        dates.append(r.index[i])
+from modules.api.stock_api import get_close_series, ohlcv_store
+from modules.ML.metrics import summarize
+from modules.ML.pipeline import _align_exog_to_y, _standardize_df, _to_returns
+from modules.ML.predictors.sarimax_exog import (
+    ARIMA_CANDIDATE_TIMEOUT,
+    ARIMA_WORKERS,
+    _fit_one,
+    arima_select_fit,
+    forecast_folds,
+    get_fit_pool,
+    reset_fit_pool,
+)
+from modules.ML.registry import load_meta
+
+# (symbol, ngày cuối cửa sổ đầu, độ dài cửa sổ, có exog[, order, trend]) -> (order, trend, params)
+_order_cache: Dict[tuple, tuple] = {}
+
+
+def _session_mask(symbol: str, index: pd.Index) -> np.ndarray:
+    """True ở dòng là phiên giao dịch (có nến trong kho OHLCV); kho lỗi -> chỉ bỏ thứ 7 / CN."""
+    idx = pd.DatetimeIndex(index).tz_localize(None).normalize()
+    try:
+        bars = ohlcv_store.history(symbol, idx[0].date(), idx[-1].date())
+        if bars is not None and not bars.empty:
+            return np.asarray(idx.isin(pd.DatetimeIndex(bars.index).normalize()))
+    except Exception as e:
+        print(f"[Backtest] {symbol}: không đọc được lịch phiên từ kho OHLCV ({e}) -> bỏ cuối tuần")
+    return np.asarray(idx.dayofweek < 5)
+
+
+def _resolve_order(symbol: str, r: pd.Series, X: Optional[pd.DataFrame], first: int,
+                   order: Union[None, str, Tuple[int, int, int]], trend: Optional[str]):
+    """(order, trend, params fit trên cửa sổ train đầu tiên) — params dùng làm start_params cho mọi fold."""
+    # ndarray: chỉ cần params, và index phiên (không có freq) khỏi làm statsmodels cảnh báo
+    X_std = _standardize_df(X.iloc[:first])[0].to_numpy(dtype="float64") if X is not None else None
+    y0 = r.iloc[:first].to_numpy(dtype="float64")
+
+    if order == "saved":
+        meta = load_meta(symbol, "gap")
+        if meta and meta.get("order"):
+            order, trend = tuple(meta["order"]), meta.get("trend", "n")
+        else:
+            print(f"[Backtest] {symbol}: chưa có model gap đã lưu -> chọn bậc trên cửa sổ train")
+            order = None
+
+    if order is not None:
+        order, trend = tuple(order), trend or "n"
+        key = (symbol, r.index[first - 1], first, X is not None, order, trend)
+        if key not in _order_cache:
+            fit = _fit_one(y0, order, trend, exog=X_std, timeout=ARIMA_CANDIDATE_TIMEOUT)
+            _order_cache[key] = (order, trend, np.asarray(fit.params, dtype="float64"))
+        return _order_cache[key]
+
+    key = (symbol, r.index[first - 1], first, X is not None)
+    if key not in _order_cache:
+        fit, o, tr = arima_select_fit(y0, d=0, max_p=3, max_q=3, trends=("n", "c"), exog=X_std)
+        _order_cache[key] = (tuple(o), tr, np.asarray(fit.params, dtype="float64"))
+    return _order_cache[key]
+
+
+def _run_folds(y: np.ndarray, X: Optional[np.ndarray], order, trend, params: np.ndarray,
+               first: int, window: int, refit_every: int, workers: int) -> np.ndarray:
+    folds = list(range(first, len(y)))
+    preds = np.full(len(folds), np.nan)
+    args = (y, X, order, trend)
+    kw = {"window": window, "first": first, "start_params": params,
+          "refit_every": refit_every, "timeout": ARIMA_CANDIDATE_TIMEOUT}
+
+    if workers <= 1 or len(folds) <= 1:
+        results = forecast_folds(*args, folds, **kw)
+    else:
+        # Chia theo khối refit_every fold để mỗi dãy giao cho worker bắt đầu bằng 1 lần ước lượng
+        step = max(1, refit_every)
+        blocks = [folds[k:k + step] for k in range(0, len(folds), step)]
+        groups = np.array_split(np.arange(len(blocks)), min(workers, len(blocks)))
+        chunks = [[i for b in g for i in blocks[b]] for g in groups if len(g)]
+        try:
+            pool = get_fit_pool(workers)
+            futs = [pool.submit(forecast_folds, *args, c, **kw) for c in chunks]
+            results = [item for f in futs for item in f.result()]
+        except BrokenProcessPool as e:
+            print(f"[Backtest] Process pool hỏng ({e}) -> chạy tuần tự")
+            reset_fit_pool()
+            results = forecast_folds(*args, folds, **kw)
+
+    for i, pred in results:
+        preds[i - first] = pred
+    return preds
+
+
+def backtest_gap_model(symbol: str,
+                       test_days: int = 60,
+                       lookback_days: int = 365,
+                       order: Union[None, str, Tuple[int, int, int]] = None,
+                       trend: Optional[str] = None,
+                       use_exog: bool = True,
+                       refit_every: int = 1,
+                       workers: Optional[int] = None,
+                       add_index: Optional[List[str]] = None,
+                       verbose: bool = True) -> pd.DataFrame:
+    """
+    Walk-forward: với mỗi phiên i trong test_days phiên cuối, fit trên cửa sổ trượt các return
+    trước i (cùng độ dài cửa sổ train của fold đầu) rồi dự báo return phiên i.
+    Return tính giữa 2 phiên liên tiếp (bỏ dòng ffill ngày nghỉ).
+    Trả DataFrame index=date, cột pred / actual; df.attrs["metrics"] chứa rmse / mae / direction_acc.
+    """
+    sym = symbol.upper()
+    t0 = time.perf_counter()
+
+    # 1 lần lấy dữ liệu cho mọi fold (test_days tính theo phiên -> lấy dư ngày lịch cho cuối tuần / lễ)
+    close = get_close_series(sym, days=lookback_days + test_days * 7 // 5 + 14)
+    r = _to_returns(close)
+
+    X = None
+    if use_exog:
+        # Căn exog trên chuỗi ngày lịch (giống lúc train model gap) rồi mới lọc phiên
+        X_raw = _align_exog_to_y(sym, r, add_index=add_index or ["VNINDEX", "VN30"], shift=1)
+        if not X_raw.empty and np.abs(X_raw.values).sum() > 0:
+            X = X_raw
+
+    sessions = _session_mask(sym, r.index)
+    dropped = int(len(r) - sessions.sum())
+    r = r[sessions]
+    if X is not None:
+        X = X[sessions]
+    first = len(r) - test_days
+    if first < 30:
+        raise ValueError("Không đủ dữ liệu returns để backtest.")
+    t_data = time.perf_counter() - t0
+
+    order, trend, params = _resolve_order(sym, r, X, first, order, trend)
+    t_order = time.perf_counter() - t0 - t_data
+
+    workers = ARIMA_WORKERS if workers is None else int(workers)
+    preds = _run_folds(
+        r.to_numpy(dtype="float64"),
+        None if X is None else X.to_numpy(dtype="float64"),
+        order, trend, params, first, window=first, refit_every=refit_every, workers=workers,
+    )
 
     df = pd.DataFrame({
-        "date": dates,
+        "date": r.index[first:],
         "pred": preds,
-        "actual": actuals
+        "actual": r.to_numpy(dtype="float64")[first:],
     }).set_index("date")
 
-    # RMSE
-    rmse = np.sqrt(np.mean((df["pred"] - df["actual"]) ** 2))
-
-    # MAE
-    mae = np.mean(np.abs(df["pred"] - df["actual"]))
-
-    # Directional accuracy
-    dir_pred = np.sign(df["pred"])
-    dir_actual = np.sign(df["actual"])
-
-    direction_acc = (dir_pred == dir_actual).mean()
-
-    print("\n===== BACKTEST RESULT =====")
-
-    print("RMSE:", rmse)
-    print("MAE:", mae)
-    print("Directional accuracy:", direction_acc)
+    metrics = summarize(df["actual"].to_numpy(), df["pred"].to_numpy())
+    metrics.update({
+        "symbol": sym,
+        "order": list(order),
+        "trend": trend,
+        "use_exog": X is not None,
+        "folds": len(df),
+        "failed_folds": int(df["pred"].isna().sum()),
+        "non_session_rows_dropped": dropped,
+        "data_sec": round(t_data, 2),
+        "order_sec": round(t_order, 2),
+        "total_sec": round(time.perf_counter() - t0, 2),
+    })
+    df.attrs["metrics"] = metrics
+
+    if verbose:
+        print("\n===== BACKTEST RESULT =====")
+        print(f"{sym} order={tuple(order)} trend={trend} exog={X is not None} folds={len(df)}")
+        print("RMSE:", metrics["rmse"])
+        print("MAE:", metrics["mae"])
+        print("Directional accuracy:", metrics["direction_acc"])
+        print(f"Thời gian: {metrics['total_sec']}s (dữ liệu {metrics['data_sec']}s, chọn bậc {metrics['order_sec']}s)")
 
     return df
 
@@ -68,4 +201,4 @@ def plot_prediction(df):
     plt.legend()
     plt.title("Predicted vs Actual Returns")
 
-    plt.show()
\ No newline at end of file
+    plt.show()
@@ -0,0 +1,256 @@
+"""
+Train model gap hàng loạt cho cả universe, chạy ngoài giờ giao dịch để model sẵn sàng trước
+giờ mở cửa (thay vì user đầu tiên hỏi 1 mã phải chờ forecast_gap grid search).
+
+- Universe (TRAIN_UNIVERSE): nhóm / sàn / mã lẻ như "VN30", "VN100", "HOSE", "FPT,VCB"
+  (giải qua resolve_symbols), hoặc "@đường/dẫn/file.txt" (mã cách nhau bởi dòng / dấu phẩy).
+- Mỗi mã train trong 1 process con riêng (grid SARIMAX tuần tự), tối đa TRAIN_WORKERS process cùng lúc;
+  quá TRAIN_SYMBOL_TIMEOUT giây -> kill process, ghi "timeout".
+- Checkpoint <MODELS_DIR>/_batch_train.json ghi lại sau từng mã, run_id = phiên mục tiêu:
+  chạy lại cùng run_id (job chết giữa chừng) -> bỏ qua mã đã train xong.
+- Summary (thời gian fit, AIC, order/trend, mã lỗi / timeout) ghi vào checkpoint và trả về.
+
+CLI:  python -m modules.ML.batch_train --universe VN30 --workers 2
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from multiprocessing.connection import wait as wait_conns
+from typing import Dict, List, Optional
+
+from modules.ML.registry import MODELS_DIR
+
+TRAIN_UNIVERSE = os.getenv("TRAIN_UNIVERSE", "VN30")
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", 2))
+TRAIN_SYMBOL_TIMEOUT = float(os.getenv("TRAIN_SYMBOL_TIMEOUT", 600))
+TRAIN_LOOKBACK_DAYS = int(os.getenv("TRAIN_LOOKBACK_DAYS", 365))
+TRAIN_CHECKPOINT = os.getenv("TRAIN_CHECKPOINT", os.path.join(MODELS_DIR, "_batch_train.json"))
+
+
+def resolve_universe(spec: str) -> List[str]:
+    spec = (spec or "").strip()
+    if spec.startswith("@"):
+        with open(spec[1:], "r", encoding="utf-8") as f:
+            raw = f.read().replace("\n", ",")
+        return list(dict.fromkeys(t.strip().upper() for t in raw.split(",") if t.strip()))
+
+    from modules.api.stock_api import resolve_symbols
+    return resolve_symbols(spec)
+
+
+# ====== Checkpoint ======
+def load_checkpoint(path: str = TRAIN_CHECKPOINT) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_checkpoint(ckpt: Dict, path: str = TRAIN_CHECKPOINT):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(ckpt, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _summarize(results: Dict[str, Dict], symbols: List[str]) -> Dict:
+    ok = {s: r for s, r in results.items() if s in symbols and r.get("status") == "ok"}
+    secs = sorted(r["sec"] for r in ok.values())
+    summary = {
+        "symbols": len(symbols),
+        "ok": len(ok),
+        "errors": sorted(s for s in symbols if results.get(s, {}).get("status") == "error"),
+        "timeouts": sorted(s for s in symbols if results.get(s, {}).get("status") == "timeout"),
+        "pending": sorted(s for s in symbols if s not in results),
+        "fit_sec_total": round(sum(secs), 2),
+        "fit_sec_median": secs[len(secs) // 2] if secs else None,
+        "fit_sec_max": secs[-1] if secs else None,
+        "slowest": sorted(ok, key=lambda s: -ok[s]["sec"])[:5],
+        "aic": {s: r.get("aic") for s, r in sorted(ok.items())},
+        "order": {s: [r.get("order"), r.get("trend")] for s, r in sorted(ok.items())},
+    }
+    return summary
+
+
+# ====== Process con ======
+def _train_child(symbol: str, lookback_days: int, conn):
+    t0 = time.perf_counter()
+    try:
+        import modules.ML.predictors.sarimax_exog as sarimax_exog
+        from modules.ML.pipeline import train_gap_model
+
+        # Grid tuần tự trong process con: song song theo mã (TRAIN_WORKERS), không mở pool lồng
+        # -> terminate khi timeout không bỏ lại process pool mồ côi
+        sarimax_exog.ARIMA_WORKERS = 1
+        _, meta, _ = train_gap_model(symbol, lookback_days=lookback_days)
+        conn.send({
+            "status": "ok",
+            "sec": round(time.perf_counter() - t0, 2),
+            "aic": meta.get("aic"),
+            "order": meta.get("order"),
+            "trend": meta.get("trend"),
+            "use_exog": meta.get("use_exog"),
+            "train_len": meta.get("train_len"),
+        })
+    except Exception as e:
+        conn.send({"status": "error", "sec": round(time.perf_counter() - t0, 2),
+                   "error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_batch_train(universe: Optional[str] = None,
+                    workers: Optional[int] = None,
+                    timeout: Optional[float] = None,
+                    lookback_days: Optional[int] = None,
+                    run_id: Optional[str] = None,
+                    force: bool = False) -> Dict:
+    """
+    Train model gap cho mọi mã trong universe. Resume theo checkpoint nếu cùng run_id
+    (mặc định: phiên giao dịch mục tiêu); force=True -> train lại toàn bộ.
+    Mã lỗi / timeout ở lần chạy trước được thử lại.
+    """
+    from modules.api.stock_api import get_time_vn
+    from modules.ML.pipeline import pick_target_trading_day
+
+    spec = universe or TRAIN_UNIVERSE
+    workers = max(1, int(workers or TRAIN_WORKERS))
+    timeout = float(timeout or TRAIN_SYMBOL_TIMEOUT)
+    lookback_days = int(lookback_days or TRAIN_LOOKBACK_DAYS)
+    run_id = run_id or pick_target_trading_day().isoformat()
+
+    symbols = resolve_universe(spec)
+    if not symbols:
+        print(f"[BatchTrain] Universe {spec!r} rỗng (không giải được danh sách mã) -> bỏ qua")
+        return {"symbols": 0, "ok": 0}
+    ckpt = load_checkpoint()
+    if force or ckpt.get("run_id") != run_id or ckpt.get("universe") != spec:
+        ckpt = {"run_id": run_id, "universe": spec, "started_at": get_time_vn(), "results": {}}
+    ckpt.pop("finished_at", None)
+    results = ckpt["results"]
+    todo = [s for s in symbols if results.get(s, {}).get("status") != "ok"]
+    print(f"[BatchTrain] run {run_id} | {spec}: {len(symbols)} mã, còn {len(todo)} mã cần train "
+          f"({workers} process, timeout {timeout:.0f}s/mã)")
+    _save_checkpoint(ckpt)
+
+    method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+    ctx = mp.get_context(method)
+    running: Dict[str, tuple] = {}   # sym -> (process, conn, t0)
+    queue = list(todo)
+    t_run = time.perf_counter()
+
+    while queue or running:
+        while queue and len(running) < workers:
+            sym = queue.pop(0)
+            recv, send = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=_train_child, args=(sym, lookback_days, send),
+                            name=f"train-{sym}", daemon=False)
+            p.start()
+            send.close()
+            running[sym] = (p, recv, time.perf_counter())
+
+        wait_conns([c for _, c, _ in running.values()], timeout=1.0)
+        for sym, (p, conn, t0) in list(running.items()):
+            res = None
+            if conn.poll():
+                try:
+                    res = conn.recv()
+                except EOFError:
+                    res = {"status": "error", "sec": round(time.perf_counter() - t0, 2),
+                           "error": f"process con thoát (exitcode {p.exitcode})"}
+            elif not p.is_alive():
+                res = {"status": "error", "sec": round(time.perf_counter() - t0, 2),
+                       "error": f"process con thoát (exitcode {p.exitcode})"}
+            elif time.perf_counter() - t0 > timeout:
+                p.terminate()
+                res = {"status": "timeout", "sec": round(timeout, 2)}
+            if res is None:
+                continue
+            p.join(5)
+            if p.is_alive():
+                p.kill()
+                p.join(5)
+            conn.close()
+            del running[sym]
+            results[sym] = res
+            _save_checkpoint(ckpt)
+            print(f"[BatchTrain] {sym}: {res['status']} ({res['sec']}s)"
+                  + (f" {res.get('error')}" if res.get("error") else ""))
+
+    summary = _summarize(results, symbols)
+    summary["wall_sec"] = round(time.perf_counter() - t_run, 2)
+    ckpt["summary"] = summary
+    ckpt["finished_at"] = get_time_vn()
+    _save_checkpoint(ckpt)
+    print(f"[BatchTrain] Xong run {run_id}: {summary['ok']}/{summary['symbols']} mã, "
+          f"{summary['wall_sec']}s | lỗi {summary['errors']} | timeout {summary['timeouts']}")
+    return summary
+
+
+def _is_due() -> bool:
+    """Ngoài giờ giao dịch và phiên mục tiêu chưa có run hoàn tất."""
+    from modules.ML.pipeline import _session_status, pick_target_trading_day
+
+    if _session_status() not in ("pre_open", "post_close", "closed"):
+        return False
+    ckpt = load_checkpoint()
+    return not (ckpt.get("run_id") == pick_target_trading_day().isoformat() and ckpt.get("finished_at"))
+
+
+def run_batch_train_if_due() -> Optional[Dict]:
+    """Chạy đồng bộ nếu tới lúc (CLI / cron). Trả summary nếu có chạy, None nếu chưa tới lúc / đã xong."""
+    return run_batch_train() if _is_due() else None
+
+
+# ====== Chạy nền cho scheduler ======
+_bg: Optional[mp.Process] = None
+
+
+def _bg_main():
+    try:
+        run_batch_train_if_due()
+    except Exception as e:
+        print(f"[BatchTrain] ❌ Lỗi: {e}")
+        raise
+
+
+def batch_train_running() -> bool:
+    return _bg is not None and _bg.is_alive()
+
+
+def start_batch_train_if_due() -> bool:
+    """
+    Cho scheduler (không chặn vòng ingestion): run tới lúc -> chạy run_batch_train trong 1 process
+    riêng rồi trả ngay; các vòng sau chỉ kiểm tra process đó xong chưa.
+    Trả True nếu đang có run chạy nền (vừa khởi động hoặc từ vòng trước).
+    """
+    global _bg
+    if _bg is not None:
+        if _bg.is_alive():
+            return True
+        _bg.join()
+        print(f"[BatchTrain] Run nền kết thúc (exitcode {_bg.exitcode})")
+        _bg = None
+
+    if not _is_due():
+        return False
+    method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+    # Không daemon: process này còn sinh process con train từng mã
+    _bg = mp.get_context(method).Process(target=_bg_main, name="batch-train", daemon=False)
+    _bg.start()
+    print(f"[BatchTrain] Khởi động run nền (pid {_bg.pid})")
+    return True
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Train model gap cho cả universe")
+    ap.add_argument("--universe", default=TRAIN_UNIVERSE, help='vd. "VN30", "VN100", "FPT,VCB", "@symbols.txt"')
+    ap.add_argument("--workers", type=int, default=TRAIN_WORKERS)
+    ap.add_argument("--timeout", type=float, default=TRAIN_SYMBOL_TIMEOUT, help="giây / mã")
+    ap.add_argument("--lookback", type=int, default=TRAIN_LOOKBACK_DAYS)
+    ap.add_argument("--force", action="store_true", help="bỏ checkpoint, train lại toàn bộ")
+    args = ap.parse_args()
+    run_batch_train(args.universe, args.workers, args.timeout, args.lookback, force=args.force)
@@ -16,3 +16,30 @@ def mae(y_true, y_pred):
     y_true = np.array(y_true, dtype="float64")
     y_pred = np.array(y_pred, dtype="float64")
     return float(np.mean(np.abs(y_true - y_pred)))
+
+
+def directional_accuracy(y_true, y_pred):
+    """
+    Tỉ lệ dự báo đúng chiều (dấu) của return.
+    """
+    y_true = np.array(y_true, dtype="float64")
+    y_pred = np.array(y_pred, dtype="float64")
+    return float(np.mean(np.sign(y_true) == np.sign(y_pred)))
+
+
+def summarize(y_true, y_pred):
+    """
+    RMSE / MAE / directional accuracy trên các cặp hữu hạn (bỏ qua fold lỗi -> NaN).
+    """
+    y_true = np.array(y_true, dtype="float64")
+    y_pred = np.array(y_pred, dtype="float64")
+    ok = np.isfinite(y_true) & np.isfinite(y_pred)
+    n = int(ok.sum())
+    if n == 0:
+        return {"n": 0, "rmse": float("nan"), "mae": float("nan"), "direction_acc": float("nan")}
+    return {
+        "n": n,
+        "rmse": rmse(y_true[ok], y_pred[ok]),
+        "mae": mae(y_true[ok], y_pred[ok]),
+        "direction_acc": directional_accuracy(y_true[ok], y_pred[ok]),
+    }
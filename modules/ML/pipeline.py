@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import os
+import time
 import numpy as np
 import pandas as pd
 import datetime as dt
@@ -14,13 +16,19 @@ from modules.api.stock_api import (
 from modules.api.time_api import get_now
 from modules.ML.features import build_news_features
 from modules.ML.predictors.sarimax_exog import arima_select_fit
-from modules.ML.registry import save_model_meta, load_model_meta
+from modules.ML.registry import save_model_meta, load_model_meta, list_model_symbols
 from modules.ML.metrics import rmse as _rmse, mae as _mae
 
 ICT = pytz.timezone("Asia/Ho_Chi_Minh")
 
 VN_HOLIDAYS: set[str] = set()
 
+# Cập nhật model gap gia tăng: ước lượng lại tham số sau mỗi N dòng (ngày) mới
+GAP_REFIT_EVERY = int(os.getenv("GAP_REFIT_EVERY", 20))
+# forecast_gap append các phiên mới vào model trong RAM trước khi dự báo (không ghi đĩa,
+# không train lại); lưu model cập nhật là việc của job ingestion (refresh_gap_models)
+GAP_AUTO_UPDATE = os.getenv("GAP_AUTO_UPDATE", "1") == "1"
+
 
 # ===== Lịch giao dịch / phiên =====
 def is_vn_holiday(d: dt.date) -> bool:
@@ -220,24 +228,21 @@ def _dir_from_gap(last_close: float, band: dict, eps: float = 1e-9):
 
 # ===== intraday momentum helper =====
 def _get_intraday_best(symbol: str, debug: bool = False) -> pd.DataFrame:
+    """
+    Nến 1m gần nhất của mã: ticks chỉ fetch 1 lần (bộ đệm tick trong stock_api),
+    days=1 rồi days=2 đều cắt local từ cùng bộ đệm -> không phát sinh thêm lời gọi upstream.
+    """
     sym = symbol.upper()
-    source_candidates = [None, "VCI", "TCBS", "MSN"]
-    intervals = ["1m", "5m", "15m"]
-    day_opts = [1, 2]
-
-    for src in source_candidates:
-        for iv in intervals:
-            for d in day_opts:
-                try:
-                    df = get_intraday_df(sym, source=src, interval=iv, days=d, debug=debug)
-                    if df is not None and not df.empty and "close" in df.columns:
-                        if debug:
-                            print(f"[intraday_best] picked src={src or 'default'} iv={iv} days={d} rows={len(df)}")
-                        return df
-                except Exception as e:
-                    if debug:
-                        print(f"[intraday_best] src={src or 'default'} iv={iv} days={d} error: {e}")
-                    continue
+    for d in (1, 2):
+        try:
+            df = get_intraday_df(sym, interval="1m", days=d, debug=debug)
+            if df is not None and not df.empty and "close" in df.columns:
+                if debug:
+                    print(f"[intraday_best] picked iv=1m days={d} rows={len(df)}")
+                return df
+        except Exception as e:
+            if debug:
+                print(f"[intraday_best] days={d} error: {e}")
 
     if debug:
         print("[intraday_best] no intraday found → returning empty")
@@ -396,6 +401,135 @@ def train_gap_model(symbol: str,
     return fit, meta, eval_report
 
 
+# ====== CẬP NHẬT GIA TĂNG MODEL GAP ======
+def _last_complete_day(now: Optional[dt.datetime] = None) -> dt.date:
+    """Ngày cuối cùng có nến đã chốt (phiên hôm nay chưa đóng cửa thì lùi 1 ngày)."""
+    now = (now or get_now()).astimezone(ICT)
+    if _session_status(now) in ("closed", "post_close"):
+        return now.date()
+    return now.date() - dt.timedelta(days=1)
+
+
+def update_gap_model(symbol: str,
+                     refit: Optional[bool] = None,
+                     fit=None,
+                     meta: Optional[Dict] = None,
+                     persist: bool = True):
+    """
+    Append các log-return (và exog) phát sinh sau ngày cuối của model 'gap' đã lưu,
+    giữ nguyên tham số (results.append, refit=False): chỉ lọc Kalman lại, không grid search.
+    - Mỗi GAP_REFIT_EVERY dòng mới (hoặc refit=True): ước lượng lại tham số cùng order/trend
+      trên cửa sổ train_len dòng gần nhất, khởi động từ tham số hiện tại.
+    - Chuỗi mới không nối liền được với model (thiếu dữ liệu) -> train lại toàn bộ.
+    persist=False (đường user: UI / API): chỉ append trong RAM, không ước lượng lại, không train lại,
+    không ghi models/*.pkl -> không tranh ghi với ingestion / batch trainer.
+    Trả (fit, meta, info); info["status"] in {"up_to_date", "appended", "refit", "retrained", "stale"}.
+    """
+    sym = symbol.upper()
+    t0 = time.perf_counter()
+    if fit is None or meta is None:
+        fit, meta = load_model_meta(sym, "gap", count=False)
+    if fit is None:
+        if not persist:
+            return fit, meta, {"status": "stale", "new_rows": 0, "sec": round(time.perf_counter() - t0, 3)}
+        fit, meta, _ = train_gap_model(sym, lookback_days=365)
+        return fit, meta, {"status": "retrained", "new_rows": 0, "sec": round(time.perf_counter() - t0, 3)}
+
+    endog_index = pd.DatetimeIndex(fit.model.data.row_labels).tz_localize(None)
+    last_idx = endog_index[-1]
+    cutoff = pd.Timestamp(_last_complete_day())
+    if last_idx >= cutoff:
+        return fit, meta, {"status": "up_to_date", "new_rows": 0, "sec": round(time.perf_counter() - t0, 3)}
+
+    # close từ kho OHLCV local: cùng cách dựng chuỗi (ngày lịch, ffill) như lúc train
+    close = get_close_series(sym, days=(cutoff - last_idx).days + 30)
+    r = _to_returns(close)
+    r.index = pd.DatetimeIndex(r.index).tz_localize(None)
+    r = r[r.index <= cutoff]
+    new = r[r.index > last_idx]
+    if new.empty:
+        return fit, meta, {"status": "up_to_date", "new_rows": 0, "sec": round(time.perf_counter() - t0, 3)}
+
+    freq = getattr(endog_index, "freq", None) or pd.tseries.frequencies.to_offset("D")
+    if last_idx not in r.index or new.index[0] != last_idx + freq:
+        if not persist:
+            return fit, meta, {"status": "stale", "new_rows": len(new), "sec": round(time.perf_counter() - t0, 3)}
+        print(f"[GapModel] {sym}: chuỗi mới không nối liền {last_idx.date()} -> train lại")
+        fit, meta, _ = train_gap_model(sym, lookback_days=365, add_index=meta.get("add_index"))
+        return fit, meta, {"status": "retrained", "new_rows": len(new), "sec": round(time.perf_counter() - t0, 3)}
+
+    use_exog = bool(meta.get("use_exog"))
+    feat_cols = meta.get("feature_cols", [])
+    X_new = None
+    if use_exog and feat_cols:
+        # Lấy cả dòng last_idx để exog dịch 1 phiên (shift=1) giống lúc train
+        X_raw = _align_exog_to_y(sym, r.loc[last_idx:], add_index=meta.get("add_index"), shift=1)
+        for c in feat_cols:
+            if c not in X_raw.columns:
+                X_raw[c] = 0.0
+        X_new = _apply_scaler(X_raw, meta.get("scaler", {}))[feat_cols].reindex(new.index).fillna(0.0)
+        # Model fit trên exog dạng ndarray (arima_select_fit) -> append cùng dạng
+        X_new = X_new.to_numpy(dtype="float64")
+
+    # meta có thể là bản trong cache model của registry -> sửa trên bản sao
+    meta = dict(meta)
+    since_refit = int(meta.get("rows_since_refit", 0)) + len(new)
+    do_refit = refit if refit is not None else since_refit >= GAP_REFIT_EVERY
+    do_refit = do_refit and persist
+
+    fit = fit.append(new, exog=X_new, refit=False)
+    status = "appended"
+
+    if do_refit:
+        window = int(meta.get("train_len") or len(endog_index))
+        y_all = fit.model.data.orig_endog
+        X_all = fit.model.data.orig_exog if use_exog and feat_cols else None
+        try:
+            fit = fit.apply(
+                y_all.iloc[-window:],
+                exog=None if X_all is None else X_all[-window:],
+                refit=True,
+                # apply() không truyền params hiện tại -> warm-start từ fit cũ, hội tụ nhanh hơn
+                fit_kwargs={"start_params": fit.params, "method": "lbfgs", "maxiter": 200, "disp": False},
+            )
+            status = "refit"
+            since_refit = 0
+            meta["refit_at"] = get_time_vn()
+            meta["aic"] = float(fit.aic)
+        except Exception as e:
+            print(f"[GapModel] {sym}: ước lượng lại lỗi ({e}) -> giữ tham số cũ")
+
+    meta["rows_since_refit"] = since_refit
+    meta["updated_at"] = get_time_vn()
+    meta["last_obs"] = new.index[-1].strftime("%Y-%m-%d")
+    meta["nobs"] = int(fit.nobs)
+    meta["last_close"] = float(close.loc[:cutoff].iloc[-1])
+    if persist:
+        save_model_meta(sym, "gap", fit, meta)
+
+    info = {"status": status, "new_rows": int(len(new)), "sec": round(time.perf_counter() - t0, 3)}
+    print(f"[GapModel] {sym}: {info}")
+    return fit, meta, info
+
+
+def refresh_gap_models(symbols: Optional[List[str]] = None) -> Dict[str, object]:
+    """Job cập nhật gia tăng mọi model gap đã lưu (mặc định: toàn bộ trong MODELS_DIR)."""
+    syms = [s.upper() for s in (symbols or list_model_symbols("gap"))]
+    t0 = time.perf_counter()
+    counts: Dict[str, int] = {}
+    failed = []
+    for sym in syms:
+        try:
+            _, _, info = update_gap_model(sym)
+            counts[info["status"]] = counts.get(info["status"], 0) + 1
+        except Exception as e:
+            print(f"[GapModel] {sym}: lỗi cập nhật ({e})")
+            failed.append(sym)
+    summary = {"symbols": len(syms), **counts, "failed": failed, "sec": round(time.perf_counter() - t0, 2)}
+    print(f"[GapModel] Refresh: {summary}")
+    return summary
+
+
 # ====== FORECAST GAP (dùng model đã lưu) ======
 def forecast_gap(symbol: str, alpha: float = 0.10):
     """
@@ -414,6 +548,12 @@ def forecast_gap(symbol: str, alpha: float = 0.10):
         # nếu vẫn None thì coi như lỗi nghiêm trọng
         if fit is None:
             raise RuntimeError("Không thể load model sau khi train.")
+    elif GAP_AUTO_UPDATE:
+        # Đưa model tới phiên đã chốt gần nhất, chỉ trong RAM (không có phiên mới thì gần như không tốn gì)
+        try:
+            fit, meta, _ = update_gap_model(sym, fit=fit, meta=meta, persist=False)
+        except Exception as e:
+            print(f"[GapModel] {sym}: không cập nhật được ({e}) -> dùng model đã lưu")
 
     use_exog   = bool(meta.get("use_exog"))
     feat_cols  = meta.get("feature_cols", [])
@@ -520,7 +660,7 @@ def _confidence_from_mu_sigma(mu: float, sigma: float) -> str:
     if ratio >= 0.5: return "medium"
     return "low"
 
-def predict_next_step_in_session(symbol: str, source: str = "VCI"):
+def predict_next_step_in_session(symbol: str, source: Optional[str] = None):
     sym = symbol.upper()
     now = get_now().astimezone(ICT)
     st = _session_status(now)
@@ -601,7 +741,7 @@ def predict_next_step_in_session(symbol: str, source: str = "VCI"):
         "mode": "in_session"
     }
 
-def predict_next_session(symbol: str, alpha: float = 0.10, source: str = "VCI"):
+def predict_next_session(symbol: str, alpha: float = 0.10, source: Optional[str] = None):
     sym = symbol.upper()
     now = get_now().astimezone(ICT)
     target_day, next_sess = _next_trading_session(now)
@@ -651,7 +791,7 @@ def predict_next_session(symbol: str, alpha: float = 0.10, source: str = "VCI"):
         "note": "PM dựa trên giá kết thúc buổi sáng và band PM mặc định."
     }
 
-def smart_predict(symbol: str, alpha: float = 0.10, source: str = "VCI"):
+def smart_predict(symbol: str, alpha: float = 0.10, source: Optional[str] = None):
     now = get_now().astimezone(ICT)
     st = _session_status(now)
 
@@ -675,7 +815,7 @@ def smart_predict(symbol: str, alpha: float = 0.10, source: str = "VCI"):
 
 
 __all__ = [
-    "train_gap_model","forecast_gap",
+    "train_gap_model","update_gap_model","refresh_gap_models","forecast_gap",
     "predict_tomorrow_full_exog","smart_predict",
     "predict_next_session","predict_next_step_in_session",
     "direction_from_return","pick_target_trading_day"
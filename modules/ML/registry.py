@@ -1,10 +1,38 @@
 import os
+import atexit
 import json
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Tuple, Any, Dict, List, Optional
+
 import joblib
-from typing import Tuple, Any, Dict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: không khoá liên process
+    fcntl = None
 
 MODELS_DIR = os.getenv("MODELS_DIR", "models")
 
+# Cache model đã unpickle trong process: khoá (symbol, tag), hết hiệu lực khi mtime/size file đổi
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", 64))
+# Warm-up lúc khởi động: nạp sẵn N mã được hỏi nhiều nhất
+MODEL_WARMUP_TOP = int(os.getenv("MODEL_WARMUP_TOP", 30))
+# Đếm lượt hỏi theo mã, cộng dồn vào file sau mỗi N lượt (để warm-up lần khởi động sau)
+MODEL_STATS_FLUSH = int(os.getenv("MODEL_STATS_FLUSH", 50))
+MODEL_REQUESTS_FILE = os.path.join(MODELS_DIR, "_model_requests.json")
+
+# (symbol, tag) -> (version, model, meta); version = (mtime_ns, size) của .pkl và .json
+_cache: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+_cache_lock = threading.Lock()
+_key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_requests: Counter = Counter()
+_unflushed = [0]
+_stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0, "load_sec": 0.0, "warmed": 0}
+
 
 def _paths(symbol: str, tag: str) -> Tuple[str, str]:
     """
@@ -18,6 +46,47 @@ def _paths(symbol: str, tag: str) -> Tuple[str, str]:
     )
 
 
+@contextmanager
+def _flock(path: str, mode: Optional[int] = None):
+    """Khoá fcntl (liên process) trên file sidecar `path`; mode mặc định LOCK_EX."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as lf:
+        if fcntl is not None:
+            fcntl.flock(lf, fcntl.LOCK_EX if mode is None else mode)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _model_lock(symbol: str, tag: str, shared: bool = False):
+    """
+    Khoá cặp .pkl/.json của 1 model: ghi giữ LOCK_EX qua cả 2 lần replace,
+    đọc đĩa giữ LOCK_SH -> không bao giờ thấy .pkl mới cạnh .json cũ.
+    """
+    mode = fcntl.LOCK_SH if (shared and fcntl is not None) else None
+    return _flock(os.path.join(MODELS_DIR, f"{symbol}_{tag}.lock"), mode)
+
+
+def _tmp_path(path: str) -> str:
+    """Tên tmp riêng cho mỗi lần ghi (pid + uuid) -> các process không ghi đè tmp của nhau."""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def _replace_atomic(path: str, write_fn):
+    tmp = _tmp_path(path)
+    try:
+        write_fn(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
 def save_model_meta(symbol: str, tag: str, model: Any, meta: Dict) -> Tuple[str, str]:
     """
     Lưu model (joblib) và metadata (json) sau quá trình train.
@@ -28,22 +97,198 @@ def save_model_meta(symbol: str, tag: str, model: Any, meta: Dict) -> Tuple[str,
       - dự báo bước tới (ret_hat_next, next_price_est)
     """
     mpath, jpath = _paths(symbol, tag)
-    joblib.dump(model, mpath)
-    with open(jpath, "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    def _dump_meta(tmp: str):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # tmp + os.replace: process khác (UI / API / ingestion) không đọc phải file ghi dở;
+    # khoá theo mã: không đọc được cặp .pkl mới / .json cũ giữa 2 lần replace
+    with _model_lock(symbol, tag):
+        _replace_atomic(mpath, lambda tmp: joblib.dump(model, tmp))
+        _replace_atomic(jpath, _dump_meta)
+        version = _version(mpath, jpath)
+    # Ghi xuyên cache: lần load kế tiếp trong process này không phải unpickle lại
+    if version is not None:
+        _cache_put((symbol, tag), version, model, meta)
     return mpath, jpath
 
 
-def load_model_meta(symbol: str, tag: str) -> Tuple[Any, Dict]:
+def _version(mpath: str, jpath: str) -> Optional[tuple]:
+    try:
+        m, j = os.stat(mpath), os.stat(jpath)
+    except OSError:
+        return None
+    return (m.st_mtime_ns, m.st_size, j.st_mtime_ns, j.st_size)
+
+
+def _cache_put(key: Tuple[str, str], version: tuple, model: Any, meta: Dict):
+    with _cache_lock:
+        _cache[key] = (version, model, dict(meta))
+        _cache.move_to_end(key)
+        while len(_cache) > MODEL_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def _count_request(symbol: str):
+    with _cache_lock:
+        _requests[symbol] += 1
+        _unflushed[0] += 1
+        due = _unflushed[0] >= MODEL_STATS_FLUSH
+    if due:
+        flush_request_stats()
+
+
+def _load_cached(symbol: str, tag: str) -> Tuple[Any, Optional[Dict], bool]:
+    """(model, meta, vừa đọc đĩa?) — model lấy từ cache nếu file chưa đổi."""
+    mpath, jpath = _paths(symbol, tag)
+    key = (symbol, tag)
+    version = _version(mpath, jpath)
+    if version is None:
+        return None, None, False
+
+    with _cache_lock:
+        item = _cache.get(key)
+        if item is not None and item[0] == version:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return item[1], dict(item[2]), False
+        lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Single-flight: nhiều thread cùng miss 1 mã -> chỉ 1 thread unpickle
+    with lock:
+        with _cache_lock:
+            item = _cache.get(key)
+            if item is not None and item[0] == version:
+                _stats["hits"] += 1
+                return item[1], dict(item[2]), False
+            _stats["reloads" if item is not None else "misses"] += 1
+
+        t0 = time.perf_counter()
+        # Đọc cặp file dưới khoá chung + lấy lại version -> cache luôn giữ đúng cặp đã đọc
+        with _model_lock(symbol, tag, shared=True):
+            version = _version(mpath, jpath)
+            if version is None:
+                return None, None, False
+            model = joblib.load(mpath)
+            with open(jpath, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        with _cache_lock:
+            _stats["load_sec"] += time.perf_counter() - t0
+        _cache_put(key, version, model, meta)
+    return model, dict(meta), True
+
+
+def load_model_meta(symbol: str, tag: str, count: bool = True) -> Tuple[Any, Dict]:
     """
-    Đọc model + metadata từ đĩa.
+    Đọc model + metadata (qua cache trong process).
+    Cache hết hiệu lực khi file .pkl / .json bị ghi lại (train / update ở process khác).
     Nếu chưa có thì trả về (None, None) để caller tự train.
+    meta trả về là bản sao (caller sửa thoải mái); model dùng chung, không sửa tại chỗ.
+    count=False: không tính vào thống kê lượt hỏi (job nền).
     """
-    mpath, jpath = _paths(symbol, tag)
-    if not (os.path.exists(mpath) and os.path.exists(jpath)):
-        return None, None
+    if count:
+        _count_request(symbol)
+    model, meta, _ = _load_cached(symbol, tag)
+    return model, meta
+
 
-    model = joblib.load(mpath)
+def list_model_symbols(tag: str) -> List[str]:
+    """Các mã đã có model + meta cho tag (vd. 'gap')."""
+    if not os.path.isdir(MODELS_DIR):
+        return []
+    suffix = f"_{tag}.pkl"
+    out = []
+    for f in sorted(os.listdir(MODELS_DIR)):
+        if f.endswith(suffix):
+            sym = f[: -len(suffix)]
+            if os.path.exists(os.path.join(MODELS_DIR, f"{sym}_{tag}.json")):
+                out.append(sym)
+    return out
+
+
+def load_meta(symbol: str, tag: str) -> Optional[Dict]:
+    """Chỉ đọc metadata (json), không load model. Chưa có thì trả None."""
+    _, jpath = _paths(symbol, tag)
+    if not os.path.exists(jpath):
+        return None
     with open(jpath, "r", encoding="utf-8") as f:
-        meta = json.load(f)
-    return model, meta
+        return json.load(f)
+
+
+# ====== Thống kê lượt hỏi + warm-up ======
+def _requests_file_lock():
+    """Khoá fcntl (liên process) quanh đọc-cộng-ghi MODEL_REQUESTS_FILE."""
+    return _flock(MODEL_REQUESTS_FILE + ".lock")
+
+
+def flush_request_stats():
+    """Cộng dồn lượt hỏi chưa ghi vào MODEL_REQUESTS_FILE (nhiều process cùng cộng vào 1 file, có khoá)."""
+    with _cache_lock:
+        delta = dict(_requests)
+        _requests.clear()
+        _unflushed[0] = 0
+    if not delta:
+        return
+    try:
+        with _requests_file_lock():
+            total = Counter(top_requested(limit=None))
+            total.update(delta)
+            with open(MODEL_REQUESTS_FILE + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(dict(total.most_common()), f, ensure_ascii=False, indent=2)
+            os.replace(MODEL_REQUESTS_FILE + ".tmp", MODEL_REQUESTS_FILE)
+    except Exception as e:
+        print(f"[ModelCache] Lỗi ghi thống kê lượt hỏi: {e}")
+
+
+atexit.register(flush_request_stats)
+
+
+def top_requested(limit: Optional[int] = MODEL_WARMUP_TOP) -> Dict[str, int]:
+    """{symbol: số lượt hỏi} giảm dần, đọc từ MODEL_REQUESTS_FILE."""
+    try:
+        with open(MODEL_REQUESTS_FILE, "r", encoding="utf-8") as f:
+            counts = Counter({k: int(v) for k, v in json.load(f).items()})
+    except (OSError, ValueError):
+        return {}
+    return dict(counts.most_common(limit))
+
+
+def warmup_models(tag: str = "gap", limit: int = MODEL_WARMUP_TOP, background: bool = True):
+    """
+    Nạp sẵn model của các mã được hỏi nhiều nhất (chưa có thống kê -> các mã có model, theo tên)
+    vào cache. background=True -> chạy thread nền, không chặn khởi động.
+    """
+    def _run():
+        t0 = time.perf_counter()
+        available = set(list_model_symbols(tag))
+        syms = [s for s in top_requested(limit=None) if s in available][:limit]
+        if len(syms) < limit:
+            syms += [s for s in sorted(available) if s not in syms][: limit - len(syms)]
+        n = 0
+        for sym in syms[:MODEL_CACHE_SIZE]:
+            try:
+                n += int(_load_cached(sym, tag)[2])
+            except Exception as e:
+                print(f"[ModelCache] Không warm-up được {sym}: {e}")
+        with _cache_lock:
+            _stats["warmed"] += n
+        print(f"[ModelCache] Warm-up {n} model '{tag}' trong {time.perf_counter() - t0:.2f}s")
+
+    if not background:
+        _run()
+        return None
+    t = threading.Thread(target=_run, name="model-warmup", daemon=True)
+    t.start()
+    return t
+
+
+def model_cache_stats() -> Dict[str, Any]:
+    with _cache_lock:
+        out = dict(_stats)
+        out["load_sec"] = round(out["load_sec"], 3)
+        out["size"] = len(_cache)
+        out["max_size"] = MODEL_CACHE_SIZE
+        out["models"] = [f"{s}_{t}" for s, t in _cache]
+    return out
@@ -1,9 +1,14 @@
+import os
 from typing import Dict, Any, Optional
 
-from modules.ML.pipeline import smart_predict, predict_next_session, direction_from_return
+from modules.ML.pipeline import smart_predict, predict_next_session, direction_from_return, _session_status
+from modules.utils.fanout import fan_out
 from modules.api.time_api import get_now
 from modules.api.stock_api import DATE_FMT
 
+# Deadline (giây) cho smart_predict + predict_next_session chạy song song trong forecast brief
+FORECAST_BRIEF_DEADLINE = float(os.getenv("FORECAST_BRIEF_DEADLINE", 8))
+
 
 def _safe_get(d: Dict, key: str, default=None):
     try:
@@ -151,13 +156,22 @@ def format_forecast_brief(symbol: str) -> str:
     """
     sym = symbol.upper()
 
-    try:
-        pack = smart_predict(symbol)
-    except Exception:
-        # fallback nhẹ nếu model lỗi → thử luôn next_session
-        try:
-            next_pack = predict_next_session(symbol)
-        except Exception:
+    # Trong phiên: predict_next_session không phụ thuộc kết quả smart_predict -> chạy song song
+    tasks = {"pack": lambda: smart_predict(symbol)}
+    if _session_status() in ("morning", "afternoon"):
+        tasks["next_pack"] = lambda: predict_next_session(symbol)
+    results, info = fan_out(tasks, timeout=FORECAST_BRIEF_DEADLINE)
+
+    pack = results.get("pack")
+    if pack is None:
+        # fallback nhẹ nếu model lỗi → thử luôn next_session (quá hạn thì bỏ qua)
+        next_pack = results.get("next_pack")
+        if next_pack is None and info["pack"]["status"] == "error":
+            try:
+                next_pack = predict_next_session(symbol)
+            except Exception:
+                return ""
+        if next_pack is None:
             return ""
         brief_next = _format_next_session_brief(sym, next_pack)
         return ("\n" + brief_next) if brief_next else ""
@@ -177,11 +191,18 @@ def format_forecast_brief(symbol: str) -> str:
 
         # kèm thêm dự báo cho phiên giao dịch kế tiếp
         brief_next = ""
-        try:
-            next_pack = predict_next_session(symbol)
-            brief_next = _format_next_session_brief(sym, next_pack)
-        except Exception:
-            brief_next = ""
+        next_pack = results.get("next_pack")
+        if next_pack is None and "next_pack" not in tasks:
+            # phiên vừa mở giữa 2 lần kiểm tra -> gọi tuần tự như cũ
+            try:
+                next_pack = predict_next_session(symbol)
+            except Exception:
+                next_pack = None
+        if next_pack is not None:
+            try:
+                brief_next = _format_next_session_brief(sym, next_pack)
+            except Exception:
+                brief_next = ""
 
         if brief_next:
             parts.append("\n" + brief_next)
@@ -3,7 +3,8 @@ VNStock Data API (ICT timezone, TTL cache, robust normalize)
 - discover_market_indices, get_index_detail
 - get_stock_quote, get_top_stocks
 - get_history_prices, get_price_at_date
-- get_history_df_vnstock, get_prices_df, get_close_series
+- get_history_df_vnstock, get_prices_df, get_close_series  (đọc từ kho OHLCV local)
+- refresh_ohlcv_universe  (job đồng bộ kho OHLCV)
 - get_intraday_df  (ticks → OHLCV)
 - format_* helpers (text output)
 """
@@ -14,8 +15,9 @@ import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="vnai.scope.profile")
 
 from datetime import datetime, timedelta, date
-from functools import wraps
-from typing import Optional, Iterable, List, Dict
+from typing import Optional, Iterable, List, Dict, Tuple
+import os
+import threading
 import time
 import re
 
@@ -25,6 +27,12 @@ import pytz
 
 from vnstock import Quote, Trading, Screener
 from modules.api.time_api import get_now
+from modules.utils.fanout import fan_out
+from modules.utils.ohlcv_store import OHLCVStore
+from modules.utils.price_board import PriceBoardPoller, is_trading_hours
+from modules.utils.source_health import SourceHealth
+from modules.utils.tick_resample import resample_ticks, resample_ticks_multi, split_by_symbol
+from modules.utils.ttl_cache import TTLCache, ttl_cache_stats
 
 VN_TZ = pytz.timezone("Asia/Ho_Chi_Minh")
 DATE_FMT = "%d-%m-%Y"
@@ -46,30 +54,24 @@ def _ymd(dt_: datetime) -> str:
     return dt_.strftime("%Y-%m-%d")
 
 
-def TTLCache(ttl_seconds: int = 300, verbose: bool = False):
-    def decorator(func):
-        cache: Dict[tuple, tuple] = {}
+# ====== Đếm lời gọi upstream (vnstock) theo thread, dùng để báo số call tiết kiệm ======
+_upstream_local = threading.local()
 
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            key = (func.__name__, args, frozenset(kwargs.items()))
-            t = time.time()
-            if key in cache:
-                val, ts = cache[key]
-                if t - ts < ttl_seconds:
-                    if verbose:
-                        print(f"[Cache Hit] {func.__name__}")
-                    return val
-                cache.pop(key, None)
-            if verbose:
-                print(f"[Cache Miss] {func.__name__}")
-            val = func(*args, **kwargs)
-            cache[key] = (val, t)
-            return val
 
-        return wrapper
+def _count_upstream(n: int = 1):
+    counter = getattr(_upstream_local, "counter", None)
+    if counter is not None:
+        counter[0] += n
 
-    return decorator
+
+def _counted(fn, *args, **kwargs):
+    """Chạy fn, trả (kết quả, số lời gọi upstream thực sự phát sinh trong thread này; cache hit = 0)."""
+    prev = getattr(_upstream_local, "counter", None)
+    _upstream_local.counter = [0]
+    try:
+        return fn(*args, **kwargs), _upstream_local.counter[0]
+    finally:
+        _upstream_local.counter = prev
 
 
 def _sanitize_symbol(symbol: str) -> str:
@@ -127,17 +129,66 @@ def _normalize_history_df(df: pd.DataFrame) -> pd.DataFrame:
     return df[["open", "high", "low", "close", "volume"]]
 
 
-def _quote_history_with_fallback(symbol: str, start: str, end: str) -> pd.DataFrame:
-    for src in ("VCI", "TCBS", "MSN"):
+QUOTE_SOURCES = ("VCI", "TCBS", "MSN")
+# Nguồn đầu chậm quá N giây -> gọi song song nguồn kế tiếp (0 = tắt hedging)
+HISTORY_HEDGE_AFTER_SEC = float(os.getenv("HISTORY_HEDGE_AFTER_SEC", 2.5))
+INTRADAY_HEDGE_AFTER_SEC = float(os.getenv("INTRADAY_HEDGE_AFTER_SEC", 2.5))
+
+# Sức khoẻ từng nguồn theo loại endpoint (history / intraday hỏng độc lập nhau)
+history_sources = SourceHealth("quote.history", QUOTE_SOURCES)
+intraday_sources = SourceHealth("quote.intraday", QUOTE_SOURCES)
+
+
+def _with_upstream_counter(fn):
+    """Chuyển bộ đếm upstream của thread gọi sang thread pool của SourceHealth."""
+    counter = getattr(_upstream_local, "counter", None)
+
+    def run(*args, **kwargs):
+        _upstream_local.counter = counter
         try:
-            q = Quote(symbol=symbol, source=src)
-            raw = q.history(start=start, end=end)
-            dfn = _normalize_history_df(raw)
-            if dfn is not None and not dfn.empty:
-                return dfn
-        except Exception:
-            continue
-    raise ValueError(f"Không lấy được lịch sử cho {symbol} từ VCI/TCBS/MSN")
+            return fn(*args, **kwargs)
+        finally:
+            _upstream_local.counter = None
+
+    return run
+
+
+def _quote_history_with_fallback(
+    symbol: str, start: str, end: str, allow_empty: bool = False
+) -> pd.DataFrame:
+    """
+    Thử các nguồn theo sức khoẻ hiện tại (nguồn tốt gần nhất của mã trước, bỏ qua nguồn
+    đang mở mạch), hedge sang nguồn kế tiếp nếu nguồn đầu chậm.
+    allow_empty=True: nếu có nguồn trả lời bình thường nhưng không có phiên nào
+    (nghỉ lễ / cuối tuần / trước ngày niêm yết) -> trả DataFrame rỗng thay vì raise.
+    """
+
+    def fetch(src: str) -> pd.DataFrame:
+        _count_upstream()
+        raw = Quote(symbol=symbol, source=src).history(start=start, end=end)
+        return _normalize_history_df(raw)
+
+    try:
+        df, src = history_sources.call(
+            _with_upstream_counter(fetch),
+            symbol=symbol,
+            accept=lambda d: d is not None and not d.empty,
+            hedge_after=HISTORY_HEDGE_AFTER_SEC,
+        )
+    except RuntimeError:
+        df, src = None, None
+    if src is not None:
+        return df
+    if allow_empty and df is not None:
+        return df
+    raise ValueError(f"Không lấy được lịch sử cho {symbol} từ {'/'.join(QUOTE_SOURCES)}")
+
+
+# Kho OHLCV ngày local (Parquet): lịch sử / giá theo ngày chỉ gọi vnstock cho phiên còn thiếu
+ohlcv_store = OHLCVStore(
+    fetcher=lambda sym, start, end: _quote_history_with_fallback(sym, start, end, allow_empty=True),
+    now_fn=_today_vn,
+)
 
 
 _CANDIDATE_INDICES: List[str] = [
@@ -158,7 +209,7 @@ _CANDIDATE_INDICES: List[str] = [
 ]
 
 
-@TTLCache(ttl_seconds=6 * 3600)
+@TTLCache(ttl_seconds=6 * 3600, max_size=16, stale_ttl_seconds=6 * 3600, shared=True)
 def discover_market_indices(
     candidates: Iterable[str] | None = None, min_points: int = 1
 ) -> List[str]:
@@ -178,7 +229,7 @@ def discover_market_indices(
     return ok
 
 
-@TTLCache(ttl_seconds=300)
+@TTLCache(ttl_seconds=300, max_size=64, stale_ttl_seconds=300, shared=True)
 def get_index_detail(index_code: str = "VNINDEX") -> dict:
     try:
         index_code = _sanitize_symbol(index_code)
@@ -209,7 +260,80 @@ def get_index_detail(index_code: str = "VNINDEX") -> dict:
         return {"ticker": index_code, "error": str(e)}
 
 
-@TTLCache(ttl_seconds=60)
+# ====== Bảng giá realtime: poller nền cập nhật snapshot theo lô cho watchlist ======
+# Danh sách mã và/hoặc nhóm (VN30, VN100, HNX30...) hoặc sàn (HOSE, HNX, UPCOM), phân tách dấu phẩy
+PRICE_BOARD_WATCHLIST = os.getenv("PRICE_BOARD_WATCHLIST", "VN30")
+_BOARD_EXCHANGES = {"HOSE": ("HOSE", "HSX"), "HNX": ("HNX",), "UPCOM": ("UPCOM",)}
+
+
+def _parse_board_row(row: dict) -> dict:
+    """1 dòng price_board (cột đã làm phẳng 'nhóm_tên') -> giá / tham chiếu / trần / sàn / khối lượng."""
+
+    def num(*keys):
+        for k in keys:
+            v = row.get(k)
+            if v is not None and not (isinstance(v, float) and np.isnan(v)):
+                return float(v)
+        return None
+
+    return {
+        "price": num("match_match_price"),
+        "ref": num("match_reference_price", "listing_ref_price"),
+        "ceil": num("match_ceiling_price", "listing_ceiling"),
+        "floor": num("match_floor_price", "listing_floor"),
+        "volume": int(num("match_accumulated_volume", "match_match_vol") or 0),
+    }
+
+
+def _fetch_price_board(symbols: List[str]) -> Dict[str, dict]:
+    """1 lời gọi Trading.price_board cho cả lô mã -> {SYMBOL: row đã parse} (bỏ mã chưa khớp lệnh)."""
+    df = Trading().price_board(symbols_list=list(symbols))
+    if df is None or df.empty:
+        return {}
+    df = df.copy()
+    df.columns = [f"{a}_{b}" for a, b in df.columns]
+    out: Dict[str, dict] = {}
+    for i, row in enumerate(df.to_dict("records")):
+        sym = str(row.get("listing_symbol") or (symbols[i] if len(symbols) == 1 else "")).upper()
+        parsed = _parse_board_row(row)
+        if sym and parsed["price"]:
+            out[sym] = parsed
+    return out
+
+
+def resolve_symbols(spec: str) -> List[str]:
+    """
+    "VN30,HOSE,FPT" -> list mã: nhóm chỉ số (VN30, VN100...) / sàn tra qua vnstock Listing,
+    còn lại coi là mã lẻ. Giữ thứ tự, bỏ trùng.
+    """
+    from vnstock import Listing
+
+    out: List[str] = []
+    for tok in [t.strip().upper() for t in (spec or "").split(",") if t.strip()]:
+        try:
+            if tok in _BOARD_EXCHANGES:
+                df = Listing().symbols_by_exchange()
+                ex_col = next((c for c in ("exchange", "comGroupCode", "board") if c in df.columns), None)
+                if ex_col:
+                    out += df[df[ex_col].astype(str).str.upper().isin(_BOARD_EXCHANGES[tok])]["symbol"].tolist()
+            elif tok in _CANDIDATE_INDICES:
+                out += list(Listing().symbols_by_group(tok))
+            else:
+                out.append(tok)
+        except Exception as e:
+            print(f"[Listing] Không giải được nhóm {tok}: {e}")
+    return list(dict.fromkeys(_sanitize_symbol(x) for x in out if _sanitize_symbol(x)))
+
+
+def _board_watchlist() -> List[str]:
+    """Giải PRICE_BOARD_WATCHLIST thành list mã."""
+    return resolve_symbols(PRICE_BOARD_WATCHLIST)
+
+
+price_board = PriceBoardPoller(fetch_board=_fetch_price_board, watchlist_fn=_board_watchlist, now_fn=_today_vn)
+
+
+@TTLCache(ttl_seconds=5, max_size=2048)
 def get_stock_quote(symbol: str) -> dict:
     """
     Trả về dict thông tin giá cho 1 mã.
@@ -225,9 +349,8 @@ def get_stock_quote(symbol: str) -> dict:
 
     def _get_recent_market_date(sym: str) -> Optional[str]:
         try:
-            end_ = _today_vn()
-            start_ = end_ - timedelta(days=7)
-            hist_df = _quote_history_with_fallback(sym, _ymd(start_), _ymd(end_))
+            end_ = _today_vn().date()
+            hist_df = ohlcv_store.history(sym, end_ - timedelta(days=7), end_)
             if hist_df is None or hist_df.empty:
                 return None
             last_idx = hist_df.index[-1]
@@ -242,24 +365,23 @@ def get_stock_quote(symbol: str) -> dict:
         except Exception:
             return None
 
-    # 1. realtime board
+    # 1. realtime board: đọc snapshot của poller nền; chưa có / đã cũ -> gọi price_board cho riêng mã này
     try:
-        trading = Trading()
-        df = trading.price_board(symbols_list=[symbol])
-        if df is None or df.empty:
-            raise ValueError("Không có dữ liệu cổ phiếu.")
-        df.columns = [f"{a}_{b}" for a, b in df.columns]
-        row = df.iloc[0].to_dict()
-
-        price = row.get("match_match_price")
-        ref = row.get("match_reference_price") or row.get("listing_ref_price")
-        ceil = row.get("match_ceiling_price") or row.get("listing_ceiling")
-        floor = row.get("match_floor_price") or row.get("listing_floor")
-        vol = (
-            row.get("match_accumulated_volume")
-            or row.get("match_match_vol")
-            or 0
-        )
+        snap = price_board.get(symbol)
+        if snap is None:
+            _count_upstream()
+            rows = _fetch_price_board([symbol])
+            price_board.put(rows)
+            if symbol not in rows:
+                raise ValueError("Không có dữ liệu cổ phiếu.")
+            snap = (rows[symbol], time.time())
+        row, snap_ts = snap
+
+        price = row.get("price")
+        ref = row.get("ref")
+        ceil = row.get("ceil")
+        floor = row.get("floor")
+        vol = row.get("volume") or 0
 
         if not price or price == 0:
             raise ValueError("match_price = 0")
@@ -267,7 +389,13 @@ def get_stock_quote(symbol: str) -> dict:
         chg = float(price) - float(ref) if ref else 0.0
         pct = (chg / float(ref) * 100) if ref else 0.0
 
+        # Phiên của giá = nến cuối trong kho OHLCV (đọc local, đuôi refresh theo TTL của kho):
+        # ngày thường nghỉ lễ vẫn nằm trong "giờ giao dịch" nhưng kho không có nến hôm nay.
+        # Kho không đọc được -> mới dựa vào giờ chụp snapshot.
+        snap_dt = datetime.fromtimestamp(snap_ts, VN_TZ)
         market_date_str = _get_recent_market_date(symbol)
+        if market_date_str is None and is_trading_hours(snap_dt):
+            market_date_str = snap_dt.strftime(DATE_FMT)
 
         return {
             "symbol": symbol,
@@ -280,6 +408,8 @@ def get_stock_quote(symbol: str) -> dict:
             "volume": int(vol or 0),
             "timestamp": get_time_vn(),
             "market_date": market_date_str,
+            "snapshot_time": snap_dt.strftime(DATETIME_FMT),
+            "snapshot_age_sec": round(time.time() - snap_ts, 1),
             "source": "VNStock.Trading",
             "fallback": False,
         }
@@ -289,9 +419,8 @@ def get_stock_quote(symbol: str) -> dict:
 
         # 2. Fallback dùng lịch sử
         try:
-            end = _today_vn()
-            start = end - timedelta(days=7)
-            df = _quote_history_with_fallback(symbol, _ymd(start), _ymd(end))
+            end = _today_vn().date()
+            df = ohlcv_store.history(symbol, end - timedelta(days=7), end)
             if df is not None and not df.empty:
                 last = df.iloc[-1]
                 op = float(last.get("open", 0) or 0)
@@ -326,50 +455,77 @@ def get_stock_quote(symbol: str) -> dict:
         return {"symbol": symbol, "price": None, "error": "Không có dữ liệu giao dịch gần đây."}
 
 
-@TTLCache(ttl_seconds=300)
-def get_top_stocks(limit: int = 10, direction: str = "up") -> list:
+@TTLCache(ttl_seconds=300, max_size=4, stale_ttl_seconds=300, shared=True)
+def _get_screener_df() -> tuple:
     """
-    direction: "up" lấy top tăng %, "down" lấy top giảm % (âm nhiều nhất).
+    1 lần Screener toàn thị trường (HOSE/HNX/UPCOM), dùng chung cho top tăng + top giảm.
+    Trả (df, growth_col) đã ép kiểu số cho cột tăng trưởng.
     """
-    try:
-        screener_df = Screener().stock(
-            params={"exchangeName": "HOSE,HNX,UPCOM"}, limit=3000
-        )
-        if screener_df is None or screener_df.empty:
-            raise ValueError("Không có dữ liệu sàng lọc.")
-        growth_col = next(
-            (c for c in screener_df.columns if "growth" in c.lower()), None
-        )
-        if not growth_col:
-            raise ValueError("Không tìm thấy cột tăng trưởng giá.")
-        screener_df[growth_col] = (
-            pd.to_numeric(screener_df[growth_col], errors="coerce")
-            .astype(float)
+    _count_upstream()
+    screener_df = Screener().stock(
+        params={"exchangeName": "HOSE,HNX,UPCOM"}, limit=3000
+    )
+    if screener_df is None or screener_df.empty:
+        raise ValueError("Không có dữ liệu sàng lọc.")
+    growth_col = next(
+        (c for c in screener_df.columns if "growth" in c.lower()), None
+    )
+    if not growth_col:
+        raise ValueError("Không tìm thấy cột tăng trưởng giá.")
+    screener_df = screener_df.copy()
+    screener_df[growth_col] = (
+        pd.to_numeric(screener_df[growth_col], errors="coerce")
+        .astype(float)
+    )
+    return screener_df, growth_col
+
+
+def _movers_from_df(screener_df: pd.DataFrame, growth_col: str, limit: int, direction: str) -> list:
+    ascending = True if direction == "down" else False
+    top_df = screener_df.sort_values(growth_col, ascending=ascending).head(limit)
+
+    out = []
+    for _, row in top_df.iterrows():
+        out.append(
+            {
+                "symbol": (row.get("ticker") or row.get("symbol") or "").upper(),
+                "exchange": row.get("exchange", "") or "",
+                "price": row.get("price_near_realtime") or row.get("close_price"),
+                "pct_change": round(float(row[growth_col] or 0.0), 2),
+                "volume": int(row.get("avg_trading_value_10d", 0) or 0),
+                "timestamp": get_time_vn(),
+            }
         )
+    return out
 
-        ascending = True if direction == "down" else False
-        top_df = screener_df.sort_values(growth_col, ascending=ascending).head(limit)
 
-        out = []
-        for _, row in top_df.iterrows():
-            out.append(
-                {
-                    "symbol": (row.get("ticker") or row.get("symbol") or "").upper(),
-                    "exchange": row.get("exchange", "") or "",
-                    "price": row.get("price_near_realtime") or row.get("close_price"),
-                    "pct_change": round(float(row[growth_col] or 0.0), 2),
-                    "volume": int(row.get("avg_trading_value_10d", 0) or 0),
-                    "timestamp": get_time_vn(),
-                }
-            )
-        return out
+def get_top_movers(limit: int = 10) -> Dict[str, list]:
+    """Top tăng + top giảm từ CÙNG 1 kết quả Screener."""
+    try:
+        screener_df, growth_col = _get_screener_df()
+        return {
+            "up": _movers_from_df(screener_df, growth_col, limit, "up"),
+            "down": _movers_from_df(screener_df, growth_col, limit, "down"),
+        }
+    except Exception as e:
+        print(f"[VNStock] Lỗi top movers: {e}")
+        return {"up": [], "down": []}
+
+
+def get_top_stocks(limit: int = 10, direction: str = "up") -> list:
+    """
+    direction: "up" lấy top tăng %, "down" lấy top giảm % (âm nhiều nhất).
+    """
+    try:
+        screener_df, growth_col = _get_screener_df()
+        return _movers_from_df(screener_df, growth_col, limit, direction)
     except Exception as e:
         print(f"[VNStock] Lỗi top movers: {e}")
         return []
 
 
-def format_top_stocks(direction: str = "up", limit: int = 5) -> str:
-    arr = get_top_stocks(limit=limit, direction=direction)
+def format_top_stocks(direction: str = "up", limit: int = 5, items: Optional[list] = None) -> str:
+    arr = items if items is not None else get_top_stocks(limit=limit, direction=direction)
     if not arr:
         label = "Tăng" if direction == "up" else "Giảm"
         return f"🚫 Top {label} tạm thời không có dữ liệu."
@@ -385,7 +541,7 @@ def format_top_stocks(direction: str = "up", limit: int = 5) -> str:
     return "\n".join(lines)
 
 
-@TTLCache(ttl_seconds=300)
+@TTLCache(ttl_seconds=300, max_size=1024)
 def get_history_prices(symbol: str, days: int = 7) -> dict:
     """
     Lấy lịch sử giá khoảng N phiên gần nhất (không phải đúng N ngày lịch).
@@ -397,9 +553,9 @@ def get_history_prices(symbol: str, days: int = 7) -> dict:
         return {"symbol": symbol, "error": str(ve)}
 
     try:
-        end = _today_vn()
+        end = _today_vn().date()
         start = end - timedelta(days=days + 14)
-        df = _quote_history_with_fallback(symbol, _ymd(start), _ymd(end))
+        df = ohlcv_store.history(symbol, start, end)
         if df is None or df.empty:
             raise ValueError("Không có dữ liệu lịch sử.")
 
@@ -440,14 +596,14 @@ def get_history_prices(symbol: str, days: int = 7) -> dict:
             "history": recs,
             "days": days,
             "timestamp": get_time_vn(),
-            "source": "VNStock.Quote(FallbackOK)",
+            "source": "VNStock.Quote(LocalStore)",
         }
     except Exception as e:
         print(f"[VNStock] Lỗi lịch sử {symbol}: {e}")
         return {"symbol": symbol, "error": str(e)}
 
 
-@TTLCache(ttl_seconds=300)
+@TTLCache(ttl_seconds=300, max_size=2048)
 def get_price_at_date(
     symbol: str,
     target_date: date,
@@ -468,15 +624,13 @@ def get_price_at_date(
     if not isinstance(target_date, date):
         return {"symbol": sym, "error": "target_date phải là datetime.date"}
 
-    # Lấy 1 khoảng xung quanh target_date để chắc ăn
-    target_dt = datetime.combine(target_date, datetime.min.time())
-    target_dt = VN_TZ.localize(target_dt)
-    start_dt = target_dt - timedelta(days=window_days)
-    end_dt = target_dt + timedelta(days=window_days)
-
+    # Lấy 1 khoảng xung quanh target_date để chắc ăn (đọc từ kho local)
     try:
-        df = _quote_history_with_fallback(sym, _ymd(start_dt), _ymd(end_dt))
-        df = _normalize_history_df(df)
+        df = ohlcv_store.history(
+            sym,
+            target_date - timedelta(days=window_days),
+            target_date + timedelta(days=window_days),
+        )
         if df is None or df.empty:
             raise ValueError("Không có dữ liệu lịch sử quanh ngày yêu cầu.")
     except Exception as e:
@@ -524,7 +678,7 @@ def _to_vn_aware(dt_: datetime) -> datetime:
     return dt_.astimezone(VN_TZ)
 
 
-@TTLCache(ttl_seconds=300)
+@TTLCache(ttl_seconds=300, max_size=256, shared=True)
 def get_history_df_vnstock(
     symbol: str, start: Optional[str] = None, end: Optional[str] = None
 ) -> pd.DataFrame:
@@ -543,15 +697,14 @@ def get_history_df_vnstock(
     )
     start_dt = _to_vn_aware(start_dt)
 
-    df = _quote_history_with_fallback(symbol, _ymd(start_dt), _ymd(end_dt))
-    df = _normalize_history_df(df)
+    df = ohlcv_store.history(symbol, start_dt.date(), end_dt.date())
     if df.empty:
         raise ValueError(f"VNStock: không có dữ liệu hợp lệ cho {symbol} (normalize)")
     df = df.asfreq("D").ffill()
     return df[["open", "high", "low", "close", "volume"]]
 
 
-@TTLCache(ttl_seconds=300)
+@TTLCache(ttl_seconds=300, max_size=256)
 def get_prices_df(symbol: str, days: int = 365) -> pd.DataFrame:
     end = _today_vn()
     start = end - timedelta(days=days + 14)
@@ -561,7 +714,7 @@ def get_prices_df(symbol: str, days: int = 365) -> pd.DataFrame:
     return df.tail(days).asfreq("D").ffill()[["open", "high", "low", "close", "volume"]]
 
 
-@TTLCache(ttl_seconds=300)
+@TTLCache(ttl_seconds=300, max_size=256)
 def get_close_series(symbol: str, days: int = 365) -> pd.Series:
     df = get_prices_df(symbol, days=days)
     s = df["close"].astype("float64")
@@ -569,6 +722,20 @@ def get_close_series(symbol: str, days: int = 365) -> pd.Series:
     return s
 
 
+# Universe cho job refresh kho OHLCV: các mã đã có trong kho + danh sách cấu hình thêm
+OHLCV_UNIVERSE = [x.strip().upper() for x in os.getenv("OHLCV_UNIVERSE", "").split(",") if x.strip()]
+OHLCV_BACKFILL_DAYS = int(os.getenv("OHLCV_BACKFILL_DAYS", 730))
+
+
+def refresh_ohlcv_universe(symbols: Optional[Iterable[str]] = None) -> Dict[str, object]:
+    """
+    Đồng bộ đuôi kho OHLCV cho cả universe (chạy sau giờ đóng cửa / trong scheduler).
+    Mã chưa có trong kho được backfill OHLCV_BACKFILL_DAYS ngày.
+    """
+    universe = set(symbols or []) | set(ohlcv_store.symbols()) | set(OHLCV_UNIVERSE)
+    return ohlcv_store.refresh(universe, backfill_days=OHLCV_BACKFILL_DAYS)
+
+
 from pandas.api.types import is_numeric_dtype, is_datetime64_any_dtype
 
 
@@ -705,59 +872,40 @@ def _resample_ticks_to_ohlcv(
     interval: str = "5m",
     debug: bool = False,
 ) -> pd.DataFrame:
+    """Ticks 1 mã -> OHLCV (bin neo theo phiên, không tạo nến trong giờ nghỉ trưa)."""
     if ticks is None or ticks.empty:
         return pd.DataFrame(columns=["open", "high", "low", "close", "volume"])
+    return resample_ticks(ticks, interval=interval).astype("float64")
 
-    rule = _to_min_rule(interval)
-    df = ticks.sort_index()
 
-    try:
-        ohlc = df["price"].resample(rule).ohlc()
-        try:
-            vol = df["volume"].resample(rule).sum(min_count=1)
-        except TypeError:
-            vol = df["volume"].resample(rule).sum()
-        out = pd.concat([ohlc, vol.rename("volume")], axis=1)
-        out = out.dropna(subset=["close"], how="all")
-        if not out.empty:
-            return out.astype(
-                {
-                    "open": "float64",
-                    "high": "float64",
-                    "low": "float64",
-                    "close": "float64",
-                    "volume": "float64",
-                }
-            )
-    except Exception:
-        pass
+def _normalize_intraday_raw(raw: pd.DataFrame, debug: bool = False) -> tuple:
+    """Dữ liệu intraday thô -> ("ohlc", bars) nếu nguồn trả nến, ngược lại ("ticks", price/volume)."""
+    if raw is None or getattr(raw, "empty", True):
+        return "ticks", pd.DataFrame(columns=["price", "volume"])
+    cols = {str(c).lower() for c in raw.columns}
+    if len({"open", "high", "low", "close"} & cols) >= 2:
+        return "ohlc", _normalize_intraday_ohlc_df(raw)
+    return "ticks", _normalize_ticks_df(raw, debug=debug)
 
-    floored = df.index.floor(rule)
-    gb = df.groupby(floored)
-    out2 = (
-        pd.DataFrame(
-            {
-                "open": gb["price"].first(),
-                "high": gb["price"].max(),
-                "low": gb["price"].min(),
-                "close": gb["price"].last(),
-                "volume": gb["volume"].sum(min_count=1)
-                if hasattr(gb["volume"], "sum")
-                else gb["volume"].sum(),
-            }
+
+def _bars_from_intraday(kind: str, data: pd.DataFrame, interval: str, days: int,
+                        debug: bool = False) -> pd.DataFrame:
+    """Dựng nến `interval` từ ticks / nến mịn hơn, cắt theo days."""
+    if data is None or data.empty:
+        return pd.DataFrame(columns=["open", "high", "low", "close", "volume"])
+    if kind == "ohlc":
+        df = (
+            data.resample(_to_min_rule(interval))
+            .agg({"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+            .dropna(subset=["close"], how="all")
         )
-        .dropna(subset=["close"], how="all")
-        .sort_index()
-    )
-    return out2.astype(
-        {
-            "open": "float64",
-            "high": "float64",
-            "low": "float64",
-            "close": "float64",
-            "volume": "float64",
-        }
-    )
+    else:
+        df = _resample_ticks_to_ohlcv(data, interval=interval, debug=debug)
+
+    if not df.empty and days:
+        cutoff = _today_vn().date() - timedelta(days=max(0, int(days) - 1))
+        df = df[df.index.date >= cutoff]
+    return df
 
 
 def _finalize_intraday(
@@ -769,26 +917,158 @@ def _finalize_intraday(
     """
     Nhận ticks hoặc OHLC-like → chuẩn hoá về OHLCV + cắt theo days.
     """
-    if raw is None or getattr(raw, "empty", True):
-        return pd.DataFrame(columns=["open", "high", "low", "close", "volume"])
+    kind, data = _normalize_intraday_raw(raw, debug=debug)
+    if kind == "ohlc":
+        # Giữ nguyên độ phân giải nguồn trả về
+        if not data.empty and days:
+            cutoff = _today_vn().date() - timedelta(days=max(0, int(days) - 1))
+            data = data[data.index.date >= cutoff]
+        return data
+    return _bars_from_intraday(kind, data, interval, days, debug=debug)
 
-    cols = {c.lower() for c in raw.columns}
-    is_ohlc_like = len({"open", "high", "low", "close"} & cols) >= 2
 
-    if is_ohlc_like:
-        df = _normalize_intraday_ohlc_df(raw)
-    else:
-        ticks_norm = _normalize_ticks_df(raw, debug=debug)
-        df = _resample_ticks_to_ohlcv(ticks_norm, interval=interval, debug=debug)
+# ====== Bộ đệm tick intraday: 1 lần fetch / mã / chu kỳ refresh, mọi độ phân giải dựng local ======
+INTRADAY_TICKS_TTL = float(os.getenv("INTRADAY_TICKS_TTL", 30))
+INTRADAY_BUFFER_DAYS = int(os.getenv("INTRADAY_BUFFER_DAYS", 2))
 
-    if not df.empty and days:
-        cutoff = _today_vn().date() - timedelta(days=max(0, int(days) - 1))
-        df = df[df.index.date >= cutoff]
 
-    return df
+class IntradayTickBuffer:
+    """
+    Mỗi mã giữ (kind, data, fetched_at):
+    - refresh tối đa 1 lần / ttl giây, single-flight theo mã (các thread khác chờ chung).
+    - lần fetch mới thay phần dữ liệu từ tick đầu tiên của nó trở đi, giữ phần cũ hơn
+      (nguồn chỉ trả cửa sổ tick gần nhất / phiên hôm qua vẫn dùng được cho days=2).
+    - bỏ dữ liệu cũ hơn keep_days ngày.
+    """
+
+    def __init__(self, ttl: float = INTRADAY_TICKS_TTL, keep_days: int = INTRADAY_BUFFER_DAYS,
+                 max_symbols: int = 512):
+        self.ttl = float(ttl)
+        self.keep_days = int(keep_days)
+        self.max_symbols = int(max_symbols)
+        self._data: Dict[str, tuple] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._stats = {"hits": 0, "fetches": 0, "fetch_errors": 0}
+
+    def _lock_of(self, sym: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(sym, threading.Lock())
+
+    def _fetch(self, sym: str, debug: bool = False) -> Optional[tuple]:
+        def fetch(src: str) -> tuple:
+            _count_upstream()
+            return _normalize_intraday_raw(Quote(symbol=sym, source=src).intraday(), debug=debug)
+
+        with self._guard:
+            self._stats["fetches"] += 1
+        try:
+            (kind, data), src = intraday_sources.call(
+                _with_upstream_counter(fetch),
+                symbol=sym,
+                accept=lambda r: r is not None and not r[1].empty,
+                hedge_after=INTRADAY_HEDGE_AFTER_SEC,
+            )
+        except RuntimeError as e:
+            if debug:
+                print(f"[IntradayBuffer] {sym}: {e}")
+            src = None
+        if src is None:
+            with self._guard:
+                self._stats["fetch_errors"] += 1
+            return None
+        return kind, data
+
+    def _merge(self, old: Optional[tuple], new: tuple) -> tuple:
+        kind, data = new
+        if old is not None and old[0] == kind and not old[1].empty:
+            head = old[1][old[1].index < data.index.min()]
+            data = pd.concat([head, data]) if not head.empty else data
+        cutoff = pd.Timestamp(_today_vn().date() - timedelta(days=max(0, self.keep_days - 1)))
+        return kind, data[data.index >= cutoff]
+
+    def get(self, symbol: str, debug: bool = False) -> tuple:
+        """(kind, data) của mã; rỗng nếu mọi nguồn lỗi và chưa có gì trong bộ đệm."""
+        sym = symbol.upper()
+        with self._lock_of(sym):
+            entry = self._data.get(sym)
+            if entry is not None and time.time() - entry[2] < self.ttl:
+                with self._guard:
+                    self._stats["hits"] += 1
+                return entry[0], entry[1]
+
+            fetched = self._fetch(sym, debug=debug)
+            if fetched is None:
+                # Upstream lỗi: dùng tạm bộ đệm cũ (nếu có), thử lại sau ttl
+                if entry is None:
+                    return "ticks", pd.DataFrame(columns=["price", "volume"])
+                self._data[sym] = (entry[0], entry[1], time.time())
+                return entry[0], entry[1]
+
+            kind, data = self._merge(entry[:2] if entry else None, fetched)
+            with self._guard:
+                self._data[sym] = (kind, data, time.time())
+                while len(self._data) > self.max_symbols:
+                    self._data.pop(next(iter(self._data)))
+            return kind, data
+
+    def bars(self, symbol: str, interval: str = "5m", days: int = 1, debug: bool = False) -> pd.DataFrame:
+        kind, data = self.get(symbol, debug=debug)
+        return _bars_from_intraday(kind, data, interval, days, debug=debug)
+
+    def stats(self) -> Dict[str, object]:
+        with self._guard:
+            s = dict(self._stats)
+            s["symbols"] = len(self._data)
+        return s
+
+
+intraday_buffer = IntradayTickBuffer()
+
+INTRADAY_MULTI_DEADLINE = float(os.getenv("INTRADAY_MULTI_DEADLINE", 20))
+
+
+def get_intraday_bars_multi(
+    symbols: Iterable[str], interval: str = "5m", days: int = 1, debug: bool = False
+) -> Dict[str, pd.DataFrame]:
+    """
+    OHLCV intraday cho cả watchlist: làm mới bộ đệm tick song song, rồi ghép ticks mọi mã
+    thành 1 bảng long và resample 1 lượt (vector hoá). Mã không có dữ liệu bị bỏ qua.
+    """
+    syms = []
+    for s in symbols:
+        sym = _sanitize_symbol(s)
+        if 3 <= len(sym) <= 10 and sym not in syms:
+            syms.append(sym)
+    got, _ = fan_out(
+        {sym: (lambda sym=sym: intraday_buffer.get(sym, debug=debug)) for sym in syms},
+        timeout=INTRADAY_MULTI_DEADLINE,
+    )
 
+    out: Dict[str, pd.DataFrame] = {}
+    tick_frames = []
+    # Ghép theo thứ tự mã (tick từng mã đã sort theo thời gian) -> resample bỏ qua được bước sort
+    for sym in sorted(syms):
+        kind, data = got.get(sym, ("ticks", None))
+        if data is None or data.empty:
+            continue
+        if kind == "ohlc":
+            out[sym] = _bars_from_intraday(kind, data, interval, days, debug=debug)
+        else:
+            tick_frames.append(
+                pd.DataFrame({"symbol": sym, "time": data.index,
+                              "price": data["price"].to_numpy(), "volume": data["volume"].to_numpy()})
+            )
+    if tick_frames:
+        bars = resample_ticks_multi(pd.concat(tick_frames, ignore_index=True), interval=interval)
+        if days:
+            cutoff = pd.Timestamp(_today_vn().date() - timedelta(days=max(0, int(days) - 1)))
+            bars = bars[bars["time"] >= cutoff]
+        out.update(split_by_symbol(bars))
+    return out
 
-@TTLCache(ttl_seconds=60)
+
+@TTLCache(ttl_seconds=INTRADAY_TICKS_TTL, max_size=256)
 def get_intraday_df(
     symbol: str,
     interval: str = "5m",
@@ -798,9 +1078,9 @@ def get_intraday_df(
 ) -> pd.DataFrame:
     """
     Lấy intraday OHLCV:
-      - Ưu tiên: Quote(symbol=SYM).intraday()
-      - sau đó Quote().intraday(symbol=SYM)
-      - thử các source VCI, TCBS, MSN
+      - source chỉ định: Quote(symbol=SYM, source=...).intraday(), rồi Quote(source=...).intraday(symbol=SYM)
+      - không chỉ định: bộ đệm tick dùng chung (1 lần fetch / mã / INTRADAY_TICKS_TTL giây,
+        VCI / TCBS / MSN theo sức khoẻ nguồn), nến 1m/5m/15m... dựng local từ bộ đệm
       - fallback Trading/Data
     """
     sym = _sanitize_symbol(symbol)
@@ -809,36 +1089,29 @@ def get_intraday_df(
     except ValueError:
         return pd.DataFrame(columns=["open", "high", "low", "close", "volume"])
 
-    # 1) Quote(symbol=...).intraday()
-    try:
-        q = Quote(symbol=sym) if source is None else Quote(symbol=sym, source=source)
-        raw = q.intraday()
-        df = _finalize_intraday(raw, interval, days, debug=debug)
-        if not df.empty:
-            return df
-    except Exception:
-        pass
-
-    # 2) Quote().intraday(symbol=SYM)
-    try:
-        q2 = Quote() if source is None else Quote(source=source)
-        raw2 = q2.intraday(symbol=sym)
-        df2 = _finalize_intraday(raw2, interval, days, debug=debug)
-        if not df2.empty:
-            return df2
-    except Exception:
-        pass
+    if source is not None:
+        # 1) Quote(symbol=...).intraday()
+        try:
+            raw = Quote(symbol=sym, source=source).intraday()
+            df = _finalize_intraday(raw, interval, days, debug=debug)
+            if not df.empty:
+                return df
+        except Exception:
+            pass
 
-    # 3) thử nguồn cụ thể
-    for src in ("VCI", "TCBS", "MSN"):
+        # 2) Quote().intraday(symbol=SYM)
         try:
-            qx = Quote(symbol=sym, source=src)
-            rawx = qx.intraday()
-            dfx = _finalize_intraday(rawx, interval, days, debug=debug)
-            if not dfx.empty:
-                return dfx
+            raw2 = Quote(source=source).intraday(symbol=sym)
+            df2 = _finalize_intraday(raw2, interval, days, debug=debug)
+            if not df2.empty:
+                return df2
         except Exception:
-            continue
+            pass
+    else:
+        # 3) bộ đệm tick (VCI / TCBS / MSN theo sức khoẻ nguồn) -> dựng nến `interval` local
+        dfx = intraday_buffer.bars(sym, interval=interval, days=days, debug=debug)
+        if not dfx.empty:
+            return dfx
 
     # 4) Trading().intraday
     try:
@@ -908,22 +1181,61 @@ def format_stock_info(symbol: str) -> str:
     return body
 
 
-@TTLCache(ttl_seconds=300)
+MARKET_SUMMARY_DEADLINE = float(os.getenv("MARKET_SUMMARY_DEADLINE", 6))
+MARKET_SUMMARY_TTL = 300
+# Tóm tắt thiếu phần (task quá hạn / lỗi) chỉ giữ ngắn để lần hỏi sau build lại đủ
+MARKET_SUMMARY_PARTIAL_TTL = float(os.getenv("MARKET_SUMMARY_PARTIAL_TTL", 30))
+_MARKET_SUMMARY_ERROR = "⚠️ Không thể lấy dữ liệu thị trường."
+
+
 def format_market_summary(indices: list[str] = None) -> str:
     """
     Tóm tắt thị trường:
-    - VNINDEX, VN30, HNX, UPCOM
-    - Top tăng / top giảm (3 mã mỗi nhóm)
+    - VNINDEX, VN30, HNX, UPCOM (lấy song song)
+    - Top tăng / top giảm (3 mã mỗi nhóm) từ 1 lần Screener
     - Gắn timestamp
     """
+    return build_market_summary(indices)[0]
+
+
+def _market_summary_ttl(result: Tuple[str, Dict[str, object]]) -> float:
+    """Không cache câu báo lỗi; bản thiếu phần cache ngắn; bản đủ cache MARKET_SUMMARY_TTL."""
+    text, stats = result
+    if text == _MARKET_SUMMARY_ERROR:
+        return 0
+    if stats.get("timeouts") or stats.get("failed"):
+        return MARKET_SUMMARY_PARTIAL_TTL
+    return MARKET_SUMMARY_TTL
+
+
+@TTLCache(ttl_seconds=MARKET_SUMMARY_TTL, max_size=16, stale_ttl_seconds=120, ttl_for=_market_summary_ttl)
+def build_market_summary(indices: list[str] = None) -> Tuple[str, Dict[str, object]]:
+    """
+    (text tóm tắt thị trường, thống kê của đúng lần build đó: số call upstream,
+    số call tiết kiệm, thời gian, task quá hạn / lỗi). Cache chung 1 entry cho cả 2
+    (theo _market_summary_ttl).
+    """
+    stats: Dict[str, object] = {}
     try:
         if indices is None:
             indices = ["VNINDEX", "VN30", "HNX", "UPCOM"]
 
+        # price_board của vnstock không nhận mã chỉ số -> không gộp được thành 1 call,
+        # nên fan-out song song từng chỉ số + 1 Screener cho cả top tăng/giảm.
+        t0 = time.perf_counter()
+        tasks = {f"idx:{idx}": (lambda idx=idx: _counted(get_index_detail, idx)) for idx in indices}
+        tasks["movers"] = lambda: _counted(get_top_movers, 3)
+        results, info = fan_out(tasks, timeout=MARKET_SUMMARY_DEADLINE)
+
         summaries = []
+        failed = [k for k, v in info.items() if v["status"] == "error"]
+        upstream_calls = 0
         for idx in indices:
-            data = get_index_detail(idx)
+            data, n_calls = results.get(f"idx:{idx}", ({"error": "timeout"}, 0))
+            upstream_calls += n_calls
             if "error" in data:
+                if f"idx:{idx}" in results:
+                    failed.append(f"idx:{idx}")
                 continue
             emoji = "📈" if data["change"] > 0 else "📉" if data["change"] < 0 else "⏸️"
             summaries.append(
@@ -931,20 +1243,37 @@ def format_market_summary(indices: list[str] = None) -> str:
                 f"({data['change']:+.2f}, {data['percent_change']:+.2f}%)"
             )
 
+        movers, screener_calls = results.get("movers", ({"up": [], "down": []}, 0))
+        if "movers" in results and not (movers["up"] or movers["down"]):
+            failed.append("movers")
+        upstream_calls += screener_calls
+        # Cách cũ: mỗi chiều top tăng/giảm gọi Screener riêng -> tốn thêm đúng số call Screener đã dùng
+        saved_calls = screener_calls
+        stats = {
+            "upstream_calls": upstream_calls,
+            "sequential_calls": upstream_calls + saved_calls,
+            "saved_calls": saved_calls,
+            "wall_sec": round(time.perf_counter() - t0, 3),
+            "sum_call_sec": round(sum(v.get("sec", 0.0) for v in info.values()), 3),
+            "timeouts": [k for k, v in info.items() if v["status"] == "timeout"],
+            "failed": failed,
+        }
+        print(f"[VNStock] Market summary: {stats}")
+
         if not summaries:
-            return "⚠️ Không thể lấy dữ liệu thị trường."
+            return _MARKET_SUMMARY_ERROR, stats
 
         return (
             f"📊 **TỔNG QUAN THỊ TRƯỜNG VIỆT NAM**  \n"
             + "  \n".join(summaries)
             + "  \n\n"
-            + f"{format_top_stocks('up', 3)}  \n\n"
-            + f"{format_top_stocks('down', 3)}  \n"
+            + f"{format_top_stocks('up', 3, items=movers['up'])}  \n\n"
+            + f"{format_top_stocks('down', 3, items=movers['down'])}  \n"
             + f"🕒 Cập nhật: {get_time_vn()}"
-        )
+        ), stats
     except Exception as e:
         print(f"[VNStock] Lỗi tóm tắt thị trường: {e}")
-        return "⚠️ Không thể lấy dữ liệu thị trường."
+        return _MARKET_SUMMARY_ERROR, stats
 
 
 def format_history_text(symbol: str, days: int, data: dict) -> str:
@@ -1015,20 +1344,28 @@ __all__ = [
     "DATE_FMT",
     "DATETIME_FMT",
     "TTLCache",
+    "ttl_cache_stats",
     "get_time_vn",
     "discover_market_indices",
     "get_index_detail",
     "get_stock_quote",
+    "price_board",
     "get_top_stocks",
+    "get_top_movers",
     "get_history_prices",
     "get_price_at_date",
     "get_history_df_vnstock",
     "get_prices_df",
     "get_close_series",
+    "refresh_ohlcv_universe",
+    "resolve_symbols",
     "get_intraday_df",
+    "intraday_buffer",
+    "get_intraday_bars_multi",
     "format_stock_info",
     "format_top_stocks",
     "format_market_summary",
+    "build_market_summary",
     "format_history_text",
     "format_price_at_date",
     "_same_trading_day",
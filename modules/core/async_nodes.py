@@ -0,0 +1,35 @@
+"""
+Bản async cho các node của graph (dùng khi chạy graph.ainvoke).
+- Node có I/O async thật (LLM: astream) -> dùng thẳng coroutine.
+- Node còn lại (vnstock / Qdrant / Redis / model CPU đều là client sync) -> chạy trong
+  thread pool giới hạn, event loop không bị block nên 1 process phục vụ được nhiều hội thoại.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from langchain_core.runnables import RunnableLambda
+
+GRAPH_NODE_WORKERS = int(os.getenv("GRAPH_NODE_WORKERS", 32))
+
+_node_pool = ThreadPoolExecutor(max_workers=GRAPH_NODE_WORKERS, thread_name_prefix="graph-node")
+
+
+def offload(fn: Callable) -> Callable:
+    """Bọc node sync thành coroutine chạy trong _node_pool (giữ contextvars cho callback LangGraph)."""
+
+    @functools.wraps(fn)
+    async def _async_node(state):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(_node_pool, ctx.run, fn, state)
+
+    return _async_node
+
+
+def dual_node(fn: Callable, afn: Optional[Callable] = None) -> RunnableLambda:
+    """Node dùng được cho cả graph.invoke (fn) và graph.ainvoke (afn hoặc fn offload)."""
+    return RunnableLambda(fn, afunc=afn or offload(fn), name=fn.__name__)
@@ -1,12 +1,13 @@
 from langgraph.graph import StateGraph, START, END
 from .state import GlobalState
-from modules.nodes.cache import load_cache, save_cache
+from .async_nodes import dual_node
+from modules.nodes.cache import load_cache, save_cache, lookup_answer_cache
 from modules.nodes.processor import processor_query
 from modules.nodes.embedder import embed_query
 from modules.nodes.vector_db import search_vector_db
 from modules.nodes.retriever import retrieve_documents
 from modules.nodes.prompt_builder import build_prompt
-from modules.nodes.response_generator import response_node
+from modules.nodes.response_generator import response_node, aresponse_node
 # from modules.utils.debug import debug_summary_node
 from modules.nodes.router import route_intent
 from modules.nodes.reranker import rerank_documents
@@ -14,21 +15,32 @@ from modules.nodes.reranker import rerank_documents
 def build_graph():
     workflow = StateGraph(GlobalState)
 
-    workflow.add_node("load_cache", load_cache)
-    workflow.add_node("processor", processor_query)
-    workflow.add_node("router", route_intent)
-    workflow.add_node("embedder", embed_query)
-    workflow.add_node("vector_db", search_vector_db)
-    workflow.add_node("reranker", rerank_documents)
-    workflow.add_node("retriever", retrieve_documents)
-    workflow.add_node("prompt_builder", build_prompt)
-    workflow.add_node("response_node", response_node)
+    # Mỗi node có 2 bản: sync cho graph.invoke/stream (Streamlit), async cho graph.ainvoke (HTTP /chat)
+    workflow.add_node("load_cache", dual_node(load_cache))
+    workflow.add_node("processor", dual_node(processor_query))
+    workflow.add_node("answer_cache", dual_node(lookup_answer_cache))
+    workflow.add_node("router", dual_node(route_intent))
+    workflow.add_node("embedder", dual_node(embed_query))
+    workflow.add_node("vector_db", dual_node(search_vector_db))
+    workflow.add_node("reranker", dual_node(rerank_documents))
+    workflow.add_node("retriever", dual_node(retrieve_documents))
+    workflow.add_node("prompt_builder", dual_node(build_prompt))
+    workflow.add_node("response_node", dual_node(response_node, aresponse_node))
     # workflow.add_node("debug_summary", debug_summary_node)
-    workflow.add_node("save_cache", save_cache)
+    workflow.add_node("save_cache", dual_node(save_cache))
 
     workflow.add_edge(START, "load_cache")
     workflow.add_edge("load_cache", "processor")
-    workflow.add_edge("processor", "router")
+    workflow.add_edge("processor", "answer_cache")
+    # Cache hit -> lưu lịch sử luôn, bỏ qua retrieval / rerank / LLM
+    workflow.add_conditional_edges(
+        "answer_cache",
+        lambda state: "save_cache" if getattr(state, "answer_cache_hit", False) else "router",
+        {
+            "save_cache": "save_cache",
+            "router": "router",
+        }
+    )
     workflow.add_conditional_edges(
         "router", 
         lambda state: getattr(state, "route_to", "rag"),
@@ -2,6 +2,7 @@ from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional
 from langgraph.graph.message import add_messages
 import uuid, time, datetime
+import os
 import re
 
 
@@ -31,12 +32,17 @@ class GlobalState:
     # Đánh dấu nếu lấy từ redis
     from_cache: bool = False
     cached_response: Optional[str] = None
+    # True nếu câu trả lời lấy từ answer cache (bỏ qua router -> response_node)
+    answer_cache_hit: bool = False
 
     # Vector embedding cho processed_query
     query_embedding: Optional[Dict[str, Any]] = None
     # Kết quả tìm kiếm trong vector DB (ID + score)
     search_results: List[Dict[str, Any]] = field(default_factory=list)
 
+    # Chế độ retrieval: "client" (2 query + RRF ở retriever) | "server" (prefetch + RRF trong Qdrant)
+    retrieval_mode: str = field(default_factory=lambda: os.getenv("RETRIEVAL_MODE", "client"))
+
     search_results_dense: List[Dict[str, Any]] = field(default_factory=list)
     search_results_sparse: List[Dict[str, Any]] = field(default_factory=list)
     # Docs thực tế được lấy từ retriever
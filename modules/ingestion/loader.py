@@ -1,4 +1,5 @@
 import os
+import time
 from typing import List, Dict, Optional
 from qdrant_client import models
 from modules.utils.services import qdrant_services, embedder_services, sentiment_services
@@ -70,6 +71,14 @@ def _stable_point_id(d: Dict, j: int) -> str:
     m.update(str(j).encode("utf-8"))
     return m.hexdigest()
 
+def _embed_text(d: Dict) -> str:
+    """Text dùng để embed: summary + content (nếu có summary)."""
+    summary = (d.get("summary", "") or "").strip()
+    content = (d.get("content", "") or "").strip()
+    if summary:
+        return (summary + "\n" + content).strip()
+    return content
+
 def load_to_vector_db(
     docs: List[Dict],
     collection_name: Optional[str] = None,
@@ -106,72 +115,155 @@ def load_to_vector_db(
         print("[Loader] 0 docs hợp lệ.")
         return 0
 
+    all_texts = [_embed_text(d) for d in valid]
+
+    # Cập nhật thống kê BM25 1 lần cho toàn bộ doc mới (term id cũ giữ nguyên),
+    # không fit lại theo từng batch. Chỉ cập nhật RAM để encode; ghi đĩa sau khi upsert xong.
+    bm25 = embedder_services.bm25_stats
+    bm25_snap = None
+    try:
+        bm25_snap = bm25.snapshot()
+        embedder_services.update_bm25(all_texts, persist=False)
+    except Exception as e:
+        print(f"[Loader] Lỗi khi cập nhật thống kê BM25: {e}")
+
     total = 0
-    for start in range(0, len(valid), batch_size):
-        batch = valid[start : start + batch_size]
-        senti_res = _infer_sentiment_batch(batch)
-
-        texts = []
-        for b in batch:
-            summary = (b.get("summary", "") or "").strip()
-            content = (b.get("content", "") or "").strip()
-            if summary:
-                txt = (summary + "\n" + content).strip()
-            else:
-                txt = content
-            texts.append(txt)
-
-        dense_vecs = embedder_services.encode_dense(texts)
-
-        try:
-            embedder_services.fit_bm25(texts)
-        except Exception as e:
-            print(f"[Loader] Lỗi khi fit BM25: {e}")
-
-        try:
-            sparse_vecs = embedder_services.encode_sparse(texts)
-        except Exception as e:
-            print(f"[Loader] Lỗi khi encode sparse vectors: {e}")
-            sparse_vecs = [{"indices": [], "values": []} 
-                           for _ in texts]
-
-        points: List[models.PointStruct] = []
-        for j, d in enumerate(batch):
-            pid = _stable_point_id(d, j)
-            sp = sparse_vecs[j]
-            s_out = senti_res[j] if j < len(senti_res) else _neutral_pack()
-
-            payload = {
-                "id": pid,
-                "title": d.get("title", "") or "",
-                "url": d.get("url", "") or "",
-                "time": d.get("time", "") or "",
-                "time_ts": int(d.get("time_ts", 0)),
-                "summary": d.get("summary", "") or "",
-                "content": d.get("content", "") or "",
-                "symbols": list(d.get("symbols", []) or []),
-                "index_codes": list(d.get("index_codes", []) or []),
-                "sentiment": float(s_out.get("sentiment", 0.0)),
-                "label": str(s_out.get("label", "neu")),
-                "source": d.get("source", "cafef") or "cafef",
-            }
+    try:
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start : start + batch_size]
+            senti_res = _infer_sentiment_batch(batch)
+
+            texts = all_texts[start : start + batch_size]
+
+            t0 = time.perf_counter()
+            dense_vecs = embedder_services.encode_dense(texts)
+            dt = time.perf_counter() - t0
+            print(
+                f"[Loader] Dense encode {len(texts)} docs trong {dt:.2f}s "
+                f"({len(texts) / max(dt, 1e-9):.1f} docs/s)"
+            )
+
+            try:
+                sparse_vecs = embedder_services.encode_sparse(texts)
+            except Exception as e:
+                print(f"[Loader] Lỗi khi encode sparse vectors: {e}")
+                sparse_vecs = [{"indices": [], "values": []} 
+                               for _ in texts]
+
+            points: List[models.PointStruct] = []
+            for j, d in enumerate(batch):
+                pid = _stable_point_id(d, j)
+                sp = sparse_vecs[j]
+                s_out = senti_res[j] if j < len(senti_res) else _neutral_pack()
+
+                payload = {
+                    "id": pid,
+                    "title": d.get("title", "") or "",
+                    "url": d.get("url", "") or "",
+                    "time": d.get("time", "") or "",
+                    "time_ts": int(d.get("time_ts", 0)),
+                    "summary": d.get("summary", "") or "",
+                    "content": d.get("content", "") or "",
+                    "symbols": list(d.get("symbols", []) or []),
+                    "index_codes": list(d.get("index_codes", []) or []),
+                    "sentiment": float(s_out.get("sentiment", 0.0)),
+                    "label": str(s_out.get("label", "neu")),
+                    "source": d.get("source", "cafef") or "cafef",
+                }
+
+                points.append(
+                    models.PointStruct(
+                        id=pid,
+                        vector={
+                            "dense_vector": dense_vecs[j],
+                            "sparse_vector": models.SparseVector(
+                                indices=[int(x) for x in sp["indices"]],
+                                values=[float(v) for v in sp["values"]],
+                            ),
+                        },
+                        payload=payload,
+                    )
+                )
 
-            points.append(
-                models.PointStruct(
-                    id=pid,
+            qdrant_services.client.upsert(collection_name=coll, points=points)
+            total += len(points)
+
+    except Exception:
+        # Lỗi giữa chừng: thống kê chỉ tính các doc đã vào Qdrant
+        # (lần ingest sau gửi lại phần còn lại -> không bị đếm 2 lần)
+        if bm25_snap is not None:
+            bm25.restore(bm25_snap)
+            if total:
+                bm25.update(all_texts[:total])
+                bm25.save()
+        raise
+
+    if bm25_snap is not None:
+        bm25.save()
+
+    print(f"[Loader] Upserted {total} points → '{coll}'")
+    return total
+
+
+def rebuild_bm25_stats(
+    collection_name: Optional[str] = None,
+    batch_size: int = 512,
+    reencode: bool = True,
+) -> int:
+    """
+    Dựng lại thống kê BM25 từ toàn bộ collection và (tuỳ chọn) encode lại sparse vector
+    của mọi point theo term id mới. Dùng 1 lần khi chuyển sang thống kê bền vững,
+    hoặc khi muốn làm sạch drift IDF sau thời gian dài ingest.
+    """
+    coll = collection_name or _collection_name()
+
+    def _scroll():
+        offset = None
+        while True:
+            pts, offset = qdrant_services.client.scroll(
+                collection_name=coll,
+                limit=batch_size,
+                with_payload=["summary", "content"],
+                with_vectors=False,
+                offset=offset,
+            )
+            if not pts:
+                break
+            yield pts
+            if offset is None:
+                break
+
+    texts = []
+    for pts in _scroll():
+        texts.extend(_embed_text(p.payload or {}) for p in pts)
+    embedder_services.fit_bm25(texts, persist=True)
+
+    if not reencode:
+        return len(texts)
+
+    updated = 0
+    for pts in _scroll():
+        sparse_vecs = embedder_services.encode_sparse([_embed_text(p.payload or {}) for p in pts])
+        qdrant_services.client.update_vectors(
+            collection_name=coll,
+            points=[
+                models.PointVectors(
+                    id=p.id,
                     vector={
-                        "dense_vector": dense_vecs[j],
                         "sparse_vector": models.SparseVector(
                             indices=[int(x) for x in sp["indices"]],
                             values=[float(v) for v in sp["values"]],
-                        ),
+                        )
                     },
-                    payload=payload,
                 )
-            )
+                for p, sp in zip(pts, sparse_vecs)
+            ],
+        )
+        updated += len(pts)
 
-        qdrant_services.client.upsert(collection_name=coll, points=points)
-        total += len(points)
+    print(f"[Loader] Rebuilt BM25 ({len(texts)} docs), re-encoded {updated} sparse vectors → '{coll}'")
+    return updated
 
-    print(f"[Loader] Upserted {total} points → '{coll}'")
-    return total
\ No newline at end of file
+
+if __name__ == "__main__":
+    rebuild_bm25_stats()
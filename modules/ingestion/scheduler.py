@@ -3,7 +3,30 @@ from typing import Set, List, Dict
 from modules.ingestion.crawler import crawl_cafef_stock
 from modules.ingestion.preprocess import preprocess_articles
 from modules.ingestion.loader import load_to_vector_db
-from modules.utils.services import qdrant_services
+from modules.utils.services import qdrant_services, registry
+from modules.utils.answer_cache import answer_cache
+from modules.utils.price_board import PRICE_BOARD_POLLER
+
+# Mỗi vòng đồng bộ tin tức cũng refresh kho OHLCV ngày (chỉ tải phiên còn thiếu)
+OHLCV_REFRESH_ENABLED = os.getenv("OHLCV_REFRESH_ENABLED", "1") == "1"
+# ... rồi append các phiên mới vào model gap đã lưu (không grid search lại)
+GAP_REFRESH_ENABLED = os.getenv("GAP_REFRESH_ENABLED", "1") == "1"
+# Ngoài giờ giao dịch: train model gap cho cả TRAIN_UNIVERSE (1 run / phiên mục tiêu, có checkpoint),
+# chạy trong process nền, không chặn vòng ingestion
+GAP_BATCH_TRAIN_ENABLED = os.getenv("GAP_BATCH_TRAIN_ENABLED", "1") == "1"
+
+# Ingestion cần Qdrant + embedder + sentiment, Redis để invalidate answer cache (không cần LLM/reranker)
+INGESTION_SERVICES = ("qdrant", "embedder", "sentiment", "redis")
+
+
+def _tickers_of_docs(docs: List[Dict]) -> Set[str]:
+    """Tập mã (symbols + index_codes) xuất hiện trong các doc vừa upsert."""
+    out: Set[str] = set()
+    for d in docs:
+        for t in list(d.get("symbols") or []) + list(d.get("index_codes") or []):
+            if t:
+                out.add(str(t).upper())
+    return out
 
 
 def _get_existing_ids_from_qdrant(
@@ -89,6 +112,15 @@ def run_scheduler():
         (time.time() - max_age_days * 24 * 3600)
     )
 
+    t0 = time.perf_counter()
+    readiness = registry.warmup(*INGESTION_SERVICES)
+    print(f"[Ingestion] Cold start: {time.perf_counter() - t0:.3f}s | {readiness}")
+
+    if PRICE_BOARD_POLLER:
+        # Snapshot bảng giá cho watchlist (UI / API đọc qua Redis)
+        from modules.api.stock_api import price_board
+        price_board.start()
+
     while True:
         try:
             print("\n[Ingestion] Bắt đầu vòng đồng bộ tin tức mới...")
@@ -123,6 +155,11 @@ def run_scheduler():
                 print(
                     f"[Ingestion] ✅ Đã upsert {n} doc MỚI vào `{coll or '[default]'}`"
                 )
+                if n:
+                    # Tin mới cho mã X -> các câu trả lời đã cache về X không còn đúng
+                    tickers = _tickers_of_docs(new_docs)
+                    removed = answer_cache.invalidate_tickers(tickers)
+                    print(f"[Ingestion] Invalidate answer cache: {len(tickers)} mã, {removed} entry")
             else:
                 print("[Ingestion] Không có doc mới (toàn trùng hoặc quá cũ). Bỏ qua upsert.")
 
@@ -130,6 +167,30 @@ def run_scheduler():
             print(f"[Ingestion] ❌ LỖI: {e}")
             traceback.print_exc()
 
+        if OHLCV_REFRESH_ENABLED:
+            try:
+                from modules.api.stock_api import refresh_ohlcv_universe
+                refresh_ohlcv_universe()
+            except Exception as e:
+                print(f"[Ingestion] ❌ Lỗi refresh kho OHLCV: {e}")
+
+        batch_running = False
+        if GAP_BATCH_TRAIN_ENABLED:
+            try:
+                # Chạy trong process riêng (có thể vài giờ); vòng này chỉ khởi động / kiểm tra đã xong chưa
+                from modules.ML.batch_train import start_batch_train_if_due
+                batch_running = start_batch_train_if_due()
+            except Exception as e:
+                print(f"[Ingestion] ❌ Lỗi batch train model gap: {e}")
+
+        if GAP_REFRESH_ENABLED and not batch_running:
+            # Batch train đang ghi lại các model -> để vòng sau cập nhật, tránh ghi chồng
+            try:
+                from modules.ML.pipeline import refresh_gap_models
+                refresh_gap_models()
+            except Exception as e:
+                print(f"[Ingestion] ❌ Lỗi cập nhật model gap: {e}")
+
         print(f"[Ingestion] Sleeping {interval}s...\n")
         time.sleep(interval)
 
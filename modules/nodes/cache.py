@@ -1,6 +1,7 @@
 import json, os, errno
 from modules.core.state import GlobalState
 from modules.utils.services import redis_services
+from modules.utils.answer_cache import answer_cache
 
 LOCAL_CACHE_DIR = os.getenv("LOCAL_CACHE_DIR", "./.cache")
 os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
@@ -63,8 +64,73 @@ def load_cache(state: GlobalState) -> GlobalState:
     return state
 
 
+# Chỉ cache câu trả lời sinh thành công (không cache "response_fallback" / lỗi LLM)
+_CACHEABLE_STATUSES = {"response_generated", "response_api_done"}
+
+
+def lookup_answer_cache(state: GlobalState) -> GlobalState:
+    """
+    Tra answer cache theo state.cache_key (Processor tính).
+    Hit -> gán câu trả lời + nguồn, ghi vào lịch sử; graph rẽ thẳng sang save_cache.
+    """
+    state.answer_cache_hit = False
+    cached = answer_cache.get(state.cache_key)
+    state.add_debug("answer_cache", "hit" if cached else ("miss" if state.cache_key else "skip"))
+    if not cached or not cached.get("answer"):
+        return state
+
+    answer = cached["answer"]
+    state.answer_cache_hit = True
+    state.cached_response = answer
+    state.retrieved_docs = cached.get("sources") or []
+    state.api_type = cached.get("api_type")
+    state.final_answer = answer
+    state.response = answer
+    state.route = cached.get("route") or state.route
+    state.llm_status = "answer_cache_hit"
+
+    if state.user_query:
+        state.conversation_history.append({"role": "user", "content": state.user_query})
+    entry = {"role": "assistant", "content": answer}
+    if state.retrieved_docs:
+        entry["sources"] = state.retrieved_docs
+    state.conversation_history.append(entry)
+    state.add_debug("answer_cache_stats", answer_cache.stats())
+    return state
+
+
+def _store_answer_cache(state: GlobalState):
+    if state.answer_cache_hit or not state.cache_key:
+        return
+    if state.llm_status not in _CACHEABLE_STATUSES or not state.final_answer:
+        return
+    sources = [
+        {
+            "title": d.get("title", ""),
+            "url": d.get("url", ""),
+            "time": d.get("time", ""),
+            "score": float(d["score"]) if d.get("score") is not None else None,
+        }
+        for d in (state.retrieved_docs or [])
+    ]
+    answer_cache.set(
+        state.cache_key,
+        intent=state.intent,
+        tickers=state.tickers,
+        value={
+            "answer": state.final_answer,
+            "sources": sources,
+            "api_type": state.api_type,
+            "route": state.route,
+            "created_at": int(state.timestamp),
+        },
+    )
+
+
 def save_cache(state: GlobalState) -> GlobalState:
     """Save conversation history vào Redis, lỗi thì lưu vào file cục bộ."""
+    _store_answer_cache(state)
+
     if not state.session_id:
         return state
 
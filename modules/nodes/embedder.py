@@ -1,4 +1,5 @@
 from modules.utils.services import embedder_services
+from modules.utils.embedding_cache import query_embedding_cache
 from modules.core.state import GlobalState
 
 def embed_query(state: GlobalState) -> GlobalState:
@@ -20,18 +21,43 @@ def embed_query(state: GlobalState) -> GlobalState:
         return state
 
     try:
-        dense_vec = embedder_services.encode_dense([query])[0]
-    except Exception as e:
-        dense_vec = None
-        state.add_debug("embed_dense_error", str(e))
+        model_version = embedder_services.model_version
+    except Exception:
+        model_version = None
+
+    cached, cache_level = (None, "miss")
+    if model_version:
+        cached, cache_level = query_embedding_cache.get(query, model_version)
+
+    if cached is not None:
+        # Cache hit -> bỏ qua hoàn toàn forward pass của model
+        dense_vec = cached.get("dense_vector")
+        sparse_vec = cached.get("sparse_vector")
+        state.add_debug("embed_sparse_status", "cached" if sparse_vec else "cached_none")
+    else:
+        try:
+            dense_vec = embedder_services.encode_dense([query])[0]
+        except Exception as e:
+            dense_vec = None
+            state.add_debug("embed_dense_error", str(e))
 
-    sparse_vec = None
-    try:
-        sparse_vec = embedder_services.encode_sparse([query])
-        state.add_debug("embed_sparse_status", "ok")
-    except Exception as e:
         sparse_vec = None
-        state.add_debug("embed_sparse_error", str(e))
+        try:
+            sparse_vec = embedder_services.encode_sparse([query])
+            state.add_debug("embed_sparse_status", "ok")
+        except Exception as e:
+            sparse_vec = None
+            state.add_debug("embed_sparse_error", str(e))
+
+        if model_version and dense_vec is not None:
+            query_embedding_cache.set(
+                query,
+                model_version,
+                {"dense_vector": dense_vec, "sparse_vector": sparse_vec},
+            )
+
+    state.add_debug("embed_cache", cache_level)
+    state.add_debug("embed_cache_stats", query_embedding_cache.stats())
 
     if dense_vec is None and sparse_vec is None:
         state.query_embedding = None
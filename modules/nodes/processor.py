@@ -6,6 +6,7 @@ import pytz
 from datetime import timedelta, datetime
 from vnstock import Listing
 from unidecode import unidecode
+from modules.utils.answer_cache import make_answer_cache_key
 
 from collections import defaultdict
 from typing import List, Tuple
@@ -498,8 +499,11 @@ class Processor:
         state.time_filter = self.detect_time_filter(user_query)
         state.tickers = self.detect_tickers(user_query)
 
-        # cache_key gợi ý: bản query chuẩn hóa
-        state.cache_key = f"qa::{processed_query[:100]}"
+        # Key answer cache: query chuẩn hoá + tickers + intent + time bucket ("" = intent không cache)
+        state.cache_key = (
+            "" if is_greeting
+            else make_answer_cache_key(processed_query, state.tickers, state.intent)
+        )
 
         # debug
         if getattr(state, "add_debug", None):
@@ -1,9 +1,21 @@
+import os
 from modules.core.state import GlobalState
 from modules.utils.services import reranker_services
+from modules.utils.rerank_cache import rerank_score_cache, doc_cache_key
 
-def rerank_documents(state: GlobalState, top_k: int | None = None) -> GlobalState:
+# Số candidate tối đa (theo thứ tự RRF) được đưa qua CrossEncoder
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", 8))
+
+
+def rerank_documents(
+    state: GlobalState,
+    top_k: int | None = None,
+    max_candidates: int | None = None,
+) -> GlobalState:
     """
     Rerank danh sách state.retrieved_docs dựa trên user_query.
+    - Chỉ max_candidates doc đầu (đã sort theo RRF) đi qua CrossEncoder, phần còn lại giữ thứ tự RRF phía sau.
+    - Điểm đã tính cho (query, doc) được cache lại -> request sau không chấm lại.
     - Nếu reranker không khả dụng → giữ nguyên thứ tự.
     - Để prompt_builder tự build lại context theo thứ tự mới, ta xóa state.context.
     """
@@ -31,8 +43,31 @@ def rerank_documents(state: GlobalState, top_k: int | None = None) -> GlobalStat
             for d in docs
         ]
 
-        ranked = reranker_services.rerank(state.user_query, inputs)
-        ranked.sort(key=lambda x: x.get("rerank_score", x.get("score", 0.0)), reverse=True)
+        cap = max_candidates if max_candidates is not None else RERANK_MAX_CANDIDATES
+        cap = len(inputs) if cap is None or cap <= 0 else cap
+        candidates, overflow = inputs[:cap], inputs[cap:]
+
+        model_name = reranker_services.model_name
+        keys = [doc_cache_key(d) for d in candidates]
+        cached = rerank_score_cache.get_many(state.user_query, model_name, keys)
+
+        to_score = []
+        for d, k in zip(candidates, keys):
+            if k in cached:
+                d["rerank_score"] = cached[k]
+            else:
+                to_score.append((d, k))
+
+        if to_score:
+            reranker_services.rerank(state.user_query, [d for d, _ in to_score])
+            rerank_score_cache.set_many(
+                state.user_query,
+                model_name,
+                {k: d["rerank_score"] for d, k in to_score if "rerank_score" in d},
+            )
+
+        candidates.sort(key=lambda x: x.get("rerank_score", x.get("score", 0.0)), reverse=True)
+        ranked = candidates + overflow
 
         if top_k is not None and top_k > 0:
             ranked = ranked[:top_k]
@@ -42,6 +77,10 @@ def rerank_documents(state: GlobalState, top_k: int | None = None) -> GlobalStat
         state.llm_status = "reranker_success"
         state.add_debug("reranker_status", "applied")
         state.add_debug("reranker_docs", len(ranked))
+        state.add_debug("reranker_scored_pairs", len(to_score))
+        state.add_debug("reranker_cache_hits", len(cached))
+        state.add_debug("reranker_skipped_pairs", len(cached) + len(overflow))
+        state.add_debug("reranker_capped", len(overflow))
         return state
 
     except Exception as e:
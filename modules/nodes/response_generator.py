@@ -2,9 +2,101 @@ from modules.core.state import GlobalState
 from modules.utils.debug import add_debug_info
 from modules.utils.services import llm_services
 from datetime import datetime
+import os
 import re
+import time
 from modules.nodes.prompt_builder import SYSTEM_INSTRUCTION, CONSTRAINTS
 
+# Bật/tắt sinh câu trả lời dạng stream (UI render dần qua graph.stream(stream_mode="messages"))
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+
+def _chunk_text(chunk) -> str:
+    if isinstance(chunk, str):
+        return chunk
+    content = getattr(chunk, "content", "")
+    if isinstance(content, list):
+        return "".join(c.get("text", "") if isinstance(c, dict) else str(c) for c in content)
+    return content or ""
+
+
+def _output_text(outputs) -> str:
+    if isinstance(outputs, str):
+        return outputs.strip()
+    if isinstance(outputs, list):
+        if len(outputs) > 0 and isinstance(outputs[0], dict):
+            return outputs[0].get("content") or outputs[0].get("text") or str(outputs[0])
+        return " ".join(map(str, outputs))
+    if hasattr(outputs, "content"):
+        return outputs.content.strip()
+    return str(outputs)
+
+
+def generate_text(messages, temperature: float = 0.7, max_tokens: int = 2048, streaming: bool = LLM_STREAMING):
+    """
+    Gọi LLM, trả về (text, timing).
+    - streaming=True: dùng model.stream(); LangGraph (stream_mode="messages") chuyển từng chunk lên UI.
+      timing gồm ttft_sec (thời gian tới token đầu) + total_sec.
+    - Stream lỗi trước khi có token nào -> fallback invoke().
+    """
+    t0 = time.perf_counter()
+    timing = {"streaming": streaming, "ttft_sec": None, "total_sec": None, "chunks": 0}
+
+    if streaming:
+        parts = []
+        try:
+            for chunk in llm_services.model.stream(messages, temperature=temperature, max_tokens=max_tokens):
+                piece = _chunk_text(chunk)
+                if not piece:
+                    continue
+                if timing["ttft_sec"] is None:
+                    timing["ttft_sec"] = round(time.perf_counter() - t0, 3)
+                timing["chunks"] += 1
+                parts.append(piece)
+        except Exception as e:
+            if not parts:
+                print(f"[LLM] Stream lỗi, fallback invoke: {e}")
+                return generate_text(messages, temperature, max_tokens, streaming=False)
+            raise
+        timing["total_sec"] = round(time.perf_counter() - t0, 3)
+        return "".join(parts).strip(), timing
+
+    outputs = llm_services.model.invoke(messages, temperature=temperature, max_tokens=max_tokens)
+    timing["total_sec"] = round(time.perf_counter() - t0, 3)
+    # Không stream -> token đầu tiên tới cùng lúc với toàn bộ câu trả lời
+    timing["ttft_sec"] = timing["total_sec"]
+    return _output_text(outputs), timing
+
+
+async def agenerate_text(messages, temperature: float = 0.7, max_tokens: int = 2048, streaming: bool = LLM_STREAMING):
+    """Bản async của generate_text (astream / ainvoke) cho graph.ainvoke – không chiếm thread khi chờ vLLM."""
+    t0 = time.perf_counter()
+    timing = {"streaming": streaming, "ttft_sec": None, "total_sec": None, "chunks": 0}
+
+    if streaming:
+        parts = []
+        try:
+            async for chunk in llm_services.model.astream(messages, temperature=temperature, max_tokens=max_tokens):
+                piece = _chunk_text(chunk)
+                if not piece:
+                    continue
+                if timing["ttft_sec"] is None:
+                    timing["ttft_sec"] = round(time.perf_counter() - t0, 3)
+                timing["chunks"] += 1
+                parts.append(piece)
+        except Exception as e:
+            if not parts:
+                print(f"[LLM] Stream lỗi, fallback ainvoke: {e}")
+                return await agenerate_text(messages, temperature, max_tokens, streaming=False)
+            raise
+        timing["total_sec"] = round(time.perf_counter() - t0, 3)
+        return "".join(parts).strip(), timing
+
+    outputs = await llm_services.model.ainvoke(messages, temperature=temperature, max_tokens=max_tokens)
+    timing["total_sec"] = round(time.perf_counter() - t0, 3)
+    timing["ttft_sec"] = timing["total_sec"]
+    return _output_text(outputs), timing
+
 def _summarize_docs_for_user(docs, limit=5):
     if not docs:
         return ""
@@ -21,7 +113,8 @@ def _summarize_docs_for_user(docs, limit=5):
     )
     return "\n".join(lines).strip()
 
-def response_node(state: GlobalState, max_history: int = 50) -> GlobalState:
+def _handle_without_llm(state: GlobalState):
+    """Các nhánh không cần gọi LLM (API / greeting / thiếu prompt). Trả state nếu đã xử lý, ngược lại None."""
     route = getattr(state, "route_to", "")
     intent = getattr(state, "intent", "rag")
 
@@ -38,7 +131,9 @@ def response_node(state: GlobalState, max_history: int = 50) -> GlobalState:
 
         state.final_answer = result
         state.response = result
-        state.llm_status = "response_api_done"
+        # Không có dữ liệu / API báo lỗi ("⚠️ Không thể lấy...") -> fallback, không cache câu trả lời
+        api_failed = not state.api_response or result.startswith("⚠️ Không")
+        state.llm_status = "response_fallback" if api_failed else "response_api_done"
         return state
 
     if getattr(state, "is_greeting", False) or intent == "greeting":
@@ -53,103 +148,128 @@ def response_node(state: GlobalState, max_history: int = 50) -> GlobalState:
         state.llm_status = "response_missing_prompt"
         return state
 
-    fallback_summary = _summarize_docs_for_user(getattr(state, "retrieved_docs", []) or [])
+    return None
 
-    try:
-        messages = [
-            {
-                "role": "system",
-                "content": (SYSTEM_INSTRUCTION.strip() + "\n" + CONSTRAINTS.strip())
-            },
+
+def _build_messages(state: GlobalState):
+    return [
+        {
+            "role": "system",
+            "content": (SYSTEM_INSTRUCTION.strip() + "\n" + CONSTRAINTS.strip())
+        },
+        {
+            "role": "user",
+            "content": state.prompt
+        },
+    ]
+
+
+def _finalize_response(state: GlobalState, text: str, timing: dict, fallback_summary: str, max_history: int) -> GlobalState:
+    """Regex hậu xử lý trên TOÀN BỘ text + ghi lịch sử/debug (dùng chung cho bản sync và async)."""
+    route = getattr(state, "route_to", "")
+    intent = getattr(state, "intent", "rag")
+    add_debug_info(state, "llm_streaming", timing["streaming"])
+    add_debug_info(state, "llm_ttft_sec", timing["ttft_sec"])
+    add_debug_info(state, "llm_total_sec", timing["total_sec"])
+
+    assistant_msg = re.sub(r"```[\s\S]*?```", "", text)
+    assistant_msg = re.sub(r"http\S+", "(link)", assistant_msg)
+    assistant_msg = re.sub(
+        r"^\s*\**\s*(Assistant|User|Trợ lý|Người dùng)\s*\**\s*:\s*",
+        "",
+        assistant_msg,
+        flags=re.I
+    ).strip()
+
+    status = "response_generated"
+    if len(assistant_msg.split()) < 10:
+        # Text LLM quá ngắn -> thay bằng câu trả lời dự phòng (không cache)
+        status = "response_fallback"
+        if intent == "market" and getattr(state, "api_response", None):
+            assistant_msg = (
+                f"Dữ liệu thị trường:\n{state.api_response}\n"
+                "Diễn biến chung: xu hướng thị trường chịu ảnh hưởng bởi các thông tin gần đây.\n"
+                "Lưu ý: đây chỉ là mô tả tình hình, không phải khuyến nghị đầu tư."
+            )
+        elif fallback_summary:
+            assistant_msg = fallback_summary
+        else:
+            assistant_msg = "Hiện chưa có đủ dữ liệu để phân tích chi tiết."
+
+    if state.user_query:
+        state.conversation_history.append({"role": "user", "content": state.user_query})
+
+    entry = {"role": "assistant", "content": assistant_msg}
+
+    if getattr(state, "retrieved_docs", None):
+        entry["sources"] = [
             {
-                "role": "user",
-                "content": state.prompt
-            },
+                "title": d.get("title", ""),
+                "url": d.get("url", ""),
+                "time": d.get("time", ""),
+                "score": float(d.get("score", 0.0)) if d.get("score") else None,
+            }
+            for d in state.retrieved_docs
         ]
 
-        outputs = llm_services.model.invoke(
-            messages,
-            temperature=0.7,
-            max_tokens=2048
-        )
+    state.conversation_history.append(entry)
+    state.conversation_history = state.conversation_history[-max_history:]
 
-        if isinstance(outputs, str):
-            text = outputs.strip()
-        elif isinstance(outputs, list):
-            if len(outputs) > 0 and isinstance(outputs[0], dict):
-                text = outputs[0].get("content") or outputs[0].get("text") or str(outputs[0])
-            else:
-                text = " ".join(map(str, outputs))
-        elif hasattr(outputs, "content"):
-            text = outputs.content.strip()
-        else:
-            text = str(outputs)
-
-        assistant_msg = re.sub(r"```[\s\S]*?```", "", text)
-        assistant_msg = re.sub(r"http\S+", "(link)", assistant_msg)
-        assistant_msg = re.sub(
-            r"^\s*\**\s*(Assistant|User|Trợ lý|Người dùng)\s*\**\s*:\s*",
-            "",
-            assistant_msg,
-            flags=re.I
-        ).strip()
-
-        if len(assistant_msg.split()) < 10:
-            if intent == "market" and getattr(state, "api_response", None):
-                assistant_msg = (
-                    f"Dữ liệu thị trường:\n{state.api_response}\n"
-                    "Diễn biến chung: xu hướng thị trường chịu ảnh hưởng bởi các thông tin gần đây.\n"
-                    "Lưu ý: đây chỉ là mô tả tình hình, không phải khuyến nghị đầu tư."
-                )
-            elif fallback_summary:
-                assistant_msg = fallback_summary
-            else:
-                assistant_msg = "Hiện chưa có đủ dữ liệu để phân tích chi tiết."
+    state.final_answer = assistant_msg
+    state.response = assistant_msg
+    state.llm_status = status
 
-        if state.user_query:
-            state.conversation_history.append({"role": "user", "content": state.user_query})
+    add_debug_info(state, "llm_status", status)
+    add_debug_info(state, "route", route)
+    add_debug_info(state, "intent", intent)
+    add_debug_info(state, "timestamp", datetime.now().isoformat())
+
+    return state
+
+
+def _handle_llm_error(state: GlobalState, e: Exception, fallback_summary: str) -> GlobalState:
+    intent = getattr(state, "intent", "rag")
+    add_debug_info(state, "llm_error", str(e))
 
-        entry = {"role": "assistant", "content": assistant_msg}
+    if fallback_summary:
+        err_msg = fallback_summary
+    elif intent == "market" and getattr(state, "api_response", None):
+        err_msg = (
+            f"Dữ liệu thị trường:\n{state.api_response}\n"
+            "Đây là mô tả lại thông tin thị trường, không phải khuyến nghị đầu tư."
+        )
+    else:
+        err_msg = "Đã xảy ra lỗi khi gọi LLM, vui lòng thử lại sau."
 
-        if getattr(state, "retrieved_docs", None):
-            entry["sources"] = [
-                {
-                    "title": d.get("title", ""),
-                    "url": d.get("url", ""),
-                    "time": d.get("time", ""),
-                    "score": float(d.get("score", 0.0)) if d.get("score") else None,
-                }
-                for d in state.retrieved_docs
-            ]
+    state.set_final_answer(err_msg, route="RAG")
+    state.response = err_msg
+    state.llm_status = "response_llm_error"
 
-        state.conversation_history.append(entry)
-        state.conversation_history = state.conversation_history[-max_history:]
+    return state
 
-        state.final_answer = assistant_msg
-        state.response = assistant_msg
-        state.llm_status = "response_generated"
 
-        add_debug_info(state, "llm_status", "response_generated")
-        add_debug_info(state, "route", route)
-        add_debug_info(state, "intent", intent)
-        add_debug_info(state, "timestamp", datetime.now().isoformat())
+def response_node(state: GlobalState, max_history: int = 50) -> GlobalState:
+    handled = _handle_without_llm(state)
+    if handled is not None:
+        return handled
 
+    fallback_summary = _summarize_docs_for_user(getattr(state, "retrieved_docs", []) or [])
+    try:
+        text, timing = generate_text(_build_messages(state), temperature=0.7, max_tokens=2048)
+        return _finalize_response(state, text, timing, fallback_summary, max_history)
     except Exception as e:
-        add_debug_info(state, "llm_error", str(e))
+        return _handle_llm_error(state, e, fallback_summary)
 
-        if fallback_summary:
-            err_msg = fallback_summary
-        elif intent == "market" and getattr(state, "api_response", None):
-            err_msg = (
-                f"Dữ liệu thị trường:\n{state.api_response}\n"
-                "Đây là mô tả lại thông tin thị trường, không phải khuyến nghị đầu tư."
-            )
-        else:
-            err_msg = "Đã xảy ra lỗi khi gọi LLM, vui lòng thử lại sau."
 
-        state.set_final_answer(err_msg, route="RAG")
-        state.response = err_msg
-        state.llm_status = "response_llm_error"
-        return state
+async def aresponse_node(state: GlobalState, max_history: int = 50) -> GlobalState:
+    """Bản async cho graph.ainvoke: chờ vLLM bằng astream thay vì block 1 thread."""
+    handled = _handle_without_llm(state)
+    if handled is not None:
+        return handled
 
-    return state
+    fallback_summary = _summarize_docs_for_user(getattr(state, "retrieved_docs", []) or [])
+    try:
+        text, timing = await agenerate_text(_build_messages(state), temperature=0.7, max_tokens=2048)
+        return _finalize_response(state, text, timing, fallback_summary, max_history)
+    except Exception as e:
+        return _handle_llm_error(state, e, fallback_summary)
@@ -20,6 +20,7 @@ def retrieve_documents(state: GlobalState, max_hours: int = 48) -> GlobalState:
     - Áp dụng RRF fusion:
         rrf_score = RRF(dense_rank) + RRF(sparse_rank)
     - Chuẩn hóa thành `state.retrieved_docs` để reranker/prompt_builder dùng.
+    - retrieval_mode="server": Qdrant đã fuse sẵn (vector_db) -> giữ nguyên retrieved_docs.
     """
     if getattr(state, "route_to", "") not in ["rag", "hybrid"]:
         state.retrieved_docs = []
@@ -28,6 +29,15 @@ def retrieve_documents(state: GlobalState, max_hours: int = 48) -> GlobalState:
         state.add_debug("retriever", "skipped_non_rag_route")
         return state
 
+    if getattr(state, "retrieval_mode", "client") == "server":
+        docs = getattr(state, "retrieved_docs", []) or []
+        state.context = ""
+        state.llm_status = "retriever_success" if docs else "retriever_no_docs"
+        state.add_debug("retriever", "server_fused")
+        state.add_debug("retriever_docs", len(docs))
+        state.add_debug("retriever_top_titles", [d.get("title", "") for d in docs[:5]])
+        return state
+
     dense_hits = getattr(state, "search_results_dense", []) or []
     sparse_hits = getattr(state, "search_results_sparse", []) or []
 
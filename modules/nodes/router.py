@@ -8,6 +8,7 @@ from modules.api.stock_api import (
     format_history_text,
     get_price_at_date,
     format_price_at_date,
+    build_market_summary,
 )
 from modules.api.forecast_api import (
     get_forecast_brief_for_symbol,
@@ -19,11 +20,35 @@ from modules.api.news_api import format_today_news_brief
 
 from modules.core.state import GlobalState
 from modules.nodes.processor import processor_instance
+from modules.utils.fanout import fan_out
+import os
 import re
 import pytz
 from datetime import datetime, timedelta, date
 
 
+# Deadline (giây) cho nhóm lời gọi song song của intent market
+ROUTER_FANOUT_DEADLINE = float(os.getenv("ROUTER_FANOUT_DEADLINE", 8))
+ROUTER_CALL_DEADLINES = {
+    "stock_info": float(os.getenv("ROUTER_STOCK_INFO_DEADLINE", 4)),
+    "market_summary": float(os.getenv("ROUTER_MARKET_SUMMARY_DEADLINE", 6)),
+    "forecast_brief": float(os.getenv("ROUTER_FORECAST_DEADLINE", 8)),
+    "news_brief": float(os.getenv("ROUTER_NEWS_DEADLINE", 6)),
+}
+
+
+def _stock_info_text(symbol: str) -> str:
+    """Giá hiện tại dạng text; format lỗi thì dựng câu ngắn từ quote."""
+    data = get_stock_quote(symbol)
+    try:
+        return format_stock_info(symbol)
+    except Exception:
+        return (
+            f"{symbol}: giá ~ {data.get('price')}, "
+            f"thay đổi {data.get('percent_change')}%"
+        )
+
+
 def _extract_point_date_from_query(q: str) -> date | None:
     """
     Cố gắng suy ra 1 NGÀY CỤ THỂ từ câu hỏi:
@@ -202,22 +227,30 @@ def route_intent(state: GlobalState) -> GlobalState:
                     tickers=getattr(state, "tickers", []),
                 )
 
-                state.route_to = "api"
-                state.api_type = "news_today"
-                try:
-                    state.api_response = format_today_news_brief(
-                        limit=10,
-                        max_pages=1,
-                        keyword=news_keyword,
-                    )
+                # Crawl tin trong ngày có deadline: quá hạn / lỗi -> fallback RAG thay vì treo request
+                results, fanout_info = fan_out(
+                    {
+                        "news_brief": lambda: format_today_news_brief(
+                            limit=10,
+                            max_pages=1,
+                            keyword=news_keyword,
+                        )
+                    },
+                    timeout=ROUTER_FANOUT_DEADLINE,
+                    per_call=ROUTER_CALL_DEADLINES,
+                )
+                state.add_debug("router_fanout", fanout_info)
+                if "news_brief" in results:
+                    state.route_to = "api"
+                    state.api_type = "news_today"
+                    state.api_response = results["news_brief"]
                     state.llm_status = "route_news_today_api"
                     state.add_debug("route", "news_today_api")
                     state.add_debug("time_filter", tf)
                     state.add_debug("news_keyword", news_keyword)
                     return state
-                except Exception as e:
-                    state.add_debug("news_api_error", str(e))
-                    state.add_debug("route", "rag_fallback")
+                state.add_debug("news_api_error", fanout_info["news_brief"].get("error") or "timeout")
+                state.add_debug("route", "rag_fallback")
 
         # Nếu không phải hôm nay hoặc news_api lỗi -> fallback RAG
         state.route_to = "rag"
@@ -309,25 +342,33 @@ def route_intent(state: GlobalState) -> GlobalState:
         state.route_to = "hybrid"
         state.api_type = "market_analysis"
 
-        base_text = ""
+        # Các nguồn dữ liệu độc lập -> gọi song song, latency = nguồn chậm nhất (có deadline)
         if symbol:
-            data = get_stock_quote(symbol)
-            try:
-                base_text = format_stock_info(symbol)
-            except Exception:
-                base_text = (
-                    f"{symbol}: giá ~ {data.get('price')}, "
-                    f"thay đổi {data.get('percent_change')}%"
-                )
+            tasks = {
+                "stock_info": lambda: _stock_info_text(symbol),
+                "forecast_brief": lambda: get_forecast_brief_for_symbol(symbol),
+            }
         else:
-            try:
-                base_text = format_market_summary()
-            except Exception:
-                base_text = "Tổng quan thị trường"
+            tasks = {"market_summary": build_market_summary}
+
+        results, fanout_info = fan_out(
+            tasks,
+            timeout=ROUTER_FANOUT_DEADLINE,
+            per_call=ROUTER_CALL_DEADLINES,
+        )
+        state.add_debug("router_fanout", fanout_info)
 
-        brief_forecast = ""
+        # Ghép kết quả từng phần: nguồn nào lỗi / quá hạn thì thay bằng câu ngắn hoặc bỏ qua
         if symbol:
-            brief_forecast = get_forecast_brief_for_symbol(symbol)
+            base_text = results.get("stock_info") or (
+                f"{symbol}: dữ liệu giá tạm thời chưa sẵn sàng."
+            )
+            brief_forecast = results.get("forecast_brief") or ""
+        else:
+            summary, summary_stats = results.get("market_summary") or ("", {})
+            base_text = summary or "Tổng quan thị trường"
+            brief_forecast = ""
+            state.add_debug("market_summary_stats", summary_stats)
 
         state.api_response = base_text + (brief_forecast if brief_forecast else "")
         state.llm_status = "route_market_hybrid"
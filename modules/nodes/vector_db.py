@@ -2,10 +2,21 @@
 from modules.core.state import GlobalState
 from modules.utils.services import qdrant_services
 from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+import os
 import pytz
 from datetime import datetime, timedelta
 from qdrant_client import models
 from modules.utils.time_utils import resolve_time_window
+from modules.utils.qdrant_utils import hybrid_query_points
+
+
+# Timeout chung cho cả 2 modality (giây) + pool dùng chung giữa các request
+VECTOR_SEARCH_TIMEOUT = float(os.getenv("VECTOR_SEARCH_TIMEOUT", 5.0))
+_search_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("VECTOR_SEARCH_WORKERS", 8)),
+    thread_name_prefix="qdrant-search",
+)
 
 
 def normalize_score(score: float) -> float:
@@ -61,7 +72,115 @@ def _search_modality(
     return hits
 
 
-def search_vector_db(state: GlobalState, top_k: int = 5) -> GlobalState:
+def _timed_search(vec, using: str, top_k: int, search_filter: models.Filter):
+    """Chạy _search_modality và trả kèm latency (giây) của riêng modality đó."""
+    t0 = perf_counter()
+    hits = _search_modality(vec, using=using, top_k=top_k, search_filter=search_filter)
+    return hits, round(perf_counter() - t0, 3)
+
+
+def _search_concurrently(
+    dense_vec,
+    sparse_vec,
+    top_k: int,
+    search_filter: models.Filter,
+    timeout: float = VECTOR_SEARCH_TIMEOUT,
+):
+    """
+    Gửi dense + sparse song song, chờ chung 1 deadline.
+    Modality nào lỗi/quá hạn -> trả [] cho modality đó, modality còn lại vẫn dùng được.
+    Trả về (dense_hits, sparse_hits, info) với info chứa latency/lỗi từng modality.
+    """
+    futures = {
+        "dense": _search_pool.submit(_timed_search, dense_vec, "dense_vector", top_k, search_filter),
+        "sparse": _search_pool.submit(_timed_search, sparse_vec, "sparse_vector", top_k, search_filter),
+    }
+    wait(list(futures.values()), timeout=timeout)
+
+    results = {}
+    info = {}
+    for name, fut in futures.items():
+        try:
+            hits, sec = fut.result(timeout=0)
+            results[name] = hits
+            info[f"{name}_sec"] = sec
+        except FutureTimeout:
+            fut.cancel()
+            results[name] = []
+            info[f"{name}_error"] = f"timeout>{timeout}s"
+        except Exception as e:
+            results[name] = []
+            info[f"{name}_error"] = str(e)
+
+    if "dense_error" in info and "sparse_error" in info:
+        raise RuntimeError(f"dense: {info['dense_error']} | sparse: {info['sparse_error']}")
+
+    return results["dense"], results["sparse"], info
+
+
+def _points_to_docs(points) -> list:
+    """ScoredPoint đã fuse (server RRF) -> đúng schema retrieved_docs mà reranker dùng."""
+    docs = []
+    for rank, p in enumerate(points, start=1):
+        payload = p.payload or {}
+        fused = round(float(p.score or 0.0), 6)
+        docs.append(
+            {
+                "id": p.id,
+                "title": payload.get("title", ""),
+                "time": payload.get("time", ""),
+                "time_ts": payload.get("time_ts", 0),
+                "url": payload.get("url", ""),
+                "content": (payload.get("content") or "")[:1000],
+                "score": fused,
+                "rrf_score": fused,
+                "fused_rank": rank,
+                "dense_rank": None,
+                "sparse_rank": None,
+                "dense_score": None,
+                "sparse_score": None,
+            }
+        )
+    return docs
+
+
+def _search_server_side(
+    state: GlobalState,
+    dense_vec,
+    sparse_vec,
+    top_k: int,
+    search_filter: models.Filter,
+) -> GlobalState:
+    """
+    Chế độ retrieval_mode="server": prefetch dense + sparse, lọc thời gian và RRF
+    trong 1 lần query_points. Ghi thẳng state.retrieved_docs (retriever sẽ bỏ qua bước fuse).
+    """
+    start_t = perf_counter()
+    points = hybrid_query_points(
+        dense_vec,
+        sparse_vec,
+        top_k=top_k * 2,          # tương đương tối đa top_k dense + top_k sparse của chế độ client
+        query_filter=search_filter,
+        prefetch_limit=top_k,
+    )
+    elapsed = round(perf_counter() - start_t, 3)
+
+    docs = _points_to_docs(points)
+    state.search_results_dense = []
+    state.search_results_sparse = []
+    state.search_results = docs
+    state.retrieved_docs = docs
+    state.llm_status = "vector_db_success"
+    state.add_debug("vector_db_fused", len(docs))
+    state.add_debug("vector_db_time_sec", elapsed)
+    return state
+
+
+def search_vector_db(
+    state: GlobalState,
+    top_k: int = 5,
+    mode: str | None = None,
+) -> GlobalState:
     """
     NHIỆM VỤ:
     - CHỈ search Qdrant cho từng modality (dense / sparse).
@@ -70,6 +189,9 @@ def search_vector_db(state: GlobalState, top_k: int = 5) -> GlobalState:
         - state.search_results_sparse
     - state.search_results = dense + sparse (để debug tổng hợp).
     - Filter thời gian được thực hiện bằng resolve_time_window.
+    - mode (hoặc state.retrieval_mode / env RETRIEVAL_MODE):
+        "client" = 2 query song song, RRF ở retriever (mặc định)
+        "server" = prefetch + RRF trong Qdrant, 1 round-trip
     """
     route_to = getattr(state, "route_to", "")
     if route_to not in ["rag", "hybrid"]:
@@ -117,15 +239,21 @@ def search_vector_db(state: GlobalState, top_k: int = 5) -> GlobalState:
         ]
     )
 
+    mode = (mode or getattr(state, "retrieval_mode", None) or "client").lower()
+    state.retrieval_mode = mode
+    state.add_debug("vector_db_filter_start", start_ts)
+    state.add_debug("vector_db_filter_end", end_ts)
+    state.add_debug("vector_db_route", route_to)
+    state.add_debug("retrieval_mode", mode)
+
     try:
-        start_t = perf_counter()
+        if mode == "server":
+            return _search_server_side(state, dense_vec, sparse_vec, top_k, search_filter)
 
-        dense_hits = _search_modality(
-            dense_vec, using="dense_vector", top_k=top_k, search_filter=search_filter
-        )
+        start_t = perf_counter()
 
-        sparse_hits = _search_modality(
-            sparse_vec, using="sparse_vector", top_k=top_k, search_filter=search_filter
+        dense_hits, sparse_hits, info = _search_concurrently(
+            dense_vec, sparse_vec, top_k=top_k, search_filter=search_filter
         )
 
         elapsed = round(perf_counter() - start_t, 3)
@@ -138,9 +266,11 @@ def search_vector_db(state: GlobalState, top_k: int = 5) -> GlobalState:
         state.add_debug("vector_db_dense", len(dense_hits))
         state.add_debug("vector_db_sparse", len(sparse_hits))
         state.add_debug("vector_db_time_sec", elapsed)
-        state.add_debug("vector_db_filter_start", start_ts)
-        state.add_debug("vector_db_filter_end", end_ts)
-        state.add_debug("vector_db_route", route_to)
+        state.add_debug("vector_db_dense_sec", info.get("dense_sec"))
+        state.add_debug("vector_db_sparse_sec", info.get("sparse_sec"))
+        for k in ("dense_error", "sparse_error"):
+            if k in info:
+                state.add_debug(f"vector_db_{k}", info[k])
 
         return state
 
@@ -148,6 +278,8 @@ def search_vector_db(state: GlobalState, top_k: int = 5) -> GlobalState:
         state.search_results = []
         state.search_results_dense = []
         state.search_results_sparse = []
+        if mode == "server":
+            state.retrieved_docs = []
         state.llm_status = "vector_db_error"
         state.add_debug("vector_db_exception", str(e))
         return state
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from modules.utils.services import redis_services
+
+ANSWER_CACHE_PREFIX = "qa::"
+ANSWER_CACHE_TAG_PREFIX = "qa_tag::"
+# Tag cho câu trả lời không gắn mã (tin tức chung) -> bị xoá mỗi khi có tin mới được upsert
+GENERAL_TAG = "_general"
+
+# TTL (giây) theo intent; 0 = không cache. Override: ANSWER_CACHE_TTL_<INTENT>=...
+_DEFAULT_TTLS = {
+    "rag": 1800,        # tin tức / RAG
+    "market": 120,      # hybrid: giá hiện tại + tin tức
+    "stock": 60,        # giá / lịch sử giá
+    "forecast": 900,    # dự báo phiên tới / intraday
+    "weather": 0,
+    "time": 0,
+    "greeting": 0,
+}
+
+
+def intent_ttl(intent: str) -> int:
+    intent = (intent or "rag").lower()
+    default = _DEFAULT_TTLS.get(intent, 0)
+    return int(os.getenv(f"ANSWER_CACHE_TTL_{intent.upper()}", default))
+
+
+def _tag_ttl(ttl: int) -> int:
+    """TTL cho tag set: gấp đôi TTL dài nhất sau khi áp override env (và TTL của entry đang ghi)."""
+    return max([ttl] + [intent_ttl(i) for i in _DEFAULT_TTLS]) * 2
+
+
+def make_answer_cache_key(
+    processed_query: str,
+    tickers: Iterable[str],
+    intent: str,
+    now: Optional[float] = None,
+) -> str:
+    """
+    Key = qa::<intent>::sha1(query chuẩn hoá | tickers | intent | time bucket).
+    Time bucket = floor(now / TTL của intent) -> câu trả lời tự "sang trang" theo nhịp dữ liệu.
+    Trả "" nếu intent không được cache.
+    """
+    ttl = intent_ttl(intent)
+    if ttl <= 0 or not (processed_query or "").strip():
+        return ""
+    bucket = int((now or time.time()) // ttl)
+    syms = ",".join(sorted({t.upper() for t in (tickers or [])}))
+    raw = f"{processed_query.strip()}|{syms}|{intent}|{bucket}"
+    return f"{ANSWER_CACHE_PREFIX}{intent}::{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời cuối cùng trong Redis.
+    - get/set theo state.cache_key (do Processor tính).
+    - Mỗi entry được gắn tag theo ticker (Redis set `qa_tag::<TICKER>` chứa các key)
+      để ingestion xoá đúng các câu trả lời liên quan khi có tin mới cho mã đó.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "invalidated": 0, "errors": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if not cache_key:
+            return None
+        try:
+            raw = redis_services.client.get(cache_key)
+        except Exception:
+            self._count("errors")
+            return None
+        if not raw:
+            self._count("misses")
+            return None
+        try:
+            val = json.loads(raw)
+        except Exception:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return val
+
+    def set(self, cache_key: str, intent: str, tickers: List[str], value: Dict[str, Any]) -> bool:
+        ttl = intent_ttl(intent)
+        if not cache_key or ttl <= 0:
+            return False
+        tags = [t.upper() for t in (tickers or [])] or [GENERAL_TAG]
+        tag_ttl = _tag_ttl(ttl)
+        try:
+            pipe = redis_services.client.pipeline()
+            pipe.set(cache_key, json.dumps(value, ensure_ascii=False), ex=ttl)
+            for tag in tags:
+                tkey = ANSWER_CACHE_TAG_PREFIX + tag
+                pipe.sadd(tkey, cache_key)
+                # Tag sống lâu hơn entry dài nhất 1 chút; key hết hạn trong set chỉ là rác vô hại
+                pipe.expire(tkey, tag_ttl)
+            pipe.execute()
+        except Exception:
+            self._count("errors")
+            return False
+        self._count("stores")
+        return True
+
+    def invalidate_tickers(self, tickers: Iterable[str], include_general: bool = True) -> int:
+        """Xoá toàn bộ câu trả lời gắn với các ticker (và tag chung nếu include_general)."""
+        tags = {t.upper() for t in (tickers or []) if t}
+        if include_general:
+            tags.add(GENERAL_TAG)
+        if not tags:
+            return 0
+
+        removed = 0
+        try:
+            client = redis_services.client
+            for tag in tags:
+                tkey = ANSWER_CACHE_TAG_PREFIX + tag
+                keys = list(client.smembers(tkey) or [])
+                if keys:
+                    removed += int(client.delete(*keys) or 0)
+                client.delete(tkey)
+        except Exception as e:
+            self._count("errors")
+            print(f"[AnswerCache] Lỗi invalidate {sorted(tags)}: {e}")
+        self._count("invalidated", removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        total = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / total, 4) if total else 0.0
+        return s
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+BM25_STATS_DIR = os.getenv("BM25_STATS_DIR", "data/bm25")
+
+_VOCAB_FILE = "vocab.json"
+_DF_FILE = "df.npy"
+_META_FILE = "meta.json"
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách token giống hệt cách cũ (split theo dấu cách) để index ổn định."""
+    return (text or "").split(" ")
+
+
+class BM25Stats:
+    """
+    Thống kê BM25 bền vững (persisted) cho sparse vector:
+    - vocab: token -> term id, CHỈ THÊM (append-only) nên index không đổi giữa các batch,
+      giữa ingestion và serving.
+    - df: document frequency theo term id (numpy int64, lưu .npy -> serving load mmap).
+    - n_docs / total_len: số doc + tổng độ dài để tính IDF / avgdl.
+
+    Ingestion gọi update(texts) rồi save(); serving chỉ load() và reload_if_changed().
+    """
+
+    def __init__(self, path: str = BM25_STATS_DIR):
+        self.path = path
+        self.vocab: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype="int64")
+        self.n_docs = 0
+        self.total_len = 0
+        self.version = 0
+        self._loaded_mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    # ====== IO ======
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file(_META_FILE))
+
+    def load(self, mmap: bool = True) -> "BM25Stats":
+        """Load từ đĩa; df được memory-map (read-only) nếu mmap=True."""
+        if not self.exists():
+            return self
+        with open(self._file(_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(self._file(_VOCAB_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        df = np.load(self._file(_DF_FILE), mmap_mode="r" if mmap else None)
+
+        with self._lock:
+            self.vocab = {t: i for i, t in enumerate(terms)}
+            self.df = df
+            self.n_docs = int(meta.get("n_docs", 0))
+            self.total_len = int(meta.get("total_len", 0))
+            self.version = int(meta.get("version", 0))
+            self._loaded_mtime = os.path.getmtime(self._file(_META_FILE))
+        print(f"[BM25] Loaded stats v{self.version}: docs={self.n_docs}, vocab={len(self.vocab)}")
+        return self
+
+    def save(self):
+        """Ghi atomically (tmp + os.replace); meta.json ghi sau cùng làm mốc commit."""
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            terms = [None] * len(self.vocab)
+            for t, i in self.vocab.items():
+                terms[i] = t
+            df = np.asarray(self.df, dtype="int64")
+            self.version += 1
+            meta = {
+                "n_docs": int(self.n_docs),
+                "total_len": int(self.total_len),
+                "vocab_size": len(terms),
+                "version": self.version,
+                "updated_at": int(time.time()),
+            }
+
+        tmp_df = self._file(_DF_FILE + ".tmp.npy")
+        np.save(tmp_df, df)
+        os.replace(tmp_df, self._file(_DF_FILE))
+
+        tmp_vocab = self._file(_VOCAB_FILE + ".tmp")
+        with open(tmp_vocab, "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        os.replace(tmp_vocab, self._file(_VOCAB_FILE))
+
+        tmp_meta = self._file(_META_FILE + ".tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_meta, self._file(_META_FILE))
+        self._loaded_mtime = os.path.getmtime(self._file(_META_FILE))
+
+    def reload_if_changed(self, min_interval: float = 60.0) -> bool:
+        """Serving: kiểm tra mtime meta.json tối đa 1 lần / min_interval giây."""
+        now = time.time()
+        if now - self._last_check < min_interval:
+            return False
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self._file(_META_FILE))
+        except OSError:
+            return False
+        if self._loaded_mtime is not None and mtime <= self._loaded_mtime:
+            return False
+        self.load()
+        return True
+
+    # ====== Cập nhật ======
+    def reset(self):
+        with self._lock:
+            self.vocab = {}
+            self.df = np.zeros(0, dtype="int64")
+            self.n_docs = 0
+            self.total_len = 0
+
+    def snapshot(self) -> tuple:
+        """Mốc (df, n_docs, total_len) để hoàn tác update() chưa được index (vocab append-only, giữ nguyên)."""
+        with self._lock:
+            return np.array(self.df, dtype="int64"), self.n_docs, self.total_len
+
+    def restore(self, snap: tuple):
+        """Quay df / n_docs / total_len về snapshot(); term id thêm sau mốc vẫn giữ (df = 0)."""
+        df_old, n_docs, total_len = snap
+        with self._lock:
+            df = np.zeros(len(self.vocab), dtype="int64")
+            df[: len(df_old)] = df_old
+            self.df = df
+            self.n_docs = n_docs
+            self.total_len = total_len
+
+    def update(self, corpus: Iterable[str]) -> int:
+        """Cộng dồn df / n_docs / total_len cho các doc mới. Trả về số doc đã thêm."""
+        added_docs = 0
+        added_len = 0
+        df_delta: Counter = Counter()
+        with self._lock:
+            for text in corpus:
+                tokens = tokenize(text)
+                added_docs += 1
+                added_len += len(tokens)
+                for tok in sorted(set(tokens)):
+                    idx = self.vocab.get(tok)
+                    if idx is None:
+                        idx = len(self.vocab)
+                        self.vocab[tok] = idx
+                    df_delta[idx] += 1
+
+            if added_docs == 0:
+                return 0
+
+            # df có thể đang là memmap read-only -> copy sang RAM trước khi ghi
+            df = np.zeros(len(self.vocab), dtype="int64")
+            df[: len(self.df)] = self.df
+            if df_delta:
+                idxs = np.fromiter(df_delta.keys(), dtype="int64", count=len(df_delta))
+                cnts = np.fromiter(df_delta.values(), dtype="int64", count=len(df_delta))
+                np.add.at(df, idxs, cnts)
+            self.df = df
+            self.n_docs += added_docs
+            self.total_len += added_len
+        return added_docs
+
+    # ====== Encode ======
+    def idf(self, idx: int) -> float:
+        """IDF kiểu BM25 (biến thể luôn dương: log(1 + (N - df + 0.5) / (df + 0.5)))."""
+        if idx >= len(self.df):
+            return 0.0
+        df = float(self.df[idx])
+        return math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def encode(self, text: str) -> Dict[str, list]:
+        index_map: Dict[int, float] = {}
+        for tok in tokenize(text):
+            idx = self.vocab.get(tok)
+            if idx is None:
+                continue
+            val = self.idf(idx)
+            if val > 0:
+                index_map[idx] = index_map.get(idx, 0.0) + val
+        indices = sorted(index_map.keys())
+        return {"indices": indices, "values": [index_map[i] for i in indices]}
+
+    @property
+    def fingerprint(self) -> str:
+        return f"v{self.version}-n{self.n_docs}"
+
+    def __len__(self):
+        return len(self.vocab)
@@ -162,6 +162,49 @@ def test_retriever_node(user_query: str, top_k: int = 5) -> GlobalState:
     return state
 
 
+# ========================================================================
+# SO SÁNH RETRIEVAL CLIENT-SIDE RRF vs SERVER-SIDE RRF
+# ========================================================================
+def compare_retrieval_modes(user_query: str, top_k: int = 5, runs: int = 5) -> dict:
+    """Benchmark 2 chế độ retrieval trên cùng 1 embedding: latency trung bình + độ trùng top docs."""
+    import time
+
+    _sep("COMPARE RETRIEVAL MODES")
+    base = GlobalState(user_query=user_query, debug=True)
+    base = processor_query(base)
+    base.route_to = "rag"
+    base = embed_query(base)
+
+    report = {}
+    top_ids = {}
+    for mode in ("client", "server"):
+        timings = []
+        for _ in range(max(1, runs)):
+            st = GlobalState(
+                user_query=base.user_query,
+                processed_query=base.processed_query,
+                route_to="rag",
+                time_filter=base.time_filter,
+                query_embedding=base.query_embedding,
+                retrieval_mode=mode,
+            )
+            t0 = time.perf_counter()
+            st = search_vector_db(st, top_k=top_k)
+            st = retrieve_documents(st)
+            timings.append(time.perf_counter() - t0)
+        top_ids[mode] = [d.get("id") for d in st.retrieved_docs[:top_k]]
+        report[mode] = {
+            "avg_ms": round(1000 * sum(timings) / len(timings), 2),
+            "docs": len(st.retrieved_docs),
+        }
+
+    overlap = len(set(top_ids["client"]) & set(top_ids["server"]))
+    report["top_overlap"] = f"{overlap}/{top_k}"
+    for k, v in report.items():
+        print(f"{k:12s}: {v}")
+    return report
+
+
 # ========================================================================
 # TEST RERANKER
 # ========================================================================
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from modules.utils.services import redis_services
+
+EMBED_CACHE_L1_SIZE = int(os.getenv("EMBED_CACHE_L1_SIZE", 2048))
+EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", 24 * 3600))
+EMBED_CACHE_PREFIX = "emb::"
+
+
+def _normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", (query or "").strip().lower())
+
+
+class QueryEmbeddingCache:
+    """
+    Cache 2 tầng cho embedding truy vấn (dense + sparse):
+    - L1: LRU trong process (không tốn network).
+    - L2: Redis dùng chung giữa các worker/process.
+    Key = hash(query chuẩn hoá + model_version) -> đổi model/BM25 là key tự đổi.
+    """
+
+    def __init__(self, max_size: int = EMBED_CACHE_L1_SIZE, ttl_seconds: int = EMBED_CACHE_TTL):
+        self.max_size = int(max_size)
+        self.ttl_seconds = int(ttl_seconds)
+        self._l1: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "l2_errors": 0}
+
+    @staticmethod
+    def make_key(query: str, model_version: str) -> str:
+        raw = f"{model_version}||{_normalize_query(query)}"
+        return EMBED_CACHE_PREFIX + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _l1_put(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._l1[key] = value
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.max_size:
+                self._l1.popitem(last=False)
+
+    def get(self, query: str, model_version: str) -> tuple[Optional[Dict[str, Any]], str]:
+        """Trả về (embedding | None, tầng trả lời: 'l1' | 'l2' | 'miss')."""
+        key = self.make_key(query, model_version)
+
+        with self._lock:
+            val = self._l1.get(key)
+            if val is not None:
+                self._l1.move_to_end(key)
+                self._stats["l1_hits"] += 1
+                return val, "l1"
+
+        try:
+            raw = redis_services.client.get(key)
+        except Exception:
+            raw = None
+            with self._lock:
+                self._stats["l2_errors"] += 1
+
+        if raw:
+            try:
+                val = json.loads(raw)
+                self._l1_put(key, val)
+                with self._lock:
+                    self._stats["l2_hits"] += 1
+                return val, "l2"
+            except Exception:
+                pass
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None, "miss"
+
+    def set(self, query: str, model_version: str, value: Dict[str, Any]):
+        key = self.make_key(query, model_version)
+        self._l1_put(key, value)
+        try:
+            redis_services.client.set(key, json.dumps(value), ex=self.ttl_seconds)
+        except Exception:
+            with self._lock:
+                self._stats["l2_errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s["l1_size"] = len(self._l1)
+        total = s["l1_hits"] + s["l2_hits"] + s["misses"]
+        s["requests"] = total
+        s["hit_rate"] = round((s["l1_hits"] + s["l2_hits"]) / total, 4) if total else 0.0
+        return s
+
+    def clear_local(self):
+        with self._lock:
+            self._l1.clear()
+
+
+query_embedding_cache = QueryEmbeddingCache()
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Pool ngoài (router, refresh kho OHLCV...) và pool cho fan-out lồng bên trong 1 task
+# (build_market_summary / format_forecast_brief gọi từ router) -> thread ngoài đang chờ
+# không bao giờ chiếm chỗ của task con (tránh deadlock / đói thread).
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", 16))
+FANOUT_NESTED_WORKERS = int(os.getenv("FANOUT_NESTED_WORKERS", 32))
+
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+_nested_pool = ThreadPoolExecutor(max_workers=FANOUT_NESTED_WORKERS, thread_name_prefix="fanout-nested")
+
+# Độ sâu fan-out của thread hiện tại: 0 = ngoài, 1 = task của pool ngoài, >= 2 = task của pool lồng
+_depth = threading.local()
+
+
+def _with_depth(fn: Callable[[], Any], depth: int) -> Callable[[], Any]:
+    def run():
+        _depth.value = depth
+        try:
+            return fn()
+        finally:
+            _depth.value = 0
+    return run
+
+
+def _run_inline(tasks: Dict[str, Callable[[], Any]], deadlines: Dict[str, float], t0: float):
+    """Fan-out lồng sâu hơn 2 tầng: chạy tuần tự ngay trên thread hiện tại, bỏ task đã quá hạn."""
+    results: Dict[str, Any] = {}
+    info: Dict[str, Dict[str, Any]] = {}
+    for name, fn in tasks.items():
+        if time.perf_counter() >= deadlines[name]:
+            info[name] = {"status": "timeout", "sec": round(time.perf_counter() - t0, 3)}
+            continue
+        try:
+            results[name] = fn()
+            info[name] = {"status": "ok", "sec": round(time.perf_counter() - t0, 3)}
+        except Exception as e:
+            info[name] = {"status": "error", "sec": round(time.perf_counter() - t0, 3), "error": str(e)}
+    return results, info
+
+
+def fan_out(
+    tasks: Dict[str, Callable[[], Any]],
+    timeout: float,
+    per_call: Optional[Dict[str, float]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Chạy song song các lời gọi độc lập (vnstock / model / news...) với deadline.
+    - timeout: deadline chung cho cả nhóm (giây).
+    - per_call: deadline riêng theo tên task (không vượt quá timeout chung).
+    Trả về (results, info):
+      results: {name: value} chỉ gồm task xong đúng hạn và không lỗi (kết quả từng phần).
+      info:    {name: {"status": ok|error|timeout, "sec": ..., "error": ...}}
+    Task quá hạn không bị huỷ được (thread) -> chạy nốt ở nền, kết quả vẫn vào TTLCache cho lần sau.
+    Gọi từ trong 1 task fan-out -> dùng pool lồng riêng; sâu hơn nữa -> chạy tuần tự tại chỗ.
+    """
+    per_call = per_call or {}
+    t0 = time.perf_counter()
+    deadlines = {name: t0 + min(per_call.get(name, timeout), timeout) for name in tasks}
+
+    depth = getattr(_depth, "value", 0)
+    if depth >= 2:
+        return _run_inline(tasks, deadlines, t0)
+    pool = _fanout_pool if depth == 0 else _nested_pool
+    futures = {pool.submit(_with_depth(fn, depth + 1)): name for name, fn in tasks.items()}
+
+    results: Dict[str, Any] = {}
+    info: Dict[str, Dict[str, Any]] = {}
+    pending = set(futures)
+
+    while pending:
+        now = time.perf_counter()
+        # Task quá deadline riêng -> timeout
+        for fut in [f for f in pending if deadlines[futures[f]] <= now]:
+            pending.discard(fut)
+            fut.cancel()
+            info[futures[fut]] = {"status": "timeout", "sec": round(now - t0, 3)}
+        if not pending:
+            break
+
+        next_deadline = min(deadlines[futures[f]] for f in pending)
+        done, pending = wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = futures[fut]
+            sec = round(time.perf_counter() - t0, 3)
+            try:
+                results[name] = fut.result()
+                info[name] = {"status": "ok", "sec": sec}
+            except Exception as e:
+                info[name] = {"status": "error", "sec": sec, "error": str(e)}
+
+    return results, info
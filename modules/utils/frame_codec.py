@@ -0,0 +1,183 @@
+"""
+Mã hoá nhị phân gọn cho giá trị cache dùng chung qua Redis (tầng L2 của TTLCache):
+- DataFrame / Series -> Arrow IPC (nén zstd nếu có), giữ index + freq của DatetimeIndex.
+- tuple -> mã hoá từng phần tử (vd. (screener_df, growth_col)).
+- còn lại (dict/list/str/số...) -> JSON.
+Không dùng pickle: bytes đọc từ Redis không được phép thực thi code khi giải mã.
+Giá trị không mã hoá được (object tuỳ ý, thiếu pyarrow) -> TypeError, TTLCache bỏ qua L2 cho entry đó.
+
+Benchmark giải mã so với fetch vnstock:  python -m modules.utils.frame_codec VCB FPT HPG
+"""
+import io
+import json
+import struct
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except Exception:  # pragma: no cover - thiếu pyarrow -> DataFrame không lên L2
+    pa = None
+    pa_ipc = None
+
+_TAG_FRAME = b"D"
+_TAG_SERIES = b"S"
+_TAG_TUPLE = b"T"
+_TAG_JSON = b"J"
+_SERIES_COL = "__series__"
+
+
+def _ipc_options():
+    for codec in ("zstd", "lz4"):
+        try:
+            return pa_ipc.IpcWriteOptions(compression=codec)
+        except Exception:
+            continue
+    return pa_ipc.IpcWriteOptions()
+
+
+def _frame_to_arrow(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    freq = getattr(df.index, "freqstr", None)
+    if freq:
+        meta = dict(table.schema.metadata or {})
+        meta[b"freq"] = freq.encode("utf-8")
+        table = table.replace_schema_metadata(meta)
+    sink = io.BytesIO()
+    with pa_ipc.new_stream(sink, table.schema, options=_ipc_options()) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _arrow_to_frame(buf: bytes) -> pd.DataFrame:
+    table = pa_ipc.open_stream(pa.py_buffer(buf)).read_all()
+    df = table.to_pandas()
+    freq = (table.schema.metadata or {}).get(b"freq")
+    if freq and isinstance(df.index, pd.DatetimeIndex):
+        try:
+            df.index = pd.DatetimeIndex(df.index, freq=freq.decode("utf-8"))
+        except Exception:
+            pass
+    return df
+
+
+def _json_default(v):
+    # Số numpy (np.float64, np.int64...) trong dict trả về từ DataFrame
+    if isinstance(v, np.generic):
+        return v.item()
+    raise TypeError(f"frame_codec: không mã hoá được {type(v).__name__}")
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, allow_nan=True, default=_json_default).encode("utf-8")
+
+
+def dumps(value: Any) -> bytes:
+    if isinstance(value, (pd.DataFrame, pd.Series)) and pa is None:
+        raise TypeError("frame_codec: cần pyarrow để mã hoá DataFrame / Series")
+    if isinstance(value, pd.DataFrame):
+        return _TAG_FRAME + _frame_to_arrow(value)
+    if isinstance(value, pd.Series):
+        frame = value.to_frame(name=_SERIES_COL)
+        name = _json_dumps(value.name)
+        return _TAG_SERIES + struct.pack(">I", len(name)) + name + _frame_to_arrow(frame)
+    if isinstance(value, tuple):
+        parts = [dumps(v) for v in value]
+        out = [_TAG_TUPLE, struct.pack(">I", len(parts))]
+        for p in parts:
+            out.append(struct.pack(">Q", len(p)))
+            out.append(p)
+        return b"".join(out)
+    return _TAG_JSON + _json_dumps(value)
+
+
+def loads(buf: bytes) -> Any:
+    tag, body = buf[:1], buf[1:]
+    if tag == _TAG_FRAME:
+        return _arrow_to_frame(body)
+    if tag == _TAG_SERIES:
+        (n,) = struct.unpack(">I", body[:4])
+        name = json.loads(body[4 : 4 + n])
+        s = _arrow_to_frame(body[4 + n :])[_SERIES_COL]
+        s.name = name
+        return s
+    if tag == _TAG_TUPLE:
+        (count,) = struct.unpack(">I", body[:4])
+        pos, items = 4, []
+        for _ in range(count):
+            (size,) = struct.unpack(">Q", body[pos : pos + 8])
+            pos += 8
+            items.append(loads(body[pos : pos + size]))
+            pos += size
+        return tuple(items)
+    if tag == _TAG_JSON:
+        return json.loads(body)
+    raise ValueError(f"frame_codec: tag không hợp lệ {tag!r}")
+
+
+# ====== Benchmark ======
+def benchmark(symbols: List[str], days: int = 365, runs: int = 20) -> List[Dict[str, Any]]:
+    """
+    So sánh cho từng mã:
+    - fetch_ms: gọi vnstock thật (bỏ qua mọi cache)
+    - encode/decode_ms, bytes: Arrow IPC vs JSON (orient="split")
+    - redis_roundtrip_ms: GET từ Redis + decode (chi phí 1 lần hit L2)
+    """
+    from datetime import timedelta
+    from modules.api.stock_api import get_history_df_vnstock, _today_vn, _ymd
+    from modules.utils.services import redis_services
+
+    fetch = getattr(get_history_df_vnstock, "__wrapped__", get_history_df_vnstock)
+    client = redis_services.binary_client
+    end = _today_vn()
+    start = end - timedelta(days=days)
+
+    rows = []
+    for sym in symbols:
+        t0 = time.perf_counter()
+        df = fetch(sym, start=_ymd(start), end=_ymd(end))
+        fetch_ms = (time.perf_counter() - t0) * 1000
+
+        row = {"symbol": sym, "rows": len(df), "fetch_ms": round(fetch_ms, 1)}
+        for label, enc, dec in (
+            ("arrow", dumps, loads),
+            ("json",
+             lambda v: v.to_json(orient="split", date_format="iso").encode("utf-8"),
+             lambda b: pd.read_json(io.BytesIO(b), orient="split")),
+        ):
+            if label == "arrow" and pa is None:
+                continue
+            t0 = time.perf_counter()
+            for _ in range(runs):
+                blob = enc(df)
+            enc_ms = (time.perf_counter() - t0) * 1000 / runs
+            t0 = time.perf_counter()
+            for _ in range(runs):
+                dec(blob)
+            dec_ms = (time.perf_counter() - t0) * 1000 / runs
+
+            key = f"bench::codec::{label}::{sym}"
+            client.set(key, blob, ex=60)
+            t0 = time.perf_counter()
+            for _ in range(runs):
+                dec(client.get(key))
+            rt_ms = (time.perf_counter() - t0) * 1000 / runs
+            client.delete(key)
+
+            row[f"{label}_bytes"] = len(blob)
+            row[f"{label}_encode_ms"] = round(enc_ms, 3)
+            row[f"{label}_decode_ms"] = round(dec_ms, 3)
+            row[f"{label}_redis_roundtrip_ms"] = round(rt_ms, 3)
+            row[f"{label}_speedup_vs_fetch"] = round(fetch_ms / max(rt_ms, 1e-6), 1)
+        rows.append(row)
+        print(row)
+    return rows
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1:] or ["VCB", "FPT", "HPG"])
@@ -0,0 +1,287 @@
+"""
+Kho OHLCV ngày bền vững (persisted), mỗi mã 1 file Parquet cột:
+    <OHLCV_STORE_DIR>/<SYMBOL>.parquet   index = ngày (datetime64, 00:00), cột open/high/low/close/volume
+    <OHLCV_STORE_DIR>/<SYMBOL>.json      meta: first/last, listed_from, synced_at
+
+- history(sym, start, end): đọc local; chỉ gọi upstream cho đoạn còn thiếu
+  (phần đầu chưa backfill, hoặc các phiên sau `last` chưa đồng bộ).
+- Dữ liệu coi là đầy đủ tới ngày synced_at (nếu đồng bộ sau giờ đóng cửa / cuối tuần),
+  ngược lại tới ngày trước đó -> truy vấn quá khứ không cần mạng.
+- Phiên hôm nay đang chạy: tối đa 1 lần refresh đuôi / OHLCV_STORE_TAIL_TTL giây.
+- Ghi file tmp (tên riêng mỗi lần ghi) + os.replace, đọc lại khi mtime đổi; đồng bộ 1 mã
+  chạy dưới khoá thread + fcntl theo mã (nhiều process đọc/ghi cùng thư mục).
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: không khoá liên process
+    fcntl = None
+
+OHLCV_STORE_DIR = os.getenv("OHLCV_STORE_DIR", "data/ohlcv")
+# Refresh đuôi (phiên đang giao dịch / upstream lỗi) tối đa 1 lần mỗi N giây cho mỗi mã
+OHLCV_STORE_TAIL_TTL = float(os.getenv("OHLCV_STORE_TAIL_TTL", 300))
+# Sau mốc này (giờ VN) coi như nến ngày đã chốt
+OHLCV_STORE_CLOSE_HHMM = os.getenv("OHLCV_STORE_CLOSE_HHMM", "15:05")
+
+COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# fetcher(symbol, "YYYY-MM-DD", "YYYY-MM-DD") -> DataFrame OHLCV đã normalize
+# (rỗng nếu upstream trả lời nhưng không có phiên nào; raise nếu upstream lỗi)
+Fetcher = Callable[[str, str, str], pd.DataFrame]
+
+
+def _empty() -> pd.DataFrame:
+    return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name="date"), dtype="float64")
+
+
+def _to_daily(df: pd.DataFrame) -> pd.DataFrame:
+    """Index về ngày (bỏ giờ), mỗi ngày 1 dòng (giữ bản mới nhất), sort tăng dần."""
+    if df is None or df.empty:
+        return _empty()
+    out = df[COLUMNS].astype("float64").copy()
+    out.index = pd.DatetimeIndex(out.index).normalize()
+    out.index.name = "date"
+    out = out[~out.index.duplicated(keep="last")]
+    return out.sort_index()
+
+
+class OHLCVStore:
+    def __init__(self, fetcher: Fetcher, path: str = OHLCV_STORE_DIR,
+                 tail_ttl: float = OHLCV_STORE_TAIL_TTL, close_hhmm: str = OHLCV_STORE_CLOSE_HHMM,
+                 now_fn: Optional[Callable[[], datetime]] = None):
+        self.fetcher = fetcher
+        self.path = path
+        self.tail_ttl = float(tail_ttl)
+        hh, mm = close_hhmm.split(":")
+        self.close_time = (int(hh), int(mm))
+        self.now_fn = now_fn or datetime.now
+        # sym -> (mtime, df, meta) đã đọc từ đĩa
+        self._mem: Dict[str, tuple] = {}
+        # sym -> lần thử upstream gần nhất (chặn gọi lặp khi upstream lỗi / chưa có phiên mới)
+        self._head_failed: Dict[str, float] = {}
+        self._tail_attempted: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._stats = {"local_hits": 0, "fetches": 0, "fetch_errors": 0, "rows_fetched": 0}
+
+    # ====== IO ======
+    def _file(self, sym: str, ext: str) -> str:
+        return os.path.join(self.path, f"{sym}.{ext}")
+
+    def _lock_of(self, sym: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(sym, threading.Lock())
+
+    @contextmanager
+    def _sym_lock(self, sym: str):
+        """Khoá đồng bộ 1 mã: thread lock trong process + fcntl trên <SYMBOL>.lock giữa các process."""
+        with self._lock_of(sym):
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(sym, "lock"), "a") as lf:
+                if fcntl is not None:
+                    fcntl.flock(lf, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _replace_atomic(self, dst: str, write_fn: Callable[[str], None]):
+        """Ghi qua file tmp tên riêng (pid + uuid) rồi os.replace -> không đè tmp của process khác."""
+        tmp = f"{dst}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            write_fn(tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def symbols(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(f[:-8] for f in os.listdir(self.path) if f.endswith(".parquet"))
+
+    def _read(self, sym: str):
+        """(df, meta) từ RAM, đọc lại đĩa nếu file đã bị process khác ghi đè."""
+        pq = self._file(sym, "parquet")
+        try:
+            mtime = os.path.getmtime(pq)
+        except OSError:
+            return _empty(), {}
+        try:
+            # meta ghi sau parquet -> đọc lại cả khi chỉ meta vừa đổi
+            mtime = (mtime, os.path.getmtime(self._file(sym, "json")))
+        except OSError:
+            mtime = (mtime, None)
+        cached = self._mem.get(sym)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        df = pd.read_parquet(pq)
+        try:
+            with open(self._file(sym, "json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        self._mem[sym] = (mtime, df, meta)
+        return df, meta
+
+    def _write(self, sym: str, df: pd.DataFrame, meta: dict):
+        os.makedirs(self.path, exist_ok=True)
+        pq, js = self._file(sym, "parquet"), self._file(sym, "json")
+        if not df.empty:
+            meta["first"] = df.index[0].strftime("%Y-%m-%d")
+            meta["last"] = df.index[-1].strftime("%Y-%m-%d")
+        meta["rows"] = int(len(df))
+        # Parquet trước, meta sau (mốc commit): chết giữa chừng -> meta cũ chỉ "nhận" ít dữ liệu hơn
+        # thực tế, lần sau tải lại phần thiếu; không bao giờ meta báo đã đồng bộ mà parquet chưa có
+        self._replace_atomic(pq, lambda tmp: df.to_parquet(tmp, compression="zstd"))
+
+        def _dump_meta(tmp: str):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+        self._replace_atomic(js, _dump_meta)
+        self._mem[sym] = ((os.path.getmtime(pq), os.path.getmtime(js)), df, meta)
+
+    # ====== Đồng bộ ======
+    def _complete_until(self, synced_at: Optional[float]) -> Optional[date]:
+        """Ngày cuối cùng chắc chắn đã có đủ nến chốt tại thời điểm synced_at."""
+        if not synced_at:
+            return None
+        ts = datetime.fromtimestamp(synced_at, tz=self.now_fn().tzinfo)
+        closed = ts.weekday() >= 5 or (ts.hour, ts.minute) >= self.close_time
+        return ts.date() if closed else ts.date() - timedelta(days=1)
+
+    def _fetch(self, sym: str, start: date, end: date) -> pd.DataFrame:
+        with self._guard:
+            self._stats["fetches"] += 1
+        try:
+            df = _to_daily(self.fetcher(sym, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")))
+        except Exception as e:
+            with self._guard:
+                self._stats["fetch_errors"] += 1
+            print(f"[OHLCVStore] Không lấy được {sym} {start}..{end}: {e}")
+            return None
+        with self._guard:
+            self._stats["rows_fetched"] += len(df)
+        return df
+
+    def _ensure(self, sym: str, start: date, end: date, force_tail: bool = False):
+        """Tải các đoạn còn thiếu trong [start, end] (nếu có) rồi ghi đĩa."""
+        df, meta = self._read(sym)
+        now = self.now_fn()
+        today = now.date()
+        end = min(end, today)
+
+        parts = []
+        meta = dict(meta)
+        first = df.index[0].date() if not df.empty else None
+        last = df.index[-1].date() if not df.empty else None
+        listed_from = date.fromisoformat(meta["listed_from"]) if meta.get("listed_from") else None
+        head_throttled = time.time() - self._head_failed.get(sym, 0.0) < self.tail_ttl
+        tail_throttled = time.time() - self._tail_attempted.get(sym, 0.0) < self.tail_ttl
+        fetched_to_today = False
+
+        # 1) Chưa có gì / thiếu phần đầu (chưa biết mã niêm yết từ bao giờ).
+        #    Mã mới tải luôn tới hôm nay để dữ liệu local liền mạch tới synced_at.
+        head_end = (first - timedelta(days=1)) if first else today
+        if start <= head_end and (listed_from is None or start < listed_from) and not head_throttled:
+            got = self._fetch(sym, start, head_end)
+            if got is not None:
+                parts.append(got)
+                # Upstream không có gì trước phiên đầu tiên trả về -> không hỏi lại đoạn này
+                meta["listed_from"] = start.strftime("%Y-%m-%d")
+            else:
+                self._head_failed[sym] = time.time()
+            if first is None and got is not None and not got.empty:
+                # Mã mới: vừa tải tới hôm nay -> không cần refresh đuôi ngay
+                last = got.index[-1].date()
+                meta["synced_at"] = self.now_fn().timestamp()
+                self._tail_attempted[sym] = time.time()
+                fetched_to_today = True
+
+        # 2) Đuôi: các phiên sau lần đồng bộ cuối (lấy lại cả `last` để sửa nến chưa chốt)
+        complete = self._complete_until(meta.get("synced_at"))
+        need_tail = last is not None and not fetched_to_today and (complete is None or end > complete)
+        if need_tail and (force_tail or not tail_throttled):
+            self._tail_attempted[sym] = time.time()
+            got = self._fetch(sym, last, today)
+            if got is not None:
+                parts.append(got)
+                meta["synced_at"] = self.now_fn().timestamp()
+
+        if not parts:
+            return df
+        merged = _to_daily(pd.concat([df] + parts))
+        self._write(sym, merged, meta)
+        return merged
+
+    # ====== API ======
+    def history(self, symbol: str, start: date, end: date) -> pd.DataFrame:
+        """OHLCV ngày trong [start, end] (theo ngày); rỗng nếu không có dữ liệu."""
+        sym = symbol.upper()
+        with self._sym_lock(sym):
+            df = self._ensure(sym, start, end)
+        out = df.loc[pd.Timestamp(start):pd.Timestamp(end)]
+        with self._guard:
+            self._stats["local_hits"] += 1
+        return out.copy()
+
+    def at_or_before(self, symbol: str, target: date, lookback_days: int = 10) -> Optional[pd.Series]:
+        """Nến của phiên gần nhất <= target (None nếu không có)."""
+        df = self.history(symbol, target - timedelta(days=lookback_days), target)
+        return None if df.empty else df.iloc[-1]
+
+    def sync(self, symbol: str, backfill_days: int = 0) -> int:
+        """Đồng bộ đuôi 1 mã tới hôm nay (mã mới: backfill N ngày). Trả số dòng hiện có."""
+        sym = symbol.upper()
+        today = self.now_fn().date()
+        with self._sym_lock(sym):
+            df = self._ensure(sym, today - timedelta(days=backfill_days), today, force_tail=True)
+        return len(df)
+
+    def refresh(self, symbols: Iterable[str], backfill_days: int = 0, workers: int = 8) -> Dict[str, object]:
+        """Job refresh cả universe: chạy sync song song, trả tóm tắt."""
+        from modules.utils.fanout import fan_out
+
+        syms = sorted({s.upper() for s in symbols if s})
+        t0 = time.perf_counter()
+        fetches0 = self.stats()["fetches"]
+        ok, failed = 0, []
+        # Chia batch để không chiếm hết pool fan-out dùng chung
+        for i in range(0, len(syms), workers):
+            batch = syms[i:i + workers]
+            results, info = fan_out(
+                {s: (lambda s=s: self.sync(s, backfill_days)) for s in batch},
+                timeout=120.0,
+            )
+            ok += len(results)
+            failed += [s for s in batch if s not in results]
+        summary = {
+            "symbols": len(syms),
+            "ok": ok,
+            "failed": failed,
+            "fetches": self.stats()["fetches"] - fetches0,
+            "sec": round(time.perf_counter() - t0, 2),
+        }
+        print(f"[OHLCVStore] Refresh universe: {summary}")
+        return summary
+
+    def stats(self) -> Dict[str, object]:
+        with self._guard:
+            s = dict(self._stats)
+        s["symbols_in_memory"] = len(self._mem)
+        return s
@@ -0,0 +1,391 @@
+"""
+ONNX Runtime backend (CPU) cho embedder (MiniLM) và reranker (CrossEncoder).
+- export_*: xuất model HF sang ONNX, tuỳ chọn quantize dynamic int8.
+- OnnxDenseEncoder / OnnxCrossEncoder: chạy inference qua onnxruntime.
+- parity với PyTorch chạy ngay sau export; không đạt -> services giữ backend torch
+- parity + benchmark so với PyTorch: python -m modules.utils.onnx_backend
+Bật bằng env INFERENCE_BACKEND=onnx (ONNX_QUANTIZE=1 để dùng bản int8).
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ONNX_MODELS_DIR = os.getenv("ONNX_MODELS_DIR", "models/onnx")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+
+
+def onnx_available() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def resolve_backend(backend: Optional[str], device: str) -> str:
+    """
+    Chọn backend inference: 'torch' | 'onnx'.
+    ONNX chỉ dùng cho CPU; thiếu onnxruntime thì fallback torch (không làm hỏng service).
+    """
+    backend = (backend or INFERENCE_BACKEND).lower()
+    if backend != "onnx":
+        return "torch"
+    if device != "cpu":
+        print(f"[ONNX] Device={device} -> giữ backend torch")
+        return "torch"
+    if not onnx_available():
+        print("[ONNX] Chưa cài onnxruntime -> fallback backend torch")
+        return "torch"
+    return "onnx"
+
+
+def _model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODELS_DIR, model_name.replace("/", "__"))
+
+
+def _model_file(model_dir: str, quantize: bool) -> str:
+    return os.path.join(model_dir, "model.int8.onnx" if quantize else "model.onnx")
+
+
+def _quantize(fp32_path: str, int8_path: str):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+
+# Tăng khi đổi cách export -> bản ONNX cũ trên đĩa bị export lại
+EXPORT_VERSION = 2
+# Ngưỡng parity ONNX vs torch; không đạt thì không cho chọn backend onnx
+ONNX_PARITY_MIN_COSINE = float(os.getenv("ONNX_PARITY_MIN_COSINE", 0.98))
+ONNX_PARITY_SCORE_TOL = float(os.getenv("ONNX_PARITY_SCORE_TOL", 0.05))
+
+# Độ dài khác nhau -> batch có padding, attention_mask thực sự có tác dụng khi so parity
+_PARITY_QUERY = "tin tức VNINDEX hôm nay"
+_PARITY_TEXTS = [
+    "VN-Index tăng mạnh nhờ nhóm ngân hàng, khối ngoại mua ròng phiên thứ ba liên tiếp.",
+    "HPG giảm nhẹ.",
+    "FPT công bố kết quả kinh doanh quý, lợi nhuận tăng trưởng hai chữ số so với cùng kỳ năm trước.",
+    "Thời tiết Hà Nội hôm nay nắng nhẹ.",
+]
+
+
+def _read_meta(out_dir: str) -> Dict:
+    path = os.path.join(out_dir, "onnx_meta.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(out_dir: str, **updates) -> None:
+    meta = _read_meta(out_dir)
+    meta.update(updates)
+    with open(os.path.join(out_dir, "onnx_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def _forward_args(model, sample) -> Tuple[List[str], tuple]:
+    """
+    Sắp input theo thứ tự tham số của model.forward (không theo thứ tự key của tokenizer).
+    BertModel.forward(input_ids, attention_mask, token_type_ids, ...) nhận positional,
+    tokenizer lại trả input_ids, token_type_ids, attention_mask -> truyền nguyên thứ tự
+    tokenizer sẽ tráo mask và token types trong graph.
+    """
+    import inspect
+
+    params = list(inspect.signature(model.forward).parameters)
+    missing = [k for k in sample.keys() if k not in params]
+    if missing:
+        raise ValueError(f"model.forward không nhận input {missing}")
+    last = max(params.index(k) for k in sample.keys())
+    input_names = [p for p in params[: last + 1] if p in sample]
+    # Tham số xen giữa mà tokenizer không trả -> None (dùng default của forward)
+    args = tuple(sample[p] if p in sample else None for p in params[: last + 1])
+    return input_names, args
+
+
+def _parity(model, sample, path: str, output_name: str) -> Dict:
+    """So output ONNX với torch trên cùng batch mẫu (cosine cho dense, sai lệch logits cho reranker)."""
+    import torch
+
+    with torch.inference_mode():
+        ref = model(**sample)[0].numpy()
+    session = _session(path)
+    feed = {i.name: sample[i.name].numpy().astype("int64") for i in session.get_inputs()}
+    out = session.run(None, feed)[0]
+
+    if output_name == "logits":
+        ref_s = ref[:, 0] if ref.ndim == 2 else ref.reshape(-1)
+        out_s = out[:, 0] if out.ndim == 2 else out.reshape(-1)
+        diff = float(np.abs(out_s - ref_s).max())
+        # Logits không chuẩn hoá -> tolerance theo biên độ điểm của torch
+        tol = ONNX_PARITY_SCORE_TOL * max(1.0, float(np.ptp(ref_s)))
+        same_top1 = bool(np.argmax(out_s) == np.argmax(ref_s))
+        return {
+            "max_abs_diff": round(diff, 5),
+            "tolerance": round(tol, 5),
+            "same_top1": same_top1,
+            "ok": diff <= tol and same_top1,
+        }
+
+    mask = sample["attention_mask"].numpy()
+    a, b = mean_pool(out, mask), mean_pool(ref, mask)
+    cos = (a * b).sum(1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+    min_cos = float(cos.min())
+    return {
+        "min_cosine": round(min_cos, 5),
+        "threshold": ONNX_PARITY_MIN_COSINE,
+        "ok": min_cos >= ONNX_PARITY_MIN_COSINE,
+    }
+
+
+def _export(model, tokenizer, out_dir: str, output_name: str, pair: bool, quantize: bool) -> str:
+    """
+    Export 1 model HF (torch) sang ONNX với batch/sequence động,
+    rồi chạy parity (fp32 + int8 nếu có) và ghi kết quả vào onnx_meta.json.
+    """
+    import torch
+
+    os.makedirs(out_dir, exist_ok=True)
+    sample = (
+        tokenizer([_PARITY_QUERY] * len(_PARITY_TEXTS), _PARITY_TEXTS, padding=True, return_tensors="pt")
+        if pair
+        else tokenizer(_PARITY_TEXTS, padding=True, return_tensors="pt")
+    )
+    model = model.to("cpu").eval()
+    input_names, args = _forward_args(model, sample)
+    dynamic_axes = {k: {0: "batch", 1: "seq"} for k in input_names}
+    dynamic_axes[output_name] = {0: "batch"} if output_name == "logits" else {0: "batch", 1: "seq"}
+
+    fp32_path = _model_file(out_dir, quantize=False)
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            args,
+            fp32_path,
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(out_dir)
+
+    parity = {"fp32": _parity(model, sample, fp32_path, output_name)}
+    if quantize:
+        int8_path = _model_file(out_dir, quantize=True)
+        _quantize(fp32_path, int8_path)
+        parity["int8"] = _parity(model, sample, int8_path, output_name)
+    _write_meta(out_dir, export_version=EXPORT_VERSION, parity=parity)
+    print(f"[ONNX] Parity {os.path.basename(out_dir)}: {parity}")
+    return _model_file(out_dir, quantize)
+
+
+def export_dense_onnx(model_name: str, quantize: bool = ONNX_QUANTIZE) -> str:
+    from transformers import AutoTokenizer, AutoModel
+
+    out_dir = _model_dir(model_name)
+    tok = AutoTokenizer.from_pretrained(model_name)
+    mdl = AutoModel.from_pretrained(model_name)
+    # Chỉ export last_hidden_state (pooling làm ở numpy theo attention_mask)
+    mdl.config.return_dict = False
+    path = _export(mdl, tok, out_dir, "last_hidden_state", pair=False, quantize=quantize)
+    print(f"[ONNX] Dense model exported → {path}")
+    return path
+
+
+def export_cross_encoder_onnx(model_name: str, quantize: bool = ONNX_QUANTIZE) -> str:
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    out_dir = _model_dir(model_name)
+    ce = CrossEncoder(model_name, device="cpu")
+    mdl = ce.model
+    mdl.config.return_dict = False
+    path = _export(mdl, ce.tokenizer, out_dir, "logits", pair=True, quantize=quantize)
+
+    # Ghi lại activation mà CrossEncoder.predict dùng (sigmoid / identity) để giữ parity điểm số
+    act = getattr(ce, "activation_fn", None) or getattr(ce, "default_activation_function", None)
+    activation = "identity"
+    if act is not None:
+        probe = float(act(torch.tensor([0.0])).reshape(-1)[0])
+        activation = "sigmoid" if abs(probe - 0.5) < 1e-6 else "identity"
+    _write_meta(out_dir, activation=activation, max_length=ce.max_length)
+    print(f"[ONNX] CrossEncoder exported → {path} (activation={activation})")
+    return path
+
+
+def _session(path: str):
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    n_threads = int(os.getenv("ONNX_NUM_THREADS", 0))
+    if n_threads > 0:
+        opts.intra_op_num_threads = n_threads
+    return ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+
+def _ensure_exported(model_name: str, quantize: bool, exporter) -> str:
+    """
+    Export nếu chưa có (hoặc bản cũ trước EXPORT_VERSION / thiếu kết quả parity),
+    rồi chặn backend onnx khi parity so với torch không đạt.
+    """
+    model_dir = _model_dir(model_name)
+    path = _model_file(model_dir, quantize)
+    tag = "int8" if quantize else "fp32"
+    meta = _read_meta(model_dir)
+    if (
+        not os.path.exists(path)
+        or meta.get("export_version") != EXPORT_VERSION
+        or tag not in meta.get("parity", {})
+    ):
+        exporter(model_name, quantize=quantize)
+        meta = _read_meta(model_dir)
+    check = meta.get("parity", {}).get(tag, {})
+    if not check.get("ok"):
+        raise RuntimeError(f"[ONNX] {model_name} ({tag}) lệch so với torch: {check}")
+    return path
+
+
+class OnnxDenseEncoder:
+    """Chạy MiniLM qua onnxruntime; trả last_hidden_state (numpy)."""
+
+    def __init__(self, model_name: str, quantize: bool = ONNX_QUANTIZE):
+        self.model_name = model_name
+        self.quantize = quantize
+        self.path = _ensure_exported(model_name, quantize, export_dense_onnx)
+        self.session = _session(self.path)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, features: Dict[str, np.ndarray]) -> np.ndarray:
+        feed = {k: np.asarray(features[k], dtype="int64") for k in self.input_names if k in features}
+        return self.session.run(None, feed)[0]
+
+
+class OnnxCrossEncoder:
+    """Thay thế CrossEncoder.predict bằng onnxruntime (cùng tokenizer + activation)."""
+
+    def __init__(self, model_name: str, quantize: bool = ONNX_QUANTIZE, batch_size: int = 32):
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.path = _ensure_exported(model_name, quantize, export_cross_encoder_onnx)
+        model_dir = _model_dir(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        meta = _read_meta(model_dir)
+        self.activation = meta.get("activation", "identity")
+        self.max_length = meta.get("max_length") or 512
+        self.session = _session(self.path)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def predict(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        if not pairs:
+            return np.zeros(0, dtype="float32")
+        scores = []
+        for start in range(0, len(pairs), self.batch_size):
+            chunk = pairs[start : start + self.batch_size]
+            enc = self.tokenizer(
+                [q for q, _ in chunk],
+                [d for _, d in chunk],
+                truncation=True,
+                padding=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feed = {k: enc[k].astype("int64") for k in self.input_names if k in enc}
+            logits = self.session.run(None, feed)[0]
+            scores.append(logits[:, 0] if logits.ndim == 2 else logits.reshape(-1))
+        out = np.concatenate(scores).astype("float32")
+        if self.activation == "sigmoid":
+            out = 1.0 / (1.0 + np.exp(-out))
+        return out
+
+
+def mean_pool(hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+# ====== Parity + benchmark ======
+def _timeit(fn, runs: int) -> float:
+    fn()  # warmup
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - t0) / runs
+
+
+def compare_backends(
+    texts: Optional[List[str]] = None,
+    query: str = "tin tức VNINDEX hôm nay",
+    runs: int = 10,
+) -> Dict[str, Dict]:
+    """
+    So sánh torch vs onnx (fp32 / int8) trên CPU:
+    - dense: cosine nhỏ nhất giữa embedding 2 backend
+    - reranker: sai lệch tuyệt đối lớn nhất + tương quan thứ hạng top-1
+    - latency trung bình / batch và throughput (texts/s)
+    """
+    from modules.utils.services import EmbedderServices, RerankerServices
+
+    texts = texts or [
+        "VN-Index tăng mạnh nhờ nhóm ngân hàng, khối ngoại mua ròng phiên thứ ba liên tiếp.",
+        "Giá thép Hòa Phát điều chỉnh, cổ phiếu HPG giảm nhẹ trong phiên sáng.",
+        "FPT công bố kết quả kinh doanh quý, lợi nhuận tăng trưởng hai chữ số.",
+        "Lãi suất liên ngân hàng hạ nhiệt, thanh khoản hệ thống dồi dào.",
+    ] * 8
+
+    report: Dict[str, Dict] = {}
+    torch_emb = EmbedderServices(auto_fit=False, device="cpu", backend="torch")
+    ref_dense = np.asarray(torch_emb.encode_dense(texts))
+    report["dense_torch"] = {
+        "sec_per_batch": round(_timeit(lambda: torch_emb.encode_dense(texts), runs), 4)
+    }
+
+    torch_rr = RerankerServices(device="cpu", backend="torch")
+    pairs = [(query, t) for t in texts]
+    ref_scores = np.asarray(torch_rr._predict(pairs), dtype="float64")
+    report["rerank_torch"] = {
+        "sec_per_batch": round(_timeit(lambda: torch_rr._predict(pairs), runs), 4)
+    }
+
+    for quantize in (False, True):
+        tag = "int8" if quantize else "fp32"
+
+        emb = EmbedderServices(auto_fit=False, device="cpu", backend="onnx", onnx_quantize=quantize)
+        dense = np.asarray(emb.encode_dense(texts))
+        cos = (dense * ref_dense).sum(1) / (
+            np.linalg.norm(dense, axis=1) * np.linalg.norm(ref_dense, axis=1) + 1e-12
+        )
+        sec = _timeit(lambda: emb.encode_dense(texts), runs)
+        report[f"dense_onnx_{tag}"] = {
+            "min_cosine_vs_torch": round(float(cos.min()), 5),
+            "sec_per_batch": round(sec, 4),
+            "texts_per_sec": round(len(texts) / sec, 1),
+            "speedup_vs_torch": round(report["dense_torch"]["sec_per_batch"] / sec, 2),
+        }
+
+        rr = RerankerServices(device="cpu", backend="onnx", onnx_quantize=quantize)
+        scores = np.asarray(rr._predict(pairs), dtype="float64")
+        sec = _timeit(lambda: rr._predict(pairs), runs)
+        report[f"rerank_onnx_{tag}"] = {
+            "max_abs_diff_vs_torch": round(float(np.abs(scores - ref_scores).max()), 5),
+            "same_top1": bool(np.argmax(scores) == np.argmax(ref_scores)),
+            "sec_per_batch": round(sec, 4),
+            "pairs_per_sec": round(len(pairs) / sec, 1),
+            "speedup_vs_torch": round(report["rerank_torch"]["sec_per_batch"] / sec, 2),
+        }
+
+    for k, v in report.items():
+        print(f"{k:18s} {v}")
+    return report
+
+
+if __name__ == "__main__":
+    compare_backends()
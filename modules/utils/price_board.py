@@ -0,0 +1,230 @@
+"""
+Snapshot bảng giá (price_board) dùng chung, cập nhật bởi 1 thread nền:
+- Poll cả watchlist theo lô (PRICE_BOARD_BATCH mã / lời gọi) mỗi PRICE_BOARD_POLL_SEC giây
+  trong giờ giao dịch, ngoài giờ thưa hơn (PRICE_BOARD_IDLE_SEC).
+- Mã được hỏi mà chưa có trong watchlist -> tự đăng ký, vòng poll sau có luôn
+  (process không poll ghi đăng ký vào sorted set Redis pb::subs, poller gộp vào vòng poll).
+- Snapshot giữ trong RAM + Redis (PRICE_BOARD_REDIS, mặc định bật).
+- Chỉ 1 process poll upstream: ingestion đặt PRICE_BOARD_POLLER=1 và start() poller;
+  UI / API (mặc định tắt) chỉ đọc snapshot Redis, thiếu / cũ mới gọi price_board cho riêng mã đó.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bật (=1) ở đúng 1 process (ingestion); process khác đọc snapshot từ Redis
+PRICE_BOARD_POLLER = os.getenv("PRICE_BOARD_POLLER", "0") == "1"
+PRICE_BOARD_POLL_SEC = float(os.getenv("PRICE_BOARD_POLL_SEC", 5))
+PRICE_BOARD_IDLE_SEC = float(os.getenv("PRICE_BOARD_IDLE_SEC", 300))
+PRICE_BOARD_BATCH = int(os.getenv("PRICE_BOARD_BATCH", 100))
+PRICE_BOARD_REDIS = os.getenv("PRICE_BOARD_REDIS", "1") == "1"
+PRICE_BOARD_PREFIX = "pb::"
+# Số mã đăng ký động tối đa (ngoài watchlist cấu hình)
+PRICE_BOARD_MAX_DYNAMIC = int(os.getenv("PRICE_BOARD_MAX_DYNAMIC", 500))
+# Đăng ký động dùng chung giữa các process: sorted set {SYMBOL: lần hỏi gần nhất}
+PRICE_BOARD_SUBS_KEY = PRICE_BOARD_PREFIX + "subs"
+# Mã không được hỏi lại trong N giây -> poller bỏ khỏi vòng poll
+PRICE_BOARD_SUB_TTL = float(os.getenv("PRICE_BOARD_SUB_TTL", 1800))
+
+# fetch_board(symbols) -> {SYMBOL: row dict}; watchlist_fn() -> list mã
+BoardFetcher = Callable[[List[str]], Dict[str, dict]]
+
+
+def is_trading_hours(now: datetime) -> bool:
+    """Ngày thường 09:00–15:00 (gồm nghỉ trưa: giá tham chiếu vẫn có thể đổi sau ATC buổi sáng)."""
+    return now.weekday() < 5 and (9, 0) <= (now.hour, now.minute) < (15, 0)
+
+
+class PriceBoardPoller:
+    def __init__(self, fetch_board: BoardFetcher, watchlist_fn: Callable[[], Iterable[str]],
+                 now_fn: Callable[[], datetime] = datetime.now,
+                 poll_sec: float = PRICE_BOARD_POLL_SEC, idle_sec: float = PRICE_BOARD_IDLE_SEC,
+                 batch: int = PRICE_BOARD_BATCH, use_redis: bool = PRICE_BOARD_REDIS,
+                 autostart: bool = PRICE_BOARD_POLLER):
+        self.fetch_board = fetch_board
+        self.watchlist_fn = watchlist_fn
+        self.now_fn = now_fn
+        self.poll_sec = float(poll_sec)
+        self.idle_sec = float(idle_sec)
+        self.batch = int(batch)
+        self.use_redis = bool(use_redis)
+        self.autostart = bool(autostart)
+        self._snap: Dict[str, Tuple[dict, float]] = {}   # sym -> (row, ts)
+        self._dynamic: "OrderedDict[str, None]" = OrderedDict()
+        self._published: Dict[str, float] = {}   # sym -> lần ghi pb::subs gần nhất
+        self._watchlist: List[str] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stats = {"polls": 0, "poll_errors": 0, "upstream_calls": 0, "rows": 0,
+                       "hits": 0, "misses": 0, "stale": 0, "last_poll_sec": None}
+
+    # ====== Snapshot ======
+    def max_age(self) -> float:
+        """Tuổi tối đa để coi snapshot còn tươi (theo nhịp poll hiện tại)."""
+        return (self.poll_sec if is_trading_hours(self.now_fn()) else self.idle_sec) * 3
+
+    def put(self, rows: Dict[str, dict], ts: Optional[float] = None):
+        ts = ts or time.time()
+        with self._lock:
+            for sym, row in rows.items():
+                self._snap[sym] = (row, ts)
+        if self.use_redis and rows:
+            try:
+                from modules.utils.services import redis_services
+
+                pipe = redis_services.client.pipeline(transaction=False)
+                ex = max(1, int(self.idle_sec * 3))
+                for sym, row in rows.items():
+                    pipe.set(PRICE_BOARD_PREFIX + sym, json.dumps({"row": row, "ts": ts}), ex=ex)
+                pipe.execute()
+            except Exception as e:
+                print(f"[PriceBoard] Lỗi ghi Redis: {e}")
+
+    def get(self, symbol: str) -> Optional[Tuple[dict, float]]:
+        """(row, ts) còn tươi của mã, hoặc None (chưa có / đã cũ). Tự đăng ký mã cho vòng poll sau
+        (lần đầu gọi cũng khởi động poller nếu autostart)."""
+        sym = symbol.upper()
+        self.subscribe([sym])
+        with self._lock:
+            item = self._snap.get(sym)
+        if item is None and self.use_redis:
+            item = self._get_redis(sym)
+        limit = self.max_age()
+        with self._lock:
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            if time.time() - item[1] > limit:
+                self._stats["stale"] += 1
+                return None
+            self._stats["hits"] += 1
+        return item
+
+    def _get_redis(self, sym: str) -> Optional[Tuple[dict, float]]:
+        try:
+            from modules.utils.services import redis_services
+
+            raw = redis_services.client.get(PRICE_BOARD_PREFIX + sym)
+            if not raw:
+                return None
+            data = json.loads(raw)
+            return data["row"], float(data["ts"])
+        except Exception:
+            return None
+
+    def subscribe(self, symbols: Iterable[str]):
+        """
+        Đăng ký mã cho vòng poll sau. Process có poller giữ trong RAM;
+        process khác (UI / API) ghi vào pb::subs để poller ở ingestion thấy.
+        """
+        if self.autostart:
+            self.start()
+        now = time.time()
+        publish = []
+        with self._lock:
+            for s in symbols:
+                if s in self._watchlist:
+                    continue
+                if s in self._dynamic:
+                    self._dynamic.move_to_end(s)
+                else:
+                    self._dynamic[s] = None
+                    while len(self._dynamic) > PRICE_BOARD_MAX_DYNAMIC:
+                        self._published.pop(self._dynamic.popitem(last=False)[0], None)
+                # Gia hạn đăng ký chung tối đa ~3 lần / TTL, không ghi Redis mỗi lượt hỏi
+                if now - self._published.get(s, 0.0) > PRICE_BOARD_SUB_TTL / 3:
+                    self._published[s] = now
+                    publish.append(s)
+        if publish and self.use_redis and not self.autostart:
+            try:
+                from modules.utils.services import redis_services
+
+                redis_services.client.zadd(PRICE_BOARD_SUBS_KEY, {s: now for s in publish})
+            except Exception as e:
+                print(f"[PriceBoard] Lỗi ghi đăng ký Redis: {e}")
+
+    # ====== Poll ======
+    def _shared_subs(self) -> List[str]:
+        """Mã do process khác đăng ký (pb::subs) còn trong PRICE_BOARD_SUB_TTL, mới nhất trước."""
+        if not self.use_redis:
+            return []
+        try:
+            from modules.utils.services import redis_services
+
+            cutoff = time.time() - PRICE_BOARD_SUB_TTL
+            pipe = redis_services.client.pipeline(transaction=False)
+            pipe.zremrangebyscore(PRICE_BOARD_SUBS_KEY, "-inf", cutoff)
+            pipe.zrevrangebyscore(PRICE_BOARD_SUBS_KEY, "+inf", cutoff, start=0, num=PRICE_BOARD_MAX_DYNAMIC)
+            return [s.decode() if isinstance(s, bytes) else s for s in pipe.execute()[1]]
+        except Exception as e:
+            print(f"[PriceBoard] Lỗi đọc đăng ký Redis: {e}")
+            return []
+
+    def _symbols(self) -> List[str]:
+        shared = self._shared_subs()
+        with self._lock:
+            return list(dict.fromkeys(self._watchlist + list(self._dynamic) + shared))
+
+    def poll_once(self) -> int:
+        """1 vòng poll toàn bộ watchlist + mã đăng ký động, theo lô. Trả số mã cập nhật."""
+        syms = self._symbols()
+        t0 = time.perf_counter()
+        updated = 0
+        for i in range(0, len(syms), self.batch):
+            chunk = syms[i:i + self.batch]
+            try:
+                with self._lock:
+                    self._stats["upstream_calls"] += 1
+                rows = self.fetch_board(chunk)
+            except Exception as e:
+                with self._lock:
+                    self._stats["poll_errors"] += 1
+                print(f"[PriceBoard] Lỗi poll {len(chunk)} mã: {e}")
+                continue
+            self.put(rows)
+            updated += len(rows)
+        with self._lock:
+            self._stats["polls"] += 1
+            self._stats["rows"] += updated
+            self._stats["last_poll_sec"] = round(time.perf_counter() - t0, 3)
+        return updated
+
+    def _run(self):
+        try:
+            wl = [s.upper() for s in self.watchlist_fn() if s]
+        except Exception as e:
+            print(f"[PriceBoard] Không lấy được watchlist: {e}")
+            wl = []
+        with self._lock:
+            self._watchlist = list(dict.fromkeys(wl))
+        print(f"[PriceBoard] Poller chạy: {len(self._watchlist)} mã watchlist")
+
+        while not self._stop.is_set():
+            self.poll_once()
+            interval = self.poll_sec if is_trading_hours(self.now_fn()) else self.idle_sec
+            self._stop.wait(timeout=interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="price-board-poller", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            s = dict(self._stats)
+            s["symbols"] = len(self._snap)
+            s["watchlist"] = len(self._watchlist)
+            s["dynamic"] = len(self._dynamic)
+            s["running"] = bool(self._thread and self._thread.is_alive())
+        return s
@@ -1,4 +1,4 @@
-from rag_note.modules.utils.services import qdrant_services, embedder_services
+from modules.utils.services import qdrant_services, embedder_services
 from qdrant_client import models
 import uuid
 
@@ -50,31 +50,64 @@ def get_doc(collection_name, point_id):
     )
     return result[0].payload if result else None
 
-def search_hybrid(collection_name,query, top_k=5):
-    dense_vector = embedder_services.encode_dense(query)[0]
-    sparse_vector = embedder_services.encode_sparse(query)
-    binary_vector = embedder_services.encode_binary(dense_vector)
-    prefetch_list = [
-        models.Prefetch(
-            query=dense_vector,
-            using="dense_vector"
-        ),
-        models.Prefetch(
-            query=sparse_vector,
-            using="sparse_vector"   
-        ),
-        models.Prefetch(
-            query=binary_vector,
-            using="binary"
+def hybrid_query_points(
+    dense_vector,
+    sparse_vector,
+    top_k: int = 5,
+    query_filter: models.Filter | None = None,
+    prefetch_limit: int | None = None,
+    collection_name: str | None = None,
+):
+    """
+    Hybrid search phía server trong 1 round-trip:
+    - prefetch dense + sparse (mỗi nhánh có cùng filter thời gian),
+    - Qdrant tự fuse bằng RRF,
+    - trả về list ScoredPoint đã fuse (kèm payload).
+    """
+    prefetch_limit = prefetch_limit or top_k * 2
+    prefetch_list = []
+    if dense_vector is not None:
+        prefetch_list.append(
+            models.Prefetch(
+                query=dense_vector,
+                using="dense_vector",
+                filter=query_filter,
+                limit=prefetch_limit,
+            )
         )
-    ]
+    if sparse_vector is not None and sparse_vector.get("indices"):
+        prefetch_list.append(
+            models.Prefetch(
+                query=models.SparseVector(
+                    indices=sparse_vector["indices"],
+                    values=sparse_vector["values"],
+                ),
+                using="sparse_vector",
+                filter=query_filter,
+                limit=prefetch_limit,
+            )
+        )
+    if not prefetch_list:
+        return []
 
-    result= qdrant_services.client.query_points(
-        collection_name=collection_name,
+    result = qdrant_services.client.query_points(
+        collection_name=collection_name or qdrant_services.collection_name,
         prefetch=prefetch_list,
         query=models.FusionQuery(fusion=models.Fusion.RRF),
+        query_filter=query_filter,
         limit=top_k,
         with_payload=True,
     )
+    return result.points
 
-    return [{"id": r.id, "score": r.score, "payload": r.payload} for r in result.points]
+
+def search_hybrid(collection_name, query, top_k=5):
+    dense_vector = embedder_services.encode_dense(query)[0]
+    sparse_vector = embedder_services.encode_sparse(query)[0]
+    points = hybrid_query_points(
+        dense_vector,
+        sparse_vector,
+        top_k=top_k,
+        collection_name=collection_name,
+    )
+    return [{"id": r.id, "score": r.score, "payload": r.payload} for r in points]
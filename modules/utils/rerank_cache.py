@@ -0,0 +1,108 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from modules.utils.services import redis_services
+
+RERANK_CACHE_L1_SIZE = int(os.getenv("RERANK_CACHE_L1_SIZE", 20000))
+RERANK_CACHE_TTL = int(os.getenv("RERANK_CACHE_TTL", 72 * 3600))
+RERANK_CACHE_PREFIX = "rr::"
+
+
+def _normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", (query or "").strip().lower())
+
+
+def doc_cache_key(doc: Dict) -> str:
+    """
+    Định danh 1 cặp doc cho cache: id + hash nội dung
+    (content của cùng 1 id có thể khác nhau khi retriever gộp dense + sparse).
+    """
+    content = doc.get("content", "") or ""
+    h = hashlib.md5(content.encode("utf-8")).hexdigest()[:10]
+    return f"{doc.get('id')}:{h}"
+
+
+class RerankScoreCache:
+    """
+    Cache điểm CrossEncoder theo (query-hash, doc-key) -> score:
+    - L1: LRU trong process.
+    - L2: Redis hash `rr::<query-hash>` (field = doc-key), 1 lệnh HMGET cho cả request.
+    query-hash gồm tên model để đổi model là cache tự vô hiệu.
+    """
+
+    def __init__(self, max_size: int = RERANK_CACHE_L1_SIZE, ttl_seconds: int = RERANK_CACHE_TTL):
+        self.max_size = int(max_size)
+        self.ttl_seconds = int(ttl_seconds)
+        self._l1: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "l2_errors": 0}
+
+    @staticmethod
+    def query_hash(query: str, model_name: str) -> str:
+        raw = f"{model_name}||{_normalize_query(query)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, query: str, model_name: str, keys: List[str]) -> Dict[str, float]:
+        qh = self.query_hash(query, model_name)
+        found: Dict[str, float] = {}
+        with self._lock:
+            for k in keys:
+                v = self._l1.get((qh, k))
+                if v is not None:
+                    self._l1.move_to_end((qh, k))
+                    found[k] = v
+
+        missing = [k for k in keys if k not in found]
+        if missing:
+            try:
+                vals = redis_services.client.hmget(RERANK_CACHE_PREFIX + qh, missing)
+                for k, v in zip(missing, vals):
+                    if v is not None:
+                        found[k] = float(v)
+                        self._l1_put(qh, k, float(v))
+            except Exception:
+                with self._lock:
+                    self._stats["l2_errors"] += 1
+
+        with self._lock:
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    def _l1_put(self, qh: str, key: str, score: float):
+        with self._lock:
+            self._l1[(qh, key)] = score
+            self._l1.move_to_end((qh, key))
+            while len(self._l1) > self.max_size:
+                self._l1.popitem(last=False)
+
+    def set_many(self, query: str, model_name: str, scores: Dict[str, float]):
+        if not scores:
+            return
+        qh = self.query_hash(query, model_name)
+        for k, v in scores.items():
+            self._l1_put(qh, k, float(v))
+        try:
+            rkey = RERANK_CACHE_PREFIX + qh
+            pipe = redis_services.client.pipeline()
+            pipe.hset(rkey, mapping={k: float(v) for k, v in scores.items()})
+            pipe.expire(rkey, self.ttl_seconds)
+            pipe.execute()
+        except Exception:
+            with self._lock:
+                self._stats["l2_errors"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["l1_size"] = len(self._l1)
+        total = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / total, 4) if total else 0.0
+        return s
+
+
+rerank_score_cache = RerankScoreCache()
@@ -1,30 +1,201 @@
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
-import redis
-from transformers import AutoTokenizer, AutoModel
-import torch
-from dotenv import load_dotenv
-from huggingface_hub import login
 import os
-from rank_bm25 import BM25Okapi
-from sentence_transformers import CrossEncoder
-import numpy as np
-from langchain.chat_models import init_chat_model
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
 
 # Load biến môi trường
 load_dotenv()
-hf_token = os.getenv("HF_TOKEN")
-if hf_token:
-    login(token=hf_token)
 
 # Disable Torch Dynamo
 os.environ['TORCH_COMPILE_DEBUG'] = '0'
 os.environ['TORCHDYNAMO_DISABLE'] = '1'
-torch._dynamo.config.suppress_errors = True
+
+_hf_login_lock = threading.Lock()
+_hf_logged_in = False
+
+
+def _prepare_hf_runtime():
+    """
+    Chỉ chạy khi có service cần model HuggingFace (embedder/reranker/sentiment):
+    - login HF_TOKEN (1 lần / process)
+    - tắt torch dynamo
+    """
+    global _hf_logged_in
+    with _hf_login_lock:
+        if _hf_logged_in:
+            return
+        import torch
+        torch._dynamo.config.suppress_errors = True
+
+        hf_token = os.getenv("HF_TOKEN")
+        if hf_token:
+            from huggingface_hub import login
+            login(token=hf_token)
+        _hf_logged_in = True
+
+
+# ====== Registry service khởi tạo lười (lazy) ======
+# Service khởi tạo lỗi: không thử lại trong SERVICE_RETRY_SEC giây (gấp đôi sau mỗi lần lỗi liên tiếp,
+# tối đa SERVICE_RETRY_MAX_SEC) -> request không phải chạy lại factory nặng (tải model...) mỗi lần
+SERVICE_RETRY_SEC = float(os.getenv("SERVICE_RETRY_SEC", 30))
+SERVICE_RETRY_MAX_SEC = float(os.getenv("SERVICE_RETRY_MAX_SEC", 600))
+
+
+class _Provider:
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.instance: Any = None
+        self.state = "idle"          # idle | loading | ready | error
+        self.error: Optional[str] = None
+        self.load_sec: Optional[float] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+
+    def backoff_error(self) -> Optional[RuntimeError]:
+        """Lỗi trả ngay (không gọi factory) nếu đang trong thời gian chờ thử lại."""
+        if self.state == "error" and time.time() < self.retry_at:
+            return RuntimeError(f"Service `{self.name}` khởi tạo lỗi (thử lại sau "
+                                f"{self.retry_at - time.time():.0f}s): {self.error}")
+        return None
+
+
+class ServiceRegistry:
+    """
+    Registry các service dùng chung, KHÔNG khởi tạo lúc import.
+    - register(name, factory): khai báo provider.
+    - get(name): khởi tạo ở lần gọi đầu tiên (thread-safe), các lần sau dùng lại.
+    - warmup(*names): entry point chủ động khởi tạo trước những gì nó cần.
+    - readiness(): trạng thái + thời gian khởi tạo từng provider (để monitor/đo cold start).
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, _Provider] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]) -> "LazyService":
+        self._providers[name] = _Provider(name, factory)
+        return LazyService(self, name)
+
+    def names(self) -> list:
+        return list(self._providers.keys())
+
+    def get(self, name: str, force: bool = False) -> Any:
+        """force=True: bỏ qua thời gian chờ thử lại sau lỗi (warmup chủ động)."""
+        prov = self._providers.get(name)
+        if prov is None:
+            raise KeyError(f"Service chưa được đăng ký: {name}")
+        if prov.state == "ready":
+            return prov.instance
+        err = None if force else prov.backoff_error()
+        if err is not None:
+            raise err
+
+        with prov.lock:
+            if prov.state == "ready":
+                return prov.instance
+            # Thread khác vừa thử và lỗi trong lúc chờ lock -> không thử lại ngay
+            err = None if force else prov.backoff_error()
+            if err is not None:
+                raise err
+            prov.state = "loading"
+            t0 = time.perf_counter()
+            try:
+                prov.instance = prov.factory()
+            except Exception as e:
+                prov.state = "error"
+                prov.error = str(e)
+                prov.load_sec = round(time.perf_counter() - t0, 3)
+                prov.failures += 1
+                delay = min(SERVICE_RETRY_SEC * 2 ** (prov.failures - 1), SERVICE_RETRY_MAX_SEC)
+                prov.retry_at = time.time() + delay
+                print(f"[Services] `{name}` khởi tạo lỗi (lần {prov.failures}), thử lại sau {delay:.0f}s: {e}")
+                raise
+            prov.state = "ready"
+            prov.error = None
+            prov.failures = 0
+            prov.load_sec = round(time.perf_counter() - t0, 3)
+            print(f"[Services] `{name}` sẵn sàng sau {prov.load_sec}s")
+            return prov.instance
+
+    def try_get(self, name: str) -> Any:
+        """Như get() nhưng trả None nếu khởi tạo lỗi."""
+        try:
+            return self.get(name)
+        except Exception:
+            return None
+
+    def warmup(self, *names: str, raise_on_error: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Khởi tạo trước các service (mặc định: tất cả).
+        Lỗi của 1 service không chặn các service khác, trừ khi raise_on_error=True.
+        """
+        targets: Iterable[str] = names or self.names()
+        for name in targets:
+            try:
+                self.get(name, force=True)
+            except Exception as e:
+                print(f"[Services] Warmup `{name}` lỗi: {e}")
+                if raise_on_error:
+                    raise
+        return self.readiness(*targets)
+
+    def is_ready(self, name: str) -> bool:
+        prov = self._providers.get(name)
+        return bool(prov and prov.state == "ready")
+
+    def readiness(self, *names: str) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for name in (names or self.names()):
+            prov = self._providers.get(name)
+            if prov is None:
+                continue
+            out[name] = {
+                "state": prov.state,
+                "load_sec": prov.load_sec,
+                "error": prov.error,
+                "retry_in_sec": round(max(0.0, prov.retry_at - time.time()), 1) if prov.state == "error" else None,
+            }
+        return out
+
+
+class LazyService:
+    """
+    Proxy giữ chỗ cho 1 service trong registry.
+    Giữ nguyên cách dùng cũ (`qdrant_services.client`, `embedder_services.encode_dense(...)`),
+    service thật chỉ được khởi tạo khi có thuộc tính đầu tiên được truy cập.
+    """
+
+    def __init__(self, registry: ServiceRegistry, name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, item):
+        return getattr(self._registry.get(self._name), item)
+
+    def __setattr__(self, item, value):
+        setattr(self._registry.get(self._name), item, value)
+
+    def __bool__(self):
+        # Service khởi tạo lỗi được coi như None (giữ hành vi cũ của sentiment_services);
+        # trong thời gian chờ thử lại chỉ trả False, không chạy lại factory
+        return self._registry.try_get(self._name) is not None
+
+    def __repr__(self):
+        prov_state = self._registry.readiness(self._name).get(self._name, {}).get("state")
+        return f"<LazyService {self._name} state={prov_state}>"
+
+
+registry = ServiceRegistry()
 
 
 class QdrantServices:
     def __init__(self, collection_name="cafef_articles", vector_size=384):
+        from qdrant_client import QdrantClient
+        from qdrant_client.http import models
+
         host = os.getenv("QDRANT_HOST", "localhost")
         port = int(os.getenv("QDRANT_PORT", 6333))
         self.client = QdrantClient(host=host, port=port)
@@ -48,15 +219,19 @@ class QdrantServices:
         else:
             print(f"Collection `{self.collection_name}` đã tồn tại.")
 
-qdrant_services = QdrantServices()
+qdrant_services = registry.register("qdrant", QdrantServices)
 
 class RedisCacheServices:
     def __init__(self, db=0):
+        import redis
+
         host = os.getenv("REDIS_HOST", "localhost")
         port = int(os.getenv("REDIS_PORT", 6379))
         self.client = redis.Redis(host=host, port=port, db=db, decode_responses=True)
+        # Client trả bytes cho dữ liệu nhị phân (DataFrame Arrow IPC của TTLCache L2)
+        self.binary_client = redis.Redis(host=host, port=port, db=db, decode_responses=False)
 
-redis_services = RedisCacheServices()
+redis_services = registry.register("redis", RedisCacheServices)
 
 class LLMServices:
     def __init__(
@@ -83,6 +258,8 @@ class LLMServices:
 
         # init_chat_model là helper của bạn, đang dùng provider="openai"
         # vì vLLM expose OpenAI-compatible API
+        from langchain.chat_models import init_chat_model
+
         self.model = init_chat_model(
             model=self.model_name,
             model_provider="openai",
@@ -120,8 +297,7 @@ class LLMServices:
             return f"[Lỗi LLM từ server] {e}"
 
 
-
-llm_services = LLMServices()
+llm_services = registry.register("llm", LLMServices)
 
 class EmbedderServices:
     def __init__(
@@ -130,28 +306,79 @@ class EmbedderServices:
             device=None,
             auto_fit=True,
             collection_name="cafef_articles",
-            max_docs=5000
+            max_docs=5000,
+            dense_batch_size=None,
+            backend=None,
+            onnx_quantize=None,
         ):
+        _prepare_hf_runtime()
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        from modules.utils.onnx_backend import resolve_backend, ONNX_QUANTIZE
+
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-        print("EmbedderServices device:", self.device)
+        self.backend = resolve_backend(backend, self.device)
+        print(f"EmbedderServices device: {self.device}, backend: {self.backend}")
         self.dense_tokenizer = AutoTokenizer.from_pretrained(dense_model_name)
-        self.dense_model = AutoModel.from_pretrained(dense_model_name).to(self.device)
-
-        self.corpus_tokens = None
-        self.bm25 = None
-        self.vocab= {}
-
-        if auto_fit:
+        self.dense_model_name = dense_model_name
+        self.dense_model = None
+        self.onnx_dense = None
+        if self.backend == "onnx":
+            from modules.utils.onnx_backend import OnnxDenseEncoder
+
+            quantize = ONNX_QUANTIZE if onnx_quantize is None else onnx_quantize
+            try:
+                self.onnx_dense = OnnxDenseEncoder(dense_model_name, quantize=quantize)
+            except RuntimeError as e:
+                # Parity ONNX vs torch không đạt -> giữ torch
+                print(f"{e} -> fallback backend torch")
+                self.backend = "torch"
+        if self.backend != "onnx":
+            self.dense_model = AutoModel.from_pretrained(dense_model_name).to(self.device)
+            self.dense_model.eval()
+        # Micro-batch cố định -> bộ nhớ đỉnh không phụ thuộc số text caller truyền vào
+        self.dense_batch_size = int(dense_batch_size or os.getenv("EMBED_BATCH_SIZE", 16))
+
+        # Thống kê BM25 bền vững: serving chỉ load (mmap), KHÔNG scroll Qdrant mỗi lần khởi động
+        from modules.utils.bm25_stats import BM25Stats
+
+        self.bm25_stats = BM25Stats().load()
+        if auto_fit and len(self.bm25_stats) == 0:
+            # Bootstrap 1 lần khi chưa có file thống kê
             self.auto_fit_bm25(collection_name, max_docs)
 
-    def fit_bm25(self,corpus):
-        self.corpus_tokens = [doc.split(" ")  for doc in corpus]
-        self.bm25 = BM25Okapi(self.corpus_tokens)
-        unique_tokens = sorted(set(token for doc in self.corpus_tokens for token in doc))
-        self.vocab = {token: idx for idx, token in enumerate(unique_tokens)}
+    @property
+    def vocab(self):
+        return self.bm25_stats.vocab
 
+    @property
+    def bm25_version(self) -> str:
+        return self.bm25_stats.fingerprint
+
+    def fit_bm25(self, corpus, persist: bool = True):
+        """Fit lại TỪ ĐẦU thống kê BM25 trên corpus (dùng cho bootstrap / rebuild)."""
+        self.bm25_stats.reset()
+        self.bm25_stats.update(corpus)
+        if persist:
+            self.bm25_stats.save()
         print(f"[BM25] Fitted. Corpus size={len(corpus)}, Vocab size={len(self.vocab)}")
 
+    def update_bm25(self, corpus, persist: bool = True) -> int:
+        """Cộng dồn thống kê BM25 với các doc mới (ingestion), giữ nguyên term id cũ."""
+        n = self.bm25_stats.update(corpus)
+        if n and persist:
+            self.bm25_stats.save()
+        print(f"[BM25] Updated +{n} docs. Total docs={self.bm25_stats.n_docs}, Vocab size={len(self.vocab)}")
+        return n
+
+    @property
+    def model_version(self) -> str:
+        """Định danh phiên bản embedder (dense model + backend + thống kê BM25) – dùng làm key cache."""
+        dense_tag = self.dense_model_name
+        if self.onnx_dense is not None:
+            dense_tag += "@onnx-int8" if self.onnx_dense.quantize else "@onnx"
+        return f"{dense_tag}|bm25:{self.bm25_version}"
+
     def auto_fit_bm25(self, collection_name, max_docs=5000):
         try:
             docs, _ = qdrant_services.client.scroll(
@@ -172,46 +399,109 @@ class EmbedderServices:
         except Exception as e:
             print(f"[BM25] Lỗi auto_fit BM25: {e}")
 
-    def encode_dense(self, texts):
+    def encode_dense(self, texts, batch_size=None):
+        """
+        Encode dense theo micro-batch:
+        - Tokenize 1 lần (không padding) để biết độ dài từng text.
+        - Sort theo số token -> mỗi micro-batch chỉ pad tới text dài nhất trong batch đó.
+        - Mean pooling có attention_mask (bỏ qua token padding).
+        - Trả về đúng thứ tự input.
+        Backend onnx: cùng cách chia batch/pooling, chạy qua onnxruntime (numpy).
+        """
+        import torch
+
         if isinstance(texts, str):
             texts = [texts]
-        inputs = self.dense_tokenizer(
-            texts, return_tensors="pt", truncation=True, padding=True
-        ).to(self.device)
-        with torch.no_grad():
-            outputs = self.dense_model(**inputs)
-        return outputs.last_hidden_state.mean(dim=1).cpu().numpy().tolist()
+        if not texts:
+            return []
+
+        bs = max(1, int(batch_size or self.dense_batch_size))
+        enc = self.dense_tokenizer(list(texts), truncation=True, padding=False)
+        lengths = [len(ids) for ids in enc["input_ids"]]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        out = [None] * len(texts)
+        if self.onnx_dense is not None:
+            from modules.utils.onnx_backend import mean_pool
+
+            for start in range(0, len(order), bs):
+                idx = order[start : start + bs]
+                features = {k: [enc[k][i] for i in idx] for k in enc.keys()}
+                inputs = self.dense_tokenizer.pad(features, return_tensors="np")
+                pooled = mean_pool(self.onnx_dense(inputs), inputs["attention_mask"])
+                for i, vec in zip(idx, pooled.tolist()):
+                    out[i] = vec
+            return out
+
+        with torch.inference_mode():
+            for start in range(0, len(order), bs):
+                idx = order[start : start + bs]
+                features = {k: [enc[k][i] for i in idx] for k in enc.keys()}
+                inputs = self.dense_tokenizer.pad(features, return_tensors="pt").to(self.device)
+
+                hidden = self.dense_model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+                for i, vec in zip(idx, pooled.cpu().numpy().tolist()):
+                    out[i] = vec
+        return out
         
     def encode_sparse(self, texts):
-        if self.bm25 is None or not hasattr(self, "vocab") or len(self.vocab) == 0:
+        # Nhận thống kê mới do ingestion ghi ra (kiểm tra mtime, tối đa 1 lần / phút)
+        try:
+            self.bm25_stats.reload_if_changed()
+        except Exception as e:
+            print(f"[BM25] Lỗi reload thống kê: {e}")
+
+        if len(self.bm25_stats) == 0:
             raise ValueError("BM25 chưa được fit")
-        
+
         if isinstance(texts, str):
             texts = [texts]
 
-        results = []
-        for text in texts:
-            tokens = text.split(" ")
-            index_map = {}
-            for token in tokens:
-                if token in self.vocab:
-                    idx = self.vocab[token]
-                    val = self.bm25.idf.get(token, 0.0)
-                    if val > 0:
-                        index_map[idx] = index_map.get(idx, 0.0) + val
-            indices = sorted(list(index_map.keys()))
-            values = list(index_map.values())
-            results.append({"indices": indices, "values": values})
-        return results
+        return [self.bm25_stats.encode(text) for text in texts]
         
-embedder_services = EmbedderServices(auto_fit=True)
+embedder_services = registry.register(
+    "embedder", lambda: EmbedderServices(auto_fit=True)
+)
 
 class RerankerServices:
-    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", device=None):
+    def __init__(
+        self,
+        model_name="cross-encoder/ms-marco-MiniLM-L-6-v2",
+        device=None,
+        backend=None,
+        onnx_quantize=None,
+    ):
+        _prepare_hf_runtime()
+        import torch
+        from modules.utils.onnx_backend import resolve_backend, ONNX_QUANTIZE
+
         self.model_name = model_name
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-        print("RerankerServices device:", self.device)
-        self.model = CrossEncoder(model_name, device=self.device)
+        self.backend = resolve_backend(backend, self.device)
+        print(f"RerankerServices device: {self.device}, backend: {self.backend}")
+        if self.backend == "onnx":
+            from modules.utils.onnx_backend import OnnxCrossEncoder
+
+            quantize = ONNX_QUANTIZE if onnx_quantize is None else onnx_quantize
+            try:
+                self.model = OnnxCrossEncoder(model_name, quantize=quantize)
+                # Điểm int8 lệch nhẹ so với torch -> tách namespace cache điểm
+                self.model_name = f"{model_name}@onnx-int8" if quantize else f"{model_name}@onnx"
+            except RuntimeError as e:
+                # Parity ONNX vs torch không đạt -> giữ torch
+                print(f"{e} -> fallback backend torch")
+                self.backend = "torch"
+        if self.backend != "onnx":
+            from sentence_transformers import CrossEncoder
+
+            self.model = CrossEncoder(model_name, device=self.device)
+
+    def _predict(self, pairs):
+        """Chấm điểm list (query, doc) – CrossEncoder và OnnxCrossEncoder cùng interface predict()."""
+        return self.model.predict(pairs)
 
     def rerank(self, query: str, docs: list):
         """
@@ -228,17 +518,18 @@ class RerankerServices:
         # Nếu input là list[str]
         if isinstance(docs[0], str):
             pairs = [(query,d) for d in docs]
-            scores = self.model.predict(pairs)
+            scores = self._predict(pairs)
             return list(zip(docs, scores))
         # Nếu input là list[dict]
         pairs = [(query, d.get("content", "")) for d in docs]
-        scores = self.model.predict(pairs)
+        scores = self._predict(pairs)
 
         for i, s in enumerate(scores):
             docs[i]["rerank_score"] = float(s)
         docs.sort(key=lambda x: x["rerank_score"], reverse=True)
         return docs
-reranker_services =RerankerServices()
+
+reranker_services = registry.register("reranker", RerankerServices)
 
 class SentimentServices:
     """
@@ -252,6 +543,7 @@ class SentimentServices:
                  model_id: str = "cardiffnlp/twitter-xlm-roberta-base-sentiment",
                  device: str | None = None,
                  max_len: int = 1000):
+        _prepare_hf_runtime()
         import torch
         from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
 
@@ -368,8 +660,15 @@ class SentimentServices:
 
         return results
 
-try:
-    sentiment_services = SentimentServices()
-except Exception as _e:
-    print("[Sentiment] global init failed:", _e)
-    sentiment_services = None
+sentiment_services = registry.register("sentiment", SentimentServices)
+
+
+if __name__ == "__main__":
+    # Đo cold start từng service: python -m modules.utils.services [qdrant embedder ...]
+    import sys
+
+    t0 = time.perf_counter()
+    status = registry.warmup(*sys.argv[1:])
+    for name, info in status.items():
+        print(f"{name:10s} {info['state']:8s} {info['load_sec']}s {info['error'] or ''}")
+    print(f"Tổng warmup: {time.perf_counter() - t0:.3f}s")
@@ -0,0 +1,221 @@
+"""
+Theo dõi sức khoẻ nguồn dữ liệu upstream (VCI / TCBS / MSN của vnstock):
+- EWMA tỉ lệ thành công + EWMA latency cho từng nguồn -> xếp thứ tự thử động
+  (chi phí kỳ vọng = latency / success), nguồn tốt gần nhất của từng mã được ưu tiên.
+- Circuit breaker: lỗi liên tiếp >= SOURCE_CB_FAILURES -> mở mạch SOURCE_CB_OPEN_SEC giây
+  (bỏ qua nguồn đó), hết hạn -> half-open cho đúng 1 request thăm dò.
+- Hedging: nguồn đang thử chậm quá hedge_after giây -> gọi song song nguồn kế tiếp,
+  lấy kết quả hợp lệ về trước.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+SOURCE_EWMA_ALPHA = float(os.getenv("SOURCE_EWMA_ALPHA", 0.2))
+SOURCE_CB_FAILURES = int(os.getenv("SOURCE_CB_FAILURES", 3))
+SOURCE_CB_OPEN_SEC = float(os.getenv("SOURCE_CB_OPEN_SEC", 60))
+# Latency giả định cho nguồn chưa có số đo (giữ thứ tự mặc định lúc khởi động)
+SOURCE_PRIOR_LATENCY_SEC = float(os.getenv("SOURCE_PRIOR_LATENCY_SEC", 1.0))
+
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SOURCE_HEDGE_WORKERS", 16)), thread_name_prefix="src-hedge"
+)
+
+_CLOSED, _OPEN, _HALF_OPEN = "closed", "open", "half_open"
+
+
+class _Source:
+    def __init__(self, name: str):
+        self.name = name
+        self.success = 1.0
+        self.latency = SOURCE_PRIOR_LATENCY_SEC
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = _CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def cost(self) -> float:
+        return self.latency / max(self.success, 0.05)
+
+
+class SourceHealth:
+    def __init__(self, name: str, sources: Sequence[str], alpha: float = SOURCE_EWMA_ALPHA,
+                 failure_threshold: int = SOURCE_CB_FAILURES, open_sec: float = SOURCE_CB_OPEN_SEC,
+                 max_symbols: int = 4096):
+        self.name = name
+        self.sources = list(sources)
+        self.alpha = float(alpha)
+        self.failure_threshold = int(failure_threshold)
+        self.open_sec = float(open_sec)
+        self.max_symbols = int(max_symbols)
+        self._src: Dict[str, _Source] = {s: _Source(s) for s in self.sources}
+        self._last_good: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "short_circuited": 0, "exhausted": 0}
+        _registry[name] = self
+
+    # ====== Circuit breaker ======
+    def _acquire(self, src: str) -> bool:
+        """Cho phép gọi nguồn? (open -> chặn; hết hạn open -> half-open, 1 lượt thăm dò)."""
+        with self._lock:
+            s = self._src[src]
+            if s.state == _CLOSED:
+                return True
+            if s.state == _OPEN and time.time() - s.opened_at >= self.open_sec:
+                s.state = _HALF_OPEN
+            if s.state == _HALF_OPEN and not s.probing:
+                s.probing = True
+                return True
+            self._stats["short_circuited"] += 1
+            return False
+
+    def record(self, src: str, ok: bool, latency: float, symbol: Optional[str] = None):
+        a = self.alpha
+        with self._lock:
+            s = self._src[src]
+            s.calls += 1
+            s.success = (1 - a) * s.success + a * (1.0 if ok else 0.0)
+            s.latency = (1 - a) * s.latency + a * float(latency)
+            s.probing = False
+            if ok:
+                s.consecutive_failures = 0
+                s.state = _CLOSED
+                if symbol:
+                    self._last_good[symbol] = src
+                    self._last_good.move_to_end(symbol)
+                    while len(self._last_good) > self.max_symbols:
+                        self._last_good.popitem(last=False)
+            else:
+                s.failures += 1
+                s.consecutive_failures += 1
+                if s.state == _HALF_OPEN or s.consecutive_failures >= self.failure_threshold:
+                    if s.state != _OPEN:
+                        print(f"[SourceHealth] {self.name}: mở mạch nguồn {src} ({s.consecutive_failures} lỗi liên tiếp)")
+                    s.state = _OPEN
+                    s.opened_at = time.time()
+
+    # ====== Thứ tự thử ======
+    def order(self, symbol: Optional[str] = None) -> List[str]:
+        """Nguồn theo chi phí kỳ vọng tăng dần; nguồn tốt gần nhất của mã lên đầu; mạch mở xuống cuối."""
+        with self._lock:
+            pos = {s: i for i, s in enumerate(self.sources)}
+            good = self._last_good.get(symbol) if symbol else None
+
+            def key(name):
+                s = self._src[name]
+                return (s.state == _OPEN, name != good, s.cost(), pos[name])
+
+            return sorted(self.sources, key=key)
+
+    # ====== Gọi có fallback + hedging ======
+    def call(
+        self,
+        fn: Callable[[str], Any],
+        symbol: Optional[str] = None,
+        accept: Optional[Callable[[Any], bool]] = None,
+        hedge_after: Optional[float] = None,
+    ) -> Tuple[Any, Optional[str]]:
+        """
+        Gọi fn(source) theo order(symbol) tới khi có kết quả accept(...) = True.
+        - fn raise -> nguồn lỗi; fn trả về (kể cả rỗng) -> nguồn vẫn khoẻ.
+        - hedge_after > 0: nguồn đang chạy quá hedge_after giây -> khởi động thêm nguồn kế tiếp.
+        Trả (value, source). Không nguồn nào đạt accept nhưng có nguồn trả lời -> (giá trị đó, None).
+        Mọi nguồn lỗi / bị chặn -> raise RuntimeError.
+        """
+        accept = accept or (lambda v: v is not None)
+        order = self.order(symbol)
+        with self._lock:
+            self._stats["calls"] += 1
+
+        pending: Dict[Any, str] = {}
+        errors: Dict[str, str] = {}
+        answered = [None, False]
+        nxt = [0]
+        hedged = [False]
+
+        def _done(src: str, t0: float):
+            def cb(fut):
+                try:
+                    fut.result()
+                    ok = True
+                except Exception:
+                    ok = False
+                self.record(src, ok, time.perf_counter() - t0, symbol)
+            return cb
+
+        def launch() -> bool:
+            while nxt[0] < len(order):
+                src = order[nxt[0]]
+                nxt[0] += 1
+                if not self._acquire(src):
+                    errors[src] = "circuit open"
+                    continue
+                fut = _hedge_pool.submit(fn, src)
+                fut.add_done_callback(_done(src, time.perf_counter()))
+                pending[fut] = src
+                return True
+            return False
+
+        launch()
+        while pending:
+            can_hedge = bool(hedge_after) and hedge_after > 0 and nxt[0] < len(order)
+            done, _ = wait(list(pending), timeout=hedge_after if can_hedge else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                if launch():
+                    hedged[0] = True
+                    with self._lock:
+                        self._stats["hedged"] += 1
+                continue
+            for fut in done:
+                src = pending.pop(fut)
+                try:
+                    value = fut.result()
+                except Exception as e:
+                    errors[src] = str(e)
+                    continue
+                if accept(value):
+                    # Nguồn hedge về trước nguồn chậm đang chạy
+                    if hedged[0] and pending:
+                        with self._lock:
+                            self._stats["hedge_wins"] += 1
+                    return value, src
+                answered[0], answered[1] = value, True
+            if not pending:
+                launch()
+
+        if answered[1]:
+            return answered[0], None
+        with self._lock:
+            self._stats["exhausted"] += 1
+        raise RuntimeError(f"{self.name}: mọi nguồn lỗi {errors}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["sources"] = {
+                n: {
+                    "state": s.state,
+                    "success_ewma": round(s.success, 3),
+                    "latency_ewma_sec": round(s.latency, 3),
+                    "calls": s.calls,
+                    "failures": s.failures,
+                }
+                for n, s in self._src.items()
+            }
+            out["symbols_tracked"] = len(self._last_good)
+        out["order"] = self.order()
+        return out
+
+
+_registry: Dict[str, SourceHealth] = {}
+
+
+def source_health_stats() -> Dict[str, Dict[str, Any]]:
+    """Trạng thái mọi bộ theo dõi nguồn (để monitor, /health)."""
+    return {name: h.stats() for name, h in _registry.items()}
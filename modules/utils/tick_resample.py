@@ -0,0 +1,225 @@
+"""
+Resample tick -> OHLCV vector hoá cho nhiều mã trong 1 lượt (NumPy, không groupby/resample theo mã).
+
+Đầu vào dạng long: cột symbol, time (datetime64, giờ VN naive), price, volume.
+- Bin theo số nguyên ns: mốc bin neo theo đầu phiên (09:00 sáng, 13:00 chiều),
+  nên nến không vắt qua giờ nghỉ trưa và khung bất kỳ (45m...) vẫn thẳng hàng với phiên.
+- Tick trong giờ nghỉ trưa [11:30, 13:00) (khớp đúng 11:30:00, thoả thuận...) gộp vào nến cuối phiên sáng;
+  tick từ 14:45 (ATC) gộp vào nến cuối phiên chiều; tick trước 09:00 vào nến đầu phiên sáng.
+- Sort ổn định (symbol, thời gian) rồi np.*.reduceat trên ranh giới nhóm -> OHLCV.
+
+Benchmark (dữ liệu tick giả lập, 120 mã):  python -m modules.utils.tick_resample --symbols 120
+"""
+import argparse
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+_NS_MIN = 60 * 1_000_000_000
+_NS_DAY = 24 * 60 * _NS_MIN
+
+# Giờ giao dịch HOSE/HNX (phút tính từ 00:00)
+AM_OPEN = 9 * 60
+AM_CLOSE = 11 * 60 + 30
+PM_OPEN = 13 * 60
+PM_CLOSE = 14 * 60 + 45
+
+OHLCV = ["open", "high", "low", "close", "volume"]
+
+
+def interval_minutes(interval: str) -> int:
+    """'1m' / '5m' / '15min' / '1h' -> số phút (mặc định 5)."""
+    iv = (interval or "").strip().lower()
+    try:
+        if iv.endswith("min"):
+            return max(1, int(iv[:-3]))
+        if iv.endswith("m"):
+            return max(1, int(iv[:-1]))
+        if iv.endswith("h"):
+            return max(1, int(iv[:-1]) * 60)
+    except ValueError:
+        pass
+    return 5
+
+
+def session_bins(t_ns: np.ndarray, minutes: int) -> np.ndarray:
+    """Thời điểm bắt đầu nến (int64 ns) cho từng tick, neo theo đầu phiên, có xử lý nghỉ trưa."""
+    step = np.int64(minutes) * _NS_MIN
+    day = (t_ns // _NS_DAY) * _NS_DAY
+    tod = t_ns - day
+
+    am_open, am_close = np.int64(AM_OPEN * _NS_MIN), np.int64(AM_CLOSE * _NS_MIN)
+    pm_open, pm_close = np.int64(PM_OPEN * _NS_MIN), np.int64(PM_CLOSE * _NS_MIN)
+
+    # Kẹp tick ngoài giờ về nến biên của phiên tương ứng (-1ns để rơi vào nến cuối)
+    tod = np.where(tod < am_open, am_open, tod)
+    tod = np.where((tod >= am_close) & (tod < pm_open), am_close - 1, tod)
+    tod = np.where(tod >= pm_close, pm_close - 1, tod)
+
+    anchor = np.where(tod < pm_open, am_open, pm_open)
+    return day + anchor + ((tod - anchor) // step) * step
+
+
+def resample_ticks_multi(ticks: pd.DataFrame, interval: str = "5m") -> pd.DataFrame:
+    """
+    ticks: DataFrame cột symbol, time, price, volume (time có thể nằm ở index).
+    Trả DataFrame long: symbol, time (đầu nến), open, high, low, close, volume
+    (sắp theo symbol rồi time; nến không có tick thì không xuất hiện).
+    """
+    if ticks is None or ticks.empty:
+        return pd.DataFrame(columns=["symbol", "time"] + OHLCV)
+
+    times = ticks["time"] if "time" in ticks.columns else ticks.index
+    t_ns = pd.DatetimeIndex(times).as_unit("ns").asi8
+    price = pd.to_numeric(ticks["price"], errors="coerce").to_numpy("float64")
+    volume = pd.to_numeric(ticks["volume"], errors="coerce").fillna(0.0).to_numpy("float64")
+    sym_codes, sym_names = pd.factorize(ticks["symbol"], sort=True)
+
+    ok = ~np.isnan(price) & (t_ns != np.iinfo(np.int64).min)
+    if not ok.all():
+        t_ns, price, volume, sym_codes = t_ns[ok], price[ok], volume[ok], sym_codes[ok]
+    if t_ns.size == 0:
+        return pd.DataFrame(columns=["symbol", "time"] + OHLCV)
+
+    bins = session_bins(t_ns, interval_minutes(interval))
+
+    # Sort ổn định theo (symbol, thời gian tick): giữ thứ tự gốc của tick cùng timestamp.
+    # Dữ liệu ghép từ bộ đệm từng mã thường đã đúng thứ tự -> bỏ qua sort.
+    ds = np.diff(sym_codes)
+    if (ds >= 0).all() and ((ds > 0) | (np.diff(t_ns) >= 0)).all():
+        sym_s, bin_s, price_s, vol_s = sym_codes, bins, price, volume
+    else:
+        order = np.lexsort((t_ns, sym_codes))
+        sym_s, bin_s = sym_codes[order], bins[order]
+        price_s, vol_s = price[order], volume[order]
+
+    change = np.empty(sym_s.size, dtype=bool)
+    change[0] = True
+    np.not_equal(sym_s[1:], sym_s[:-1], out=change[1:])
+    change[1:] |= bin_s[1:] != bin_s[:-1]
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], sym_s.size) - 1
+
+    out = pd.DataFrame({
+        "symbol": np.asarray(sym_names)[sym_s[starts]],
+        "time": pd.to_datetime(bin_s[starts]),
+        "open": price_s[starts],
+        "high": np.maximum.reduceat(price_s, starts),
+        "low": np.minimum.reduceat(price_s, starts),
+        "close": price_s[ends],
+        "volume": np.add.reduceat(vol_s, starts),
+    })
+    return out
+
+
+def resample_ticks(ticks: pd.DataFrame, interval: str = "5m") -> pd.DataFrame:
+    """1 mã: ticks index thời gian + cột price/volume -> OHLCV index theo đầu nến."""
+    if ticks is None or ticks.empty:
+        return pd.DataFrame(columns=OHLCV)
+    long = resample_ticks_multi(
+        pd.DataFrame({
+            "symbol": 0,
+            "time": ticks.index,
+            "price": ticks["price"].to_numpy(),
+            "volume": ticks["volume"].to_numpy(),
+        }),
+        interval=interval,
+    )
+    return long.set_index("time")[OHLCV].rename_axis(None)
+
+
+def split_by_symbol(bars: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Kết quả long của resample_ticks_multi -> {symbol: OHLCV index theo thời gian}."""
+    if bars is None or bars.empty:
+        return {}
+    codes = bars["symbol"].to_numpy()
+    cut = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    out = {}
+    for lo, hi in zip(np.r_[0, cut], np.r_[cut, len(bars)]):
+        part = bars.iloc[lo:hi]
+        out[str(codes[lo])] = part.set_index("time")[OHLCV].rename_axis(None)
+    return out
+
+
+# ====== Benchmark ======
+def synthetic_ticks(n_symbols: int = 120, ticks_per_symbol: int = 4000,
+                    day: str = "2025-01-06", seed: int = 0) -> pd.DataFrame:
+    """Tick giả lập trong 2 phiên (kèm vài tick 11:30:00 / 14:45:00 như dữ liệu thật)."""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp(day).value
+    am = rng.integers(AM_OPEN * _NS_MIN, AM_CLOSE * _NS_MIN, size=(n_symbols, ticks_per_symbol // 2))
+    pm = rng.integers(PM_OPEN * _NS_MIN, PM_CLOSE * _NS_MIN, size=(n_symbols, ticks_per_symbol - ticks_per_symbol // 2))
+    tod = np.concatenate([am, pm, np.full((n_symbols, 1), AM_CLOSE * _NS_MIN),
+                          np.full((n_symbols, 1), PM_CLOSE * _NS_MIN)], axis=1)
+    tod.sort(axis=1)
+    n = tod.shape[1]
+    start_px = rng.uniform(10_000, 100_000, size=(n_symbols, 1))
+    px = start_px * np.exp(np.cumsum(rng.normal(0, 0.0008, size=(n_symbols, n)), axis=1))
+    return pd.DataFrame({
+        "symbol": np.repeat([f"S{i:03d}" for i in range(n_symbols)], n),
+        "time": pd.to_datetime(base + tod.ravel()),
+        "price": np.round(px.ravel(), -1),
+        "volume": rng.integers(1, 50, size=n_symbols * n) * 100.0,
+    })
+
+
+def _pandas_per_symbol(ticks: pd.DataFrame, interval: str) -> Dict[str, pd.DataFrame]:
+    """Đường cũ: mỗi mã 1 lần resample pandas (không xử lý nghỉ trưa)."""
+    rule = f"{interval_minutes(interval)}min"
+    out = {}
+    for sym, g in ticks.groupby("symbol", sort=True):
+        s = g.set_index("time")
+        ohlc = s["price"].resample(rule).ohlc()
+        vol = s["volume"].resample(rule).sum(min_count=1)
+        out[sym] = pd.concat([ohlc, vol.rename("volume")], axis=1).dropna(subset=["close"])
+    return out
+
+
+def benchmark(n_symbols: int = 120, ticks_per_symbol: int = 4000,
+              intervals=("1m", "5m", "15m"), runs: int = 5, seed: Optional[int] = 0):
+    ticks = synthetic_ticks(n_symbols, ticks_per_symbol, seed=seed)
+    print(f"[TickResample] {n_symbols} mã x {ticks_per_symbol} tick = {len(ticks):,} dòng")
+    rows = []
+    for iv in intervals:
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            vec = resample_ticks_multi(ticks, iv)
+        vec_ms = (time.perf_counter() - t0) * 1000 / runs
+
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            ref = _pandas_per_symbol(ticks, iv)
+        pd_ms = (time.perf_counter() - t0) * 1000 / runs
+
+        # Đối chiếu trên các nến trong giờ giao dịch (đường cũ tách riêng nến 11:30 / 14:45)
+        by_sym = split_by_symbol(vec)
+        sym0 = sorted(ref)[0]
+        a = by_sym[sym0]
+        b = ref[sym0].loc[a.index.intersection(ref[sym0].index)]
+        inner = b.index[(b.index.hour * 60 + b.index.minute + interval_minutes(iv)) < AM_CLOSE]
+        match = np.allclose(a.loc[inner, OHLCV].to_numpy(), b.loc[inner, OHLCV].to_numpy())
+
+        row = {
+            "interval": iv,
+            "bars": len(vec),
+            "vectorized_ms": round(vec_ms, 2),
+            "pandas_per_symbol_ms": round(pd_ms, 2),
+            "speedup": round(pd_ms / max(vec_ms, 1e-9), 1),
+            "lunch_bars_vectorized": int(((vec["time"].dt.hour * 60 + vec["time"].dt.minute) == AM_CLOSE).sum()),
+            "lunch_bars_pandas": int(sum(((d.index.hour * 60 + d.index.minute) == AM_CLOSE).sum() for d in ref.values())),
+            "match_inner_bars": bool(match),
+        }
+        rows.append(row)
+        print(row)
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark resample tick -> OHLCV nhiều mã")
+    ap.add_argument("--symbols", type=int, default=120)
+    ap.add_argument("--ticks", type=int, default=4000, help="số tick / mã")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+    benchmark(args.symbols, args.ticks, runs=args.runs)
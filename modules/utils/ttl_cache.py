@@ -0,0 +1,321 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+# Pool nhỏ cho refresh nền (stale-while-revalidate)
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ttl-refresh")
+
+# Tầng L2 Redis dùng chung giữa các process (Streamlit workers, ingestion...) – bật bằng env
+TTL_CACHE_L2 = os.getenv("TTL_CACHE_L2", "0") == "1"
+# v2: frame_codec bỏ pickle -> key cũ (payload pickle) bị bỏ qua, tự hết hạn
+TTL_CACHE_L2_PREFIX = "ttl::v2::"
+# Redis lỗi -> tắt L2 trong khoảng này để không cộng thêm latency cho mỗi lần miss
+_L2_COOLDOWN_SEC = 30.0
+
+_MISSING = object()
+
+
+class _Flight:
+    """1 lần gọi upstream đang chạy cho 1 key; các thread khác chờ kết quả này (single-flight)."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class TTLStore:
+    """
+    Bộ nhớ cache cho 1 hàm:
+    - OrderedDict LRU, giới hạn max_size (vượt -> bỏ key ít dùng nhất).
+    - Entry hết hạn sau ttl; trong khoảng [ttl, ttl + stale_ttl] vẫn trả giá trị cũ
+      và refresh nền 1 lần (stale-while-revalidate).
+    - Dọn entry hết hạn định kỳ, không đợi đúng key đó được đọc lại.
+    - ttl_for(value) -> ttl riêng cho từng kết quả (<= 0: không cache, vd. kết quả lỗi);
+      kết quả có ttl khác ttl mặc định không ghi lên L2.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_size: int = 1024,
+                 stale_ttl_seconds: float = 0.0, sweep_every: int = 256, shared: bool = False,
+                 ttl_for: Optional[Callable[[Any], float]] = None):
+        self.name = name
+        self.shared = bool(shared) and TTL_CACHE_L2
+        self._l2_down_until = 0.0
+        self.ttl = float(ttl_seconds)
+        self.stale_ttl = float(stale_ttl_seconds)
+        self.max_size = int(max_size)
+        self.sweep_every = int(sweep_every)
+        self.ttl_for = ttl_for
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()   # key -> (value, ts, ttl)
+        self._flights: Dict[Any, _Flight] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {
+            "hits": 0, "misses": 0, "stale_hits": 0, "evictions": 0, "expirations": 0,
+            "coalesced": 0, "refreshes": 0, "refresh_errors": 0, "errors": 0,
+            "l2_hits": 0, "l2_misses": 0, "l2_errors": 0,
+        }
+
+    # ====== nội bộ (gọi khi đã giữ lock) ======
+    def _sweep_locked(self, now: float):
+        dead = [k for k, (_, ts, ttl) in self._data.items() if now - ts >= ttl + self.stale_ttl]
+        for k in dead:
+            del self._data[k]
+        self._stats["expirations"] += len(dead)
+
+    def _put_locked(self, key, value, now: float, ttl: Optional[float] = None):
+        self._data[key] = (value, now, self.ttl if ttl is None else ttl)
+        self._data.move_to_end(key)
+        self._writes += 1
+        if self._writes % self.sweep_every == 0:
+            self._sweep_locked(now)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # ====== Tầng L2 (Redis, nhị phân) ======
+    def _l2_client(self):
+        if not self.shared or time.time() < self._l2_down_until:
+            return None
+        from modules.utils.services import redis_services
+        return redis_services.binary_client
+
+    def _l2_fail(self):
+        self._l2_down_until = time.time() + _L2_COOLDOWN_SEC
+        with self._lock:
+            self._stats["l2_errors"] += 1
+
+    def _l2_get(self, l2_key: str):
+        """Trả (value, ts gốc) hoặc (_MISSING, None). Giữ ts gốc để tuổi entry không bị 'trẻ lại'."""
+        try:
+            client = self._l2_client()
+            if client is None:
+                return _MISSING, None
+            raw = client.get(l2_key)
+        except Exception:
+            self._l2_fail()
+            return _MISSING, None
+        if not raw:
+            with self._lock:
+                self._stats["l2_misses"] += 1
+            return _MISSING, None
+        try:
+            from modules.utils.frame_codec import loads
+
+            (ts,) = struct.unpack(">d", raw[:8])
+            value = loads(raw[8:])
+        except Exception:
+            self._l2_fail()
+            return _MISSING, None
+        with self._lock:
+            self._stats["l2_hits"] += 1
+        return value, ts
+
+    def _l2_set(self, l2_key: str, value, ts: float):
+        try:
+            client = self._l2_client()
+            if client is None:
+                return
+            from modules.utils.frame_codec import dumps
+
+            ex = max(1, int(self.ttl + self.stale_ttl))
+            client.set(l2_key, struct.pack(">d", ts) + dumps(value), ex=ex)
+        except TypeError:
+            # Giá trị không mã hoá được (frame_codec không dùng pickle) -> chỉ cache L1
+            return
+        except Exception:
+            self._l2_fail()
+
+    # ====== API ======
+    def lookup(self, key):
+        """Trả (value | _MISSING, trạng thái: 'fresh' | 'stale' | 'miss')."""
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING, "miss"
+            value, ts, ttl = item
+            age = now - ts
+            if age < ttl:
+                self._data.move_to_end(key)
+                self._stats["hits"] += 1
+                return value, "fresh"
+            if age < ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self._stats["stale_hits"] += 1
+                return value, "stale"
+            del self._data[key]
+            self._stats["expirations"] += 1
+            return _MISSING, "miss"
+
+    def load(self, key, loader: Callable[[], Any], l2_key: Optional[str] = None):
+        """
+        Single-flight: chỉ 1 thread gọi loader cho mỗi key, các thread khác chờ chung kết quả.
+        Có L2: thử Redis trước khi gọi upstream, gọi xong thì ghi lại Redis.
+        """
+        with self._lock:
+            # Leader trước có thể vừa ghi xong và gỡ flight giữa lookup() và lúc này
+            # -> dùng luôn entry tươi thay vì mở lượt tải mới
+            item = self._data.get(key)
+            if item is not None and time.time() - item[1] < item[2]:
+                self._data.move_to_end(key)
+                self._stats["hits"] += 1
+                return item[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        return self._fill(key, flight, loader, l2_key)
+
+    def _fill(self, key, flight: _Flight, loader: Callable[[], Any], l2_key: Optional[str]):
+        """Leader của flight (đã đăng ký trong _flights): lấy giá trị, ghi cache, đánh thức thread chờ."""
+        try:
+            value, ts, ttl = _MISSING, None, self.ttl
+            if l2_key:
+                value, ts = self._l2_get(l2_key)
+                # Bản L2 đã hết hạn tươi (chỉ còn stale) -> coi như miss, lấy upstream
+                if value is not _MISSING and time.time() - ts >= self.ttl:
+                    value = _MISSING
+            if value is _MISSING:
+                value = loader()
+                ts = time.time()
+                if self.ttl_for is not None:
+                    ttl = float(self.ttl_for(value))
+                if l2_key and ttl == self.ttl:
+                    self._l2_set(l2_key, value, ts)
+            flight.value = value
+            if ttl > 0:
+                with self._lock:
+                    self._put_locked(key, value, ts, ttl)
+            return value
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def refresh_async(self, key, loader: Callable[[], Any], l2_key: Optional[str] = None):
+        """
+        Refresh nền cho entry stale (bỏ qua nếu key đang có lượt tải khác).
+        Flight đăng ký ngay khi submit -> request stale khác và miss sau đó (entry vừa hết stale)
+        chờ chung lượt tải này thay vì gọi upstream lần nữa.
+        """
+        with self._lock:
+            if key in self._flights:
+                return
+            flight = _Flight()
+            self._flights[key] = flight
+            self._stats["refreshes"] += 1
+
+        def _run():
+            try:
+                self._fill(key, flight, loader, l2_key)
+            except Exception:
+                with self._lock:
+                    self._stats["refresh_errors"] += 1
+
+        try:
+            _refresh_pool.submit(_run)
+        except RuntimeError:
+            # Pool đã shutdown (process đang thoát) -> gỡ flight để không treo thread chờ
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.error = RuntimeError("refresh pool đã dừng")
+            flight.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._data)
+        s["max_size"] = self.max_size
+        s["shared"] = self.shared
+        total = s["hits"] + s["stale_hits"] + s["misses"] + s["coalesced"]
+        s["hit_rate"] = round((s["hits"] + s["stale_hits"]) / total, 4) if total else 0.0
+        return s
+
+
+_registry: Dict[str, TTLStore] = {}
+
+
+def ttl_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Counter hit/miss/eviction... của mọi hàm dùng @TTLCache (để monitor)."""
+    return {name: store.stats() for name, store in _registry.items()}
+
+
+def _l2_key(name: str, args: tuple, kwargs: dict) -> str:
+    # repr ổn định giữa các process (không dùng frozenset: thứ tự phụ thuộc hash seed)
+    raw = repr((args, sorted(kwargs.items())))
+    return f"{TTL_CACHE_L2_PREFIX}{name}::{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def TTLCache(ttl_seconds: int = 300, verbose: bool = False, max_size: int = 1024,
+             stale_ttl_seconds: float = 0.0, shared: bool = False,
+             ttl_for: Optional[Callable[[Any], float]] = None):
+    """
+    Decorator cache theo tham số hàm: bounded LRU + thread-safe + single-flight,
+    tuỳ chọn stale-while-revalidate (stale_ttl_seconds > 0).
+    shared=True: thêm tầng L2 Redis dùng chung giữa các process (chỉ khi env TTL_CACHE_L2=1).
+    ttl_for(kết quả) -> ttl riêng cho kết quả đó (<= 0: không cache, vd. fallback khi upstream lỗi).
+    Exception không được cache. Tham số không hash được -> gọi thẳng hàm (không cache).
+    """
+
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+        store = TTLStore(name, ttl_seconds, max_size=max_size,
+                         stale_ttl_seconds=stale_ttl_seconds, shared=shared, ttl_for=ttl_for)
+        _registry[name] = store
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, frozenset(kwargs.items()))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
+            l2_key = _l2_key(name, args, kwargs) if store.shared else None
+            value, status = store.lookup(key)
+            if status == "fresh":
+                if verbose:
+                    print(f"[Cache Hit] {func.__name__}")
+                return value
+            if status == "stale":
+                if verbose:
+                    print(f"[Cache Stale] {func.__name__} -> refresh nền")
+                store.refresh_async(key, lambda: func(*args, **kwargs), l2_key=l2_key)
+                return value
+
+            if verbose:
+                print(f"[Cache Miss] {func.__name__}")
+            return store.load(key, lambda: func(*args, **kwargs), l2_key=l2_key)
+
+        wrapper.cache = store
+        wrapper.cache_stats = store.stats
+        wrapper.cache_clear = store.clear
+        return wrapper
+
+    return decorator
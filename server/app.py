@@ -0,0 +1,140 @@
+"""
+HTTP service cho chatbot: POST /chat, GET /health.
+- mode "async" (mặc định): graph.ainvoke trên 1 event loop nền dùng chung cho cả process;
+  node I/O chờ vLLM bằng astream, node sync chạy trong pool giới hạn (GRAPH_NODE_WORKERS).
+- mode "sync": graph.invoke trong pool cùng kích thước (đường cũ, dùng để so sánh khi load test).
+Chạy: python -m server.app  (hoặc python main.py api; WSGI: "server.app:create_app()")
+Khởi tạo (warmup service, build graph, event loop) nằm trong create_app(), không chạy lúc import:
+process con của multiprocessing (forkserver / spawn) import lại module này dưới tên __mp_main__.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify, request
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from modules.core.async_nodes import GRAPH_NODE_WORKERS
+from modules.api.stock_api import price_board
+from modules.core.graph import build_graph
+from modules.core.state import GlobalState
+from modules.ML.registry import model_cache_stats, warmup_models
+from modules.utils.services import registry
+from modules.utils.source_health import source_health_stats
+from modules.utils.ttl_cache import ttl_cache_stats
+
+CHAT_SERVICES = ("redis", "qdrant", "embedder", "reranker", "llm")
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", 120))
+# Số hội thoại chạy đồng thời tối đa trên event loop (phần còn lại xếp hàng)
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 256))
+
+app = Flask(__name__)
+
+graph = None
+_loop: asyncio.AbstractEventLoop = None
+_slots: asyncio.Semaphore = None
+_sync_pool: ThreadPoolExecutor = None
+
+
+def create_app() -> Flask:
+    """Warmup service + build graph + event loop nền cho graph.ainvoke (gọi 1 lần / process)."""
+    global graph, _loop, _slots, _sync_pool
+    if graph is not None:
+        return app
+
+    t0 = time.perf_counter()
+    readiness = registry.warmup(*CHAT_SERVICES)
+    graph = build_graph()
+    print(f"[ChatAPI] Cold start: {time.perf_counter() - t0:.3f}s | {readiness}")
+    # Nạp sẵn model gap của các mã hay được hỏi (thread nền)
+    warmup_models()
+
+    # ====== Event loop nền cho graph.ainvoke ======
+    _loop = asyncio.new_event_loop()
+    threading.Thread(target=_loop.run_forever, name="chat-event-loop", daemon=True).start()
+    _slots = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+    _sync_pool = ThreadPoolExecutor(max_workers=GRAPH_NODE_WORKERS, thread_name_prefix="chat-sync")
+    return app
+
+
+async def _ainvoke(state: GlobalState):
+    async with _slots:
+        return await graph.ainvoke(state)
+
+
+def _run_graph(state: GlobalState, mode: str) -> dict:
+    if mode == "sync":
+        return _sync_pool.submit(graph.invoke, state).result(timeout=CHAT_TIMEOUT)
+    fut = asyncio.run_coroutine_threadsafe(_ainvoke(state), _loop)
+    return fut.result(timeout=CHAT_TIMEOUT)
+
+
+def _sources(final: dict) -> list:
+    return [
+        {
+            "title": d.get("title", ""),
+            "url": d.get("url", ""),
+            "time": d.get("time", ""),
+            "score": d.get("score"),
+        }
+        for d in (final.get("retrieved_docs") or [])
+    ]
+
+
+@app.post("/chat")
+def chat():
+    body = request.get_json(silent=True) or {}
+    message = (body.get("message") or "").strip()
+    if not message:
+        return jsonify({"error": "Thiếu `message`"}), 400
+
+    mode = body.get("mode") or "async"
+    if mode not in ("async", "sync"):
+        return jsonify({"error": "`mode` phải là 'async' hoặc 'sync'"}), 400
+
+    session_id = body.get("session_id") or str(uuid.uuid4())
+    state = GlobalState(user_query=message, session_id=session_id, messages=[])
+
+    started = time.perf_counter()
+    try:
+        final = _run_graph(state, mode)
+    except Exception as e:
+        print(f"[ChatAPI] Lỗi xử lý ({mode}): {e}")
+        return jsonify({"error": str(e), "session_id": session_id}), 500
+
+    debug = final.get("debug_info") or {}
+    return jsonify({
+        "session_id": session_id,
+        "answer": final.get("final_answer") or "",
+        "sources": _sources(final),
+        "intent": final.get("intent"),
+        "route": final.get("route_to"),
+        "mode": mode,
+        "latency_sec": round(time.perf_counter() - started, 3),
+        "llm_ttft_sec": debug.get("llm_ttft_sec"),
+        "answer_cache": debug.get("answer_cache"),
+    })
+
+
+@app.get("/health")
+def health():
+    return jsonify({
+        "services": registry.readiness(*CHAT_SERVICES),
+        "caches": ttl_cache_stats(),
+        "sources": source_health_stats(),
+        "price_board": price_board.stats(),
+        "models": model_cache_stats(),
+    })
+
+
+if __name__ == "__main__":
+    create_app().run(
+        host=os.getenv("CHAT_API_HOST", "0.0.0.0"),
+        port=int(os.getenv("CHAT_API_PORT", 8080)),
+        threaded=True,
+    )
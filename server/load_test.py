@@ -0,0 +1,125 @@
+"""
+Load test cho POST /chat: so sánh đường async (graph.ainvoke) và sync (graph.invoke).
+Với mỗi mode, tăng dần số client đồng thời; báo RPS, p50, p95 và mức RPS cao nhất
+mà vẫn giữ p95 <= --p95-ms.
+
+    python -m server.load_test --url http://localhost:8080/chat --concurrency 1,4,8,16,32 --duration 30
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.request
+import uuid
+from typing import Dict, List
+
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "Tin tức đáng chú ý về VNINDEX",
+    "Có nên mua HPG không?",
+    "Phân tích xu hướng thị trường tuần này",
+    "Tin tức ngân hàng mới nhất",
+    "Giá cổ phiếu FPT hôm nay thế nào?",
+]
+
+
+def _post(url: str, payload: Dict, timeout: float) -> Dict:
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def run_level(url: str, mode: str, concurrency: int, duration: float, queries: List[str],
+              timeout: float, cache_busting: bool) -> Dict:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session_id = f"load-{mode}-{uuid.uuid4()}"
+        while time.perf_counter() < deadline:
+            n = next(counter)
+            q = queries[n % len(queries)]
+            if cache_busting:
+                # Tránh answer cache trả lời thay -> đo đúng đường retrieval + LLM
+                q = f"{q} {n}"
+            t0 = time.perf_counter()
+            try:
+                _post(url, {"message": q, "session_id": session_id, "mode": mode}, timeout)
+                dt = time.perf_counter() - t0
+                with lock:
+                    latencies.append(dt)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    lat = np.asarray(latencies) * 1000.0
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "ok": int(lat.size),
+        "errors": errors[0],
+        "rps": round(lat.size / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(float(np.percentile(lat, 50)), 1) if lat.size else None,
+        "p95_ms": round(float(np.percentile(lat, 95)), 1) if lat.size else None,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test /chat (async vs sync)")
+    ap.add_argument("--url", default="http://localhost:8080/chat")
+    ap.add_argument("--modes", default="sync,async")
+    ap.add_argument("--concurrency", default="1,2,4,8,16,32")
+    ap.add_argument("--duration", type=float, default=30.0, help="giây / mức concurrency")
+    ap.add_argument("--p95-ms", type=float, default=8000.0, help="ngưỡng p95 để so sánh RPS")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--queries", default=None, help="file JSON list câu hỏi")
+    ap.add_argument("--no-cache-busting", action="store_true")
+    args = ap.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        for c in levels:
+            r = run_level(args.url, mode, c, args.duration, queries, args.timeout,
+                          cache_busting=not args.no_cache_busting)
+            results.append(r)
+            print(f"{r['mode']:5s} c={r['concurrency']:3d} rps={r['rps']:7.2f} "
+                  f"p50={r['p50_ms']}ms p95={r['p95_ms']}ms ok={r['ok']} err={r['errors']}")
+
+    print(f"\n=== RPS cao nhất với p95 <= {args.p95_ms:.0f}ms ===")
+    best = {}
+    for r in results:
+        if r["p95_ms"] is not None and r["p95_ms"] <= args.p95_ms and r["errors"] == 0:
+            if r["rps"] > best.get(r["mode"], {}).get("rps", -1):
+                best[r["mode"]] = r
+    for mode, r in best.items():
+        print(f"{mode:5s}: {r['rps']} req/s (c={r['concurrency']}, p95={r['p95_ms']}ms)")
+    if "sync" in best and "async" in best and best["sync"]["rps"] > 0:
+        print(f"async / sync = {best['async']['rps'] / best['sync']['rps']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import numpy as np
+
+from modules.utils.bm25_stats import BM25Stats
+
+
+def test_update_counts_docs_and_keeps_term_ids():
+    st = BM25Stats(path="unused")
+    assert st.update(["a b b", "b c"]) == 2
+    ids = dict(st.vocab)
+    assert st.n_docs == 2 and st.total_len == 5
+    assert st.df[ids["b"]] == 2 and st.df[ids["a"]] == 1
+
+    st.update(["c d"])
+    # vocab append-only: term id cũ không đổi
+    assert all(st.vocab[t] == i for t, i in ids.items())
+    assert st.df[st.vocab["c"]] == 2 and st.df[st.vocab["d"]] == 1
+
+
+def test_save_load_roundtrip(tmp_path):
+    st = BM25Stats(path=str(tmp_path))
+    st.update(["x y", "y z z"])
+    st.save()
+
+    loaded = BM25Stats(path=str(tmp_path)).load()
+    assert loaded.vocab == st.vocab
+    assert np.array_equal(np.asarray(loaded.df), st.df)
+    assert (loaded.n_docs, loaded.total_len, loaded.version) == (2, 5, 1)
+    assert loaded.encode("y z") == st.encode("y z")
+
+    # df đang là memmap read-only -> update vẫn cộng được
+    loaded.update(["z"])
+    assert loaded.df[loaded.vocab["z"]] == 2
+
+
+def test_snapshot_restore_undoes_update():
+    st = BM25Stats(path="unused")
+    st.update(["a b"])
+    snap = st.snapshot()
+    st.update(["b c", "c d"])
+    st.restore(snap)
+
+    assert (st.n_docs, st.total_len) == (1, 2)
+    assert st.df[st.vocab["b"]] == 1
+    # term mới vẫn giữ id nhưng df = 0
+    assert st.df[st.vocab["c"]] == 0 and st.df[st.vocab["d"]] == 0
@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from modules.utils import fanout
+from modules.utils.fanout import fan_out
+
+
+def test_partial_results_on_deadline():
+    release = threading.Event()
+    results, info = fan_out(
+        {
+            "fast": lambda: 1,
+            "slow": lambda: release.wait(5),
+            "boom": lambda: 1 / 0,
+        },
+        timeout=0.2,
+    )
+    release.set()
+    assert results == {"fast": 1}
+    assert info["fast"]["status"] == "ok"
+    assert info["slow"]["status"] == "timeout"
+    assert info["slow"]["sec"] < 1.0
+    assert info["boom"]["status"] == "error"
+
+
+def test_per_call_deadline_shorter_than_group():
+    release = threading.Event()
+    t0 = time.perf_counter()
+    _, info = fan_out({"slow": lambda: release.wait(5), "ok": lambda: "x"},
+                      timeout=2.0, per_call={"slow": 0.1})
+    release.set()
+    assert info["slow"]["status"] == "timeout"
+    assert time.perf_counter() - t0 < 1.0
+
+
+@pytest.fixture
+def tiny_pools(monkeypatch):
+    outer = ThreadPoolExecutor(max_workers=1)
+    nested = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(fanout, "_fanout_pool", outer)
+    monkeypatch.setattr(fanout, "_nested_pool", nested)
+    yield
+    outer.shutdown(wait=False)
+    nested.shutdown(wait=False)
+
+
+def test_nested_fan_out_does_not_deadlock(tiny_pools):
+    def inner():
+        res, _ = fan_out({"a": lambda: 1, "b": lambda: 2}, timeout=1.0)
+        deeper, _ = fan_out({"c": lambda: fan_out({"d": lambda: 4}, timeout=1.0)[0]}, timeout=1.0)
+        return sum(res.values()) + deeper["c"]["d"]
+
+    results, info = fan_out({"outer": inner}, timeout=2.0)
+    assert info["outer"]["status"] == "ok"
+    assert results["outer"] == 7
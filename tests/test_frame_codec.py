@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from modules.utils.frame_codec import dumps, loads
+
+
+def test_dataframe_roundtrip_keeps_index_freq_and_dtypes():
+    idx = pd.date_range("2025-01-01", periods=5, freq="D", name="time")
+    df = pd.DataFrame({"close": np.arange(5, dtype="float64"), "volume": np.arange(5)}, index=idx)
+    out = loads(dumps(df))
+    pd.testing.assert_frame_equal(out, df)
+    assert out.index.freqstr == "D"
+
+
+def test_series_roundtrip_keeps_name():
+    s = pd.Series([1.5, 2.5], index=pd.to_datetime(["2025-01-02", "2025-01-03"]), name="FPT")
+    out = loads(dumps(s))
+    pd.testing.assert_series_equal(out, s)
+
+
+def test_tuple_and_json_values():
+    df = pd.DataFrame({"ticker": ["FPT", "VCB"], "growth": [1.0, -2.0]})
+    out_df, col = loads(dumps((df, "growth")))
+    pd.testing.assert_frame_equal(out_df, df)
+    assert col == "growth"
+
+    detail = {"ticker": "VNINDEX", "price": np.float64(1250.5), "volume": np.int64(10), "tags": ["a"]}
+    assert loads(dumps(detail)) == {"ticker": "VNINDEX", "price": 1250.5, "volume": 10, "tags": ["a"]}
+    assert loads(dumps(["VNINDEX", "VN30"])) == ["VNINDEX", "VN30"]
+
+
+def test_rejects_arbitrary_objects_and_unknown_tags():
+    with pytest.raises(TypeError):
+        dumps({"obj": object()})
+    # payload pickle (tag cũ) không bao giờ được giải mã
+    with pytest.raises(ValueError):
+        loads(b"K\x80\x04N.")
@@ -0,0 +1,27 @@
+import math
+
+import numpy as np
+
+from modules.ML.metrics import directional_accuracy, mae, rmse, summarize
+
+
+def test_summarize_matches_individual_metrics():
+    y = [0.01, -0.02, 0.03, -0.01]
+    p = [0.02, -0.01, -0.01, -0.02]
+    out = summarize(y, p)
+    assert out["n"] == 4
+    assert math.isclose(out["rmse"], rmse(y, p))
+    assert math.isclose(out["mae"], mae(y, p))
+    assert out["direction_acc"] == directional_accuracy(y, p) == 0.75
+
+
+def test_summarize_skips_nan_pairs():
+    out = summarize([0.01, np.nan, -0.02, 0.03], [0.02, 0.01, np.nan, 0.01])
+    assert out["n"] == 2
+    assert math.isclose(out["mae"], 0.015)
+    assert out["direction_acc"] == 1.0
+
+
+def test_summarize_empty():
+    out = summarize([np.nan], [0.1])
+    assert out["n"] == 0 and math.isnan(out["rmse"]) and math.isnan(out["direction_acc"])
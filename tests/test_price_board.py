@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from modules.utils import price_board, services
+from modules.utils.price_board import PRICE_BOARD_SUBS_KEY, PriceBoardPoller
+
+
+class _FakeRedis:
+    """Tối thiểu cho snapshot pb::<SYM> (get / set) và sorted set pb::subs, có pipeline."""
+
+    def __init__(self):
+        self.kv = {}
+        self.zsets = {}
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def set(self, key, value, ex=None):
+        self.kv[key] = value
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zremrangebyscore(self, key, lo, hi):
+        z = self.zsets.get(key, {})
+        for m in [m for m, sc in z.items() if sc <= float(hi)]:
+            del z[m]
+
+    def zrevrangebyscore(self, key, hi, lo, start=0, num=None):
+        items = sorted(((sc, m) for m, sc in self.zsets.get(key, {}).items() if sc >= float(lo)), reverse=True)
+        return [m for _, m in items][start:None if num is None else start + num]
+
+    def pipeline(self, transaction=False):
+        client, ops = self, []
+
+        class _Pipe:
+            def __getattr__(self, name):
+                return lambda *a, **kw: ops.append((name, a, kw))
+
+            def execute(self):
+                return [getattr(client, name)(*a, **kw) for name, a, kw in ops]
+
+        return _Pipe()
+
+
+class _Services:
+    def __init__(self, client):
+        self.client = client
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = _FakeRedis()
+    monkeypatch.setattr(services, "redis_services", _Services(client))
+    return client
+
+
+def test_subscription_from_reader_reaches_poller(fake_redis):
+    polled = []
+
+    def fetch(symbols):
+        polled.append(list(symbols))
+        return {s: {"price": 1.0} for s in symbols}
+
+    reader = PriceBoardPoller(fetch, lambda: [], autostart=False)
+    poller = PriceBoardPoller(fetch, lambda: [], autostart=True)
+    poller._watchlist = ["FPT"]
+
+    assert reader.get("hpg") is None
+    assert "HPG" in fake_redis.zsets[PRICE_BOARD_SUBS_KEY]
+
+    assert poller.poll_once() == 2
+    assert polled[-1] == ["FPT", "HPG"]
+    row, _ = reader.get("HPG")
+    assert row == {"price": 1.0}
+
+
+def test_expired_subscriptions_are_dropped(fake_redis, monkeypatch):
+    monkeypatch.setattr(price_board, "PRICE_BOARD_SUB_TTL", 60.0)
+    fake_redis.zadd(PRICE_BOARD_SUBS_KEY, {"OLD": time.time() - 120, "NEW": time.time()})
+    poller = PriceBoardPoller(lambda s: {}, lambda: [], autostart=True)
+
+    assert poller._symbols() == ["NEW"]
+    assert "OLD" not in fake_redis.zsets[PRICE_BOARD_SUBS_KEY]
@@ -0,0 +1,94 @@
+import json
+import multiprocessing as mp
+import os
+import time
+
+import pytest
+
+pytest.importorskip("joblib")
+
+from modules.ML import registry
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, "MODELS_DIR", str(tmp_path))
+    monkeypatch.setattr(registry, "MODEL_REQUESTS_FILE", str(tmp_path / "_model_requests.json"))
+    registry._cache.clear()
+    registry._requests.clear()
+    registry._unflushed[0] = 0
+    yield tmp_path
+    registry._cache.clear()
+    registry._requests.clear()
+
+
+def test_cache_hit_until_files_change(models_dir):
+    registry.save_model_meta("FPT", "gap", {"params": [1.0]}, {"order": [1, 0, 0]})
+    registry._cache.clear()
+
+    m1, meta1 = registry.load_model_meta("FPT", "gap", count=False)
+    m2, _ = registry.load_model_meta("FPT", "gap", count=False)
+    assert m1 is m2 and meta1 == {"order": [1, 0, 0]}
+
+    # Process khác ghi lại file -> version (mtime/size) đổi -> đọc lại đĩa
+    time.sleep(0.01)
+    registry.joblib.dump({"params": [2.0, 3.0]}, os.path.join(str(models_dir), "FPT_gap.pkl"))
+    before = registry.model_cache_stats()["reloads"]
+    m3, _ = registry.load_model_meta("FPT", "gap", count=False)
+    assert m3 == {"params": [2.0, 3.0]}
+    assert registry.model_cache_stats()["reloads"] == before + 1
+
+
+def test_meta_is_a_copy(models_dir):
+    registry.save_model_meta("VCB", "gap", {"p": 1}, {"aic": 1.0})
+    _, meta = registry.load_model_meta("VCB", "gap", count=False)
+    meta["aic"] = 99.0
+    assert registry.load_model_meta("VCB", "gap", count=False)[1]["aic"] == 1.0
+
+
+def test_missing_model_returns_none(models_dir):
+    assert registry.load_model_meta("HPG", "gap", count=False) == (None, None)
+
+
+def _flush_many(n):
+    for _ in range(n):
+        registry._requests["FPT"] += 1
+        registry.flush_request_stats()
+
+
+@pytest.mark.skipif(registry.fcntl is None or "fork" not in mp.get_all_start_methods(),
+                    reason="cần fcntl + fork")
+def test_flush_request_stats_merges_across_processes(models_dir):
+    ctx = mp.get_context("fork")
+    procs = [ctx.Process(target=_flush_many, args=(25,)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+    with open(registry.MODEL_REQUESTS_FILE, encoding="utf-8") as f:
+        assert json.load(f) == {"FPT": 100}
+    assert registry.top_requested(limit=1) == {"FPT": 100}
+
+
+def _save_many(worker, n):
+    for i in range(n):
+        v = worker * 1000 + i
+        registry.save_model_meta("FPT", "gap", {"v": v}, {"v": v})
+
+
+@pytest.mark.skipif(registry.fcntl is None or "fork" not in mp.get_all_start_methods(),
+                    reason="cần fcntl + fork")
+def test_concurrent_saves_never_expose_mismatched_pair(models_dir):
+    registry.save_model_meta("FPT", "gap", {"v": -1}, {"v": -1})
+    ctx = mp.get_context("fork")
+    procs = [ctx.Process(target=_save_many, args=(w, 30)) for w in range(3)]
+    for p in procs:
+        p.start()
+    while any(p.is_alive() for p in procs):
+        registry._cache.clear()
+        model, meta = registry.load_model_meta("FPT", "gap", count=False)
+        assert model["v"] == meta["v"]
+    for p in procs:
+        p.join(30)
+        assert p.exitcode == 0
+    assert not [f for f in os.listdir(str(models_dir)) if f.endswith(".tmp")]
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("dotenv")
+
+from modules.utils import services
+from modules.utils.services import ServiceRegistry
+
+
+def test_failed_service_backs_off_before_retry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(services.time, "time", lambda: now[0])
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("download failed")
+        return "ok"
+
+    reg = ServiceRegistry()
+    svc = reg.register("sentiment", factory)
+
+    assert not svc
+    # Trong thời gian chờ: không chạy lại factory
+    assert not svc and not svc
+    with pytest.raises(RuntimeError):
+        reg.get("sentiment")
+    assert len(calls) == 1
+
+    now[0] += services.SERVICE_RETRY_SEC + 1
+    assert not svc
+    assert len(calls) == 2
+    # Lỗi liên tiếp -> chờ gấp đôi
+    now[0] += services.SERVICE_RETRY_SEC + 1
+    assert not svc and len(calls) == 2
+    now[0] += services.SERVICE_RETRY_SEC
+    assert svc and len(calls) == 3
+    assert reg.readiness("sentiment")["sentiment"]["state"] == "ready"
+
+
+def test_warmup_ignores_backoff():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        raise RuntimeError("boom")
+
+    reg = ServiceRegistry()
+    reg.register("qdrant", factory)
+    reg.warmup("qdrant")
+    out = reg.warmup("qdrant")
+    assert len(calls) == 2
+    assert out["qdrant"]["state"] == "error" and out["qdrant"]["retry_in_sec"] > 0
@@ -0,0 +1,89 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from modules.utils.tick_resample import resample_ticks_multi, split_by_symbol, synthetic_ticks
+
+DAY = "2025-01-06"
+
+
+def _ticks(rows):
+    """rows: [(symbol, "HH:MM:SS", price, volume)] trong ngày DAY."""
+    return pd.DataFrame({
+        "symbol": [r[0] for r in rows],
+        "time": pd.to_datetime([f"{DAY} {r[1]}" for r in rows]),
+        "price": [float(r[2]) for r in rows],
+        "volume": [float(r[3]) for r in rows],
+    })
+
+
+def _bar(bars, symbol, hhmm):
+    row = bars[(bars["symbol"] == symbol) & (bars["time"] == pd.Timestamp(f"{DAY} {hhmm}"))]
+    assert len(row) == 1, f"thiếu nến {symbol} {hhmm}"
+    return row.iloc[0]
+
+
+def test_lunch_and_atc_ticks_fold_into_session_end_bars():
+    bars = resample_ticks_multi(_ticks([
+        ("FPT", "11:25:10", 100, 1),
+        ("FPT", "11:30:00", 102, 5),   # khớp đúng 11:30:00
+        ("FPT", "12:10:00", 101, 2),   # thoả thuận giờ nghỉ trưa
+        ("FPT", "14:40:00", 103, 1),
+        ("FPT", "14:45:00", 105, 7),   # ATC
+    ]), "5m")
+
+    assert list(bars["time"].dt.strftime("%H:%M")) == ["11:25", "14:40"]
+    am = _bar(bars, "FPT", "11:25")
+    assert (am["open"], am["high"], am["low"], am["close"], am["volume"]) == (100, 102, 100, 101, 8)
+    pm = _bar(bars, "FPT", "14:40")
+    assert (pm["open"], pm["close"], pm["volume"]) == (103, 105, 8)
+
+
+def test_pre_open_ticks_clamped_into_first_bar():
+    bars = resample_ticks_multi(_ticks([
+        ("VCB", "08:45:00", 90, 3),
+        ("VCB", "09:00:00", 91, 1),
+        ("VCB", "09:04:59", 92, 1),
+    ]), "5m")
+
+    assert len(bars) == 1
+    first = _bar(bars, "VCB", "09:00")
+    assert (first["open"], first["close"], first["volume"]) == (90, 92, 5)
+
+
+def test_45m_bins_anchor_at_afternoon_open():
+    bars = resample_ticks_multi(_ticks([
+        ("HPG", "10:29:00", 10, 1),    # 09:45 -> 10:30
+        ("HPG", "10:31:00", 11, 1),    # 10:30 -> 11:15
+        ("HPG", "13:00:00", 12, 1),    # phiên chiều neo 13:00, không nối tiếp lưới buổi sáng
+        ("HPG", "13:44:00", 13, 1),
+        ("HPG", "13:46:00", 14, 1),
+    ]), "45m")
+
+    assert list(bars["time"].dt.strftime("%H:%M")) == ["09:45", "10:30", "13:00", "13:45"]
+    assert _bar(bars, "HPG", "13:00")["close"] == 13
+
+
+def test_bins_do_not_cross_symbol_boundaries():
+    bars = resample_ticks_multi(_ticks([
+        ("AAA", "09:01:00", 1, 1),
+        ("AAA", "09:02:00", 2, 1),
+        ("BBB", "09:03:00", 50, 4),    # cùng nến 09:00 nhưng khác mã
+        ("BBB", "09:04:00", 51, 4),
+    ]), "5m")
+
+    assert list(bars["symbol"]) == ["AAA", "BBB"]
+    a, b = _bar(bars, "AAA", "09:00"), _bar(bars, "BBB", "09:00")
+    assert (a["open"], a["close"], a["volume"]) == (1, 2, 2)
+    assert (b["open"], b["close"], b["volume"]) == (50, 51, 8)
+    assert sorted(split_by_symbol(bars)) == ["AAA", "BBB"]
+
+
+def test_unsorted_input_matches_sorted():
+    ticks = synthetic_ticks(n_symbols=5, ticks_per_symbol=400, day=DAY, seed=1)
+    shuffled = ticks.sample(frac=1.0, random_state=7).reset_index(drop=True)
+
+    for iv in ("1m", "5m", "45m"):
+        ref = resample_ticks_multi(ticks, iv)
+        out = resample_ticks_multi(shuffled, iv)
+        pd.testing.assert_frame_equal(out, ref)
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from modules.utils.ttl_cache import TTLCache
+
+
+def test_single_flight_coalesces_concurrent_misses():
+    calls = []
+    gate = threading.Event()
+
+    @TTLCache(ttl_seconds=60)
+    def slow(x):
+        calls.append(x)
+        gate.wait(2)
+        return x * 2
+
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(slow(3))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join(2)
+
+    assert out == [6] * 8
+    assert calls == [3]
+    stats = slow.cache_stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 7
+
+
+def test_errors_are_not_cached():
+    n = {"calls": 0}
+
+    @TTLCache(ttl_seconds=60)
+    def flaky():
+        n["calls"] += 1
+        if n["calls"] == 1:
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    try:
+        flaky()
+    except RuntimeError:
+        pass
+    assert flaky() == "ok"
+    assert n["calls"] == 2
+
+
+def test_lru_eviction():
+    @TTLCache(ttl_seconds=60, max_size=2)
+    def ident(x):
+        return x
+
+    ident(1), ident(2), ident(1), ident(3)
+    assert ident.cache.lookup(("ident", (2,), frozenset()))[1] == "miss"
+    assert ident.cache.lookup(("ident", (1,), frozenset()))[1] == "fresh"
+    assert ident.cache_stats()["evictions"] == 1
+
+
+def test_stale_while_revalidate_single_refresh():
+    calls = []
+    gate = threading.Event()
+
+    @TTLCache(ttl_seconds=0.05, stale_ttl_seconds=5)
+    def price():
+        calls.append(1)
+        if len(calls) > 1:
+            gate.wait(2)
+        return len(calls)
+
+    assert price() == 1
+    time.sleep(0.1)
+    # Entry stale: trả ngay giá trị cũ, chỉ 1 refresh nền dù gọi nhiều lần
+    assert [price() for _ in range(5)] == [1] * 5
+    key = ("price", (), frozenset())
+    # Refresh nền đã đăng ký flight -> load() cùng key chờ chung, không gọi upstream lần nữa
+    waiter = []
+    t = threading.Thread(target=lambda: waiter.append(price.cache.load(key, lambda: -1)))
+    t.start()
+    time.sleep(0.05)
+    gate.set()
+    t.join(2)
+
+    assert waiter == [2]
+    assert len(calls) == 2
+    assert price() == 2
+    assert price.cache_stats()["refreshes"] == 1
+
+
+def test_load_after_flight_finished_reuses_fresh_entry():
+    # Thread lookup() miss, leader ghi xong + gỡ flight trước khi thread này vào load()
+    calls = []
+
+    @TTLCache(ttl_seconds=60)
+    def f(x):
+        calls.append(x)
+        return x * 2
+
+    assert f(3) == 6
+    assert f.cache.load((f.__name__, (3,), frozenset()), lambda: f.__wrapped__(3)) == 6
+    assert calls == [3]
+
+
+def test_ttl_for_skips_or_shortens_per_result():
+    calls = []
+
+    @TTLCache(ttl_seconds=60, ttl_for=lambda v: 0 if v == "error" else (0.05 if v == "partial" else 60))
+    def f(x):
+        calls.append(x)
+        return x
+
+    f("error"), f("error")
+    assert calls == ["error", "error"]   # kết quả lỗi không cache
+
+    f("partial"), f("partial")
+    assert calls.count("partial") == 1
+    time.sleep(0.08)
+    f("partial")
+    assert calls.count("partial") == 2   # ttl ngắn đã hết
+
+    f("ok"), f("ok")
+    assert calls.count("ok") == 1
@@ -8,15 +8,35 @@ import time
 # Thêm folder gốc vào path (để import modules.*)
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
+from modules.api.stock_api import price_board
 from modules.core.graph import build_graph
 from modules.core.state import GlobalState
-from modules.utils.services import redis_services
+from modules.ML.registry import model_cache_stats, warmup_models
+from modules.utils.services import redis_services, registry
+from modules.utils.ttl_cache import ttl_cache_stats
+from modules.utils.source_health import source_health_stats
 
 # UI CONFIG
 st.set_page_config(page_title="Chatbot AI", layout="wide")
 st.title("🤖 Chatbot AI")
 
-graph = build_graph()
+# Các service mà graph chat cần (không load sentiment – chỉ ingestion dùng)
+UI_SERVICES = ("redis", "qdrant", "embedder", "reranker", "llm")
+
+
+@st.cache_resource(show_spinner="Đang khởi tạo mô hình...")
+def _init_graph():
+    """Build graph + warmup service 1 lần / process (cache_resource dùng chung giữa các session)."""
+    t0 = time.perf_counter()
+    readiness = registry.warmup(*UI_SERVICES)
+    g = build_graph()
+    print(f"[UI] Cold start: {time.perf_counter() - t0:.3f}s | {readiness}")
+    # Nạp sẵn model gap của các mã hay được hỏi (thread nền)
+    warmup_models()
+    return g
+
+
+graph = _init_graph()
 
 # Session init
 if "chat_history" not in st.session_state:
@@ -45,6 +65,19 @@ with st.sidebar:
             st.error(f"Lỗi khi xóa dữ liệu: {str(e)}")
 
 
+    with st.expander("🩺 Trạng thái service"):
+        st.json(registry.readiness())
+
+    with st.expander("🗄️ Cache dữ liệu thị trường"):
+        st.json(ttl_cache_stats())
+        st.caption("Model dự báo đã nạp trong process")
+        st.json(model_cache_stats())
+
+    with st.expander("📡 Sức khoẻ nguồn dữ liệu (VCI/TCBS/MSN)"):
+        st.json(source_health_stats())
+        st.caption("Snapshot bảng giá (poller nền)")
+        st.json(price_board.stats())
+
     if st.button("🔍 Debug Redis Keys"):
         try:
             all_keys = list(redis_services.client.scan_iter("*"))
@@ -105,6 +138,9 @@ def display_history():
         with st.chat_message(role):
             st.markdown(content)
             if role == "assistant":
+                timing = msg.get("timing")
+                if timing:
+                    st.caption(f"⏱️ TTFT {timing.get('ttft_sec')}s · tổng {timing.get('total_sec')}s")
                 render_sources(msg.get("sources"))
 
 display_history()
@@ -133,44 +169,63 @@ if user_input := st.chat_input("💬 Nhập tin nhắn của bạn..."):
     )
 
     with st.chat_message("assistant"):
-        with st.spinner("Đang tạo câu trả lời..."):
+        placeholder = st.empty()
+        placeholder.markdown("⏳ _Đang tạo câu trả lời..._")
+        try:
+            final_state, streamed = {}, ""
+            # messages: chunk token từ response_node; values: state đầy đủ sau mỗi node
+            for mode, payload in graph.stream(state, stream_mode=["messages", "values"]):
+                if mode == "values":
+                    final_state = payload
+                    continue
+                chunk, meta = payload
+                if meta.get("langgraph_node") != "response_node":
+                    continue
+                piece = getattr(chunk, "content", "")
+                if isinstance(piece, str) and piece:
+                    streamed += piece
+                    placeholder.markdown(streamed + "▌")
+
+            # Câu trả lời cuối (đã qua regex hậu xử lý) thay cho bản stream thô
+            response = final_state.get("final_answer") or "❌ Xin lỗi, không có câu trả lời."
+            placeholder.markdown(response)
+
+            sources = []
+            for doc in final_state.get("retrieved_docs") or []:
+                sources.append({
+                    "title": doc.get("title", ""),
+                    "url": doc.get("url", ""),
+                    "time": doc.get("time", ""),
+                    "score": doc.get("score", None),
+                })
+
+            assistant_msg = {"role": "assistant", "content": response}
+            if sources:
+                assistant_msg["sources"] = sources
+            debug = final_state.get("debug_info") or {}
+            if debug.get("llm_total_sec") is not None:
+                assistant_msg["timing"] = {
+                    "ttft_sec": debug.get("llm_ttft_sec"),
+                    "total_sec": debug.get("llm_total_sec"),
+                }
+
+            st.session_state.chat_history.append(assistant_msg)
+            render_sources(sources)
+
+            # Lưu cache
             try:
-                state = graph.invoke(state)
-                response = state.get("final_answer", "❌ Xin lỗi, không có câu trả lời.")
-
-                sources = []
-                if getattr(state, "retrieved_docs", None):
-                    for doc in state.retrieved_docs:
-                        sources.append({
-                            "title": doc.get("title", ""),
-                            "url": doc.get("url", ""),
-                            "time": doc.get("time", ""),
-                            "score": doc.get("score", None),
-                        })
-
-                assistant_msg = {"role": "assistant", "content": response}
-                if sources:
-                    assistant_msg["sources"] = sources
-
-                st.session_state.chat_history.append(assistant_msg)
-
-                # Hiển thị output + nguồn
-                st.markdown(response)
-                render_sources(sources)
-
-                # Lưu cache
-                try:
-                    redis_services.client.set(
-                        key,
-                        json.dumps(st.session_state.chat_history, ensure_ascii=False),
-                        ex=3600
-                    )
-                except Exception as e:
-                    st.warning(f"Không thể lưu vào Redis: {str(e)}")
-
+                redis_services.client.set(
+                    key,
+                    json.dumps(st.session_state.chat_history, ensure_ascii=False),
+                    ex=3600
+                )
             except Exception as e:
-                st.error(f"Lỗi khi xử lý: {str(e)}")
-                error_msg = {"role": "assistant", "content": f"❌ Lỗi: {str(e)}"}
-                st.session_state.chat_history.append(error_msg)
+                st.warning(f"Không thể lưu vào Redis: {str(e)}")
+
+        except Exception as e:
+            placeholder.empty()
+            st.error(f"Lỗi khi xử lý: {str(e)}")
+            error_msg = {"role": "assistant", "content": f"❌ Lỗi: {str(e)}"}
+            st.session_state.chat_history.append(error_msg)
 
     st.rerun()